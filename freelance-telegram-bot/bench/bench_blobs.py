@@ -0,0 +1,149 @@
+"""
+Размер базы истории и скорость страницы истории: тексты прямо в history
+(схема версии 2) против сжатых тел в blobs с превью (версия 3).
+
+Данные похожи на настоящие: резюме и вакансии по 1-3 тыс. символов,
+ответы по 3-6 тыс.; часть записей - повторные генерации с тем же вводом.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_blobs --rows 20000 --users 1000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench.utils import percentile
+from blobs import make_preview, store_texts
+from migrations import migrate, schema_version
+
+WORDS = (
+    'опыт работы разработка проект клиент задача команда python backend api база данных '
+    'оптимизация сервис пользователь интерфейс дизайн тестирование требования сроки бюджет '
+    'результат навыки ответственность коммуникация аналитика продажи маркетинг контент текст '
+    'вакансия компания удаленно график условия зарплата портфолио отзыв рекомендации'
+).split()
+
+OLD_PAGE_QUERY = '''
+    SELECT * FROM history
+    WHERE user_id = ?
+    ORDER BY date DESC, id DESC
+    LIMIT 11
+'''
+NEW_PAGE_QUERY = '''
+    SELECT id, user_id, date, request_type, input_preview, output_preview FROM history
+    WHERE user_id = ?
+    ORDER BY date DESC, id DESC
+    LIMIT 11
+'''
+
+
+def make_text(rng, low, high):
+    words = []
+    length = 0
+    target = rng.randint(low, high)
+    while length < target:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def make_rows(rows, users, seed=1):
+    rng = random.Random(seed)
+    started_at = datetime(2024, 1, 1)
+    result = []
+    last_input = {}
+    for i in range(rows):
+        user_id = rng.randrange(users)
+        # Каждая третья запись - "Сгенерировать заново" с тем же вводом
+        if user_id in last_input and rng.random() < 0.33:
+            input_data = last_input[user_id]
+        else:
+            input_data = make_text(rng, 1000, 3000)
+            last_input[user_id] = input_data
+        date = (started_at + timedelta(seconds=i * 7)).isoformat()
+        result.append((user_id, date, 'resume_improvement', input_data, make_text(rng, 3000, 6000)))
+    return result
+
+
+def db_size(conn, path):
+    conn.execute('VACUUM')
+    return os.path.getsize(path)
+
+
+def measure_pages(conn, query, users, queries, truncate):
+    latencies = []
+    rng = random.Random(2)
+    for _ in range(queries):
+        started = time.perf_counter()
+        rows = conn.execute(query, (rng.randrange(users),)).fetchall()
+        if truncate:
+            # Так show_history обрезал тексты до появления превью
+            rows = [(*row[:4], make_preview(row[4]), make_preview(row[5])) for row in rows]
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def report(name, size, latencies):
+    print(f'{name}: {size / 1024 / 1024:.1f} MB, страница истории '
+          f'p50 {percentile(latencies, 50) * 1000:.2f} ms, p99 {percentile(latencies, 99) * 1000:.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows, args.users)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'history.db')
+        conn = sqlite3.connect(path, isolation_level=None)
+        migrate(conn, target=2)
+
+        started = time.perf_counter()
+        conn.execute('BEGIN')
+        conn.executemany('''
+            INSERT INTO history (user_id, date, request_type, input_data, output_data)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        conn.execute('COMMIT')
+        print(f'запись {args.rows} строк в схему 2: {time.perf_counter() - started:.2f} s')
+        report('схема 2 (тексты в history)', db_size(conn, path),
+               measure_pages(conn, OLD_PAGE_QUERY, args.users, args.queries, truncate=True))
+
+        started = time.perf_counter()
+        migrate(conn)
+        print(f'миграция до версии {schema_version(conn)}: {time.perf_counter() - started:.2f} s')
+        report('схема 3 (blobs + превью)', db_size(conn, path),
+               measure_pages(conn, NEW_PAGE_QUERY, args.users, args.queries, truncate=False))
+        conn.close()
+
+        # Запись в новую схему - как в HistoryStore._write_batch
+        path = os.path.join(tmp, 'fresh.db')
+        conn = sqlite3.connect(path, isolation_level=None)
+        migrate(conn)
+        started = time.perf_counter()
+        conn.execute('BEGIN')
+        hashes = store_texts(conn, [text for row in rows for text in (row[3], row[4])])
+        conn.executemany('''
+            INSERT INTO history (user_id, date, request_type, input_preview, output_preview, input_hash, output_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [(*row[:3], make_preview(row[3]), make_preview(row[4]), hashes[2 * i], hashes[2 * i + 1])
+              for i, row in enumerate(rows)])
+        conn.execute('COMMIT')
+        print(f'запись {args.rows} строк в схему 3 (с хэшированием и сжатием): '
+              f'{time.perf_counter() - started:.2f} s')
+        blobs, = conn.execute('SELECT COUNT(*) FROM blobs').fetchone()
+        print(f'тел в blobs: {blobs} на {2 * args.rows} текстов')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
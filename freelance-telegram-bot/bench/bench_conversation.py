@@ -0,0 +1,79 @@
+"""
+Память диалога в режиме "Задать вопрос": полная переписка в каждом
+запросе против окна conversation.py с бюджетом токенов.
+
+Один пользователь задает подряд turns вопросов; мок GigaChat тратит
+время на каждый токен промпта и ответа. Печатает размер запроса и
+задержку на разных шагах диалога и сколько места окно занимает в FSM.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_conversation --turns 30
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from bench.bench_blobs import make_text
+from bench.mock_gigachat import MockGigaChat
+from conversation import append_turn, build_messages
+from gigachat import GigaChatClient
+from prompts import FREE_QUESTION
+
+CHECKPOINTS = (1, 5, 10, 25, 50, 100)
+
+
+async def run(client, mock, questions, windowed):
+    window = []
+    full = []
+    results = {}
+    for turn, question in enumerate(questions, 1):
+        if windowed:
+            request = build_messages(window, question)
+        else:
+            request = full + [{'role': 'user', 'content': question}]
+
+        prompt_before = mock.prompt_tokens
+        started = time.perf_counter()
+        answer = await client.complete(request, max_tokens=FREE_QUESTION.max_tokens)
+        latency = time.perf_counter() - started
+
+        window = append_turn(window, question, answer)
+        full = request + [{'role': 'assistant', 'content': answer}]
+        if turn in CHECKPOINTS or turn == len(questions):
+            stored = window if windowed else [[m['role'], m['content']] for m in full]
+            results[turn] = (mock.prompt_tokens - prompt_before, latency,
+                             len(json.dumps(stored, ensure_ascii=False).encode()))
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=30)
+    parser.add_argument('--answer-tokens', type=int, default=500, help='длина ответа модели')
+    parser.add_argument('--prompt-token-ms', type=float, default=0.1, help='время на токен промпта, мс')
+    parser.add_argument('--completion-token-ms', type=float, default=0.2, help='время на токен ответа, мс')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    questions = [make_text(rng, 50, 400) for _ in range(args.turns)]
+
+    mock = await MockGigaChat(
+        auth_latency=0.0, chat_latency=0.02, answer_tokens=args.answer_tokens,
+        prompt_token_latency=args.prompt_token_ms / 1000, completion_token_latency=args.completion_token_ms / 1000,
+    ).start()
+    client = GigaChatClient('id', 'secret', auth_url=mock.auth_url, chat_url=mock.chat_url)
+    try:
+        for name, windowed in (('вся переписка', False), ('окно conversation.py', True)):
+            print(f'{name}:')
+            for turn, (tokens, latency, stored) in (await run(client, mock, questions, windowed)).items():
+                print(f'  вопрос {turn:>3}: промпт {tokens:6} токенов, {latency * 1000:6.0f} ms, '
+                      f'в FSM {stored / 1024:6.1f} KB')
+    finally:
+        await client.close()
+        await mock.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,64 @@
+"""
+Вывод длинных ответов: разбиение на сообщения и доставка через мок Bot API.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_delivery --size 9000 --replies 200
+"""
+import argparse
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from bench.mock_telegram import MockTelegram
+from bench.utils import percentile
+from streaming import MESSAGE_LIMIT, deliver, split_message
+
+
+def make_text(size):
+    paragraph = 'Это предложение ответа. ' * 20 + '\n\n'
+    return (paragraph * (size // len(paragraph) + 1))[:size]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=9000, help='длина ответа, символов')
+    parser.add_argument('--replies', type=int, default=200)
+    parser.add_argument('--api-latency', type=float, default=0.02, help='задержка ответа мока Bot API, с')
+    args = parser.parse_args()
+
+    text = make_text(args.size)
+    started = time.perf_counter()
+    for _ in range(1000):
+        parts = split_message(text)
+    per_split = (time.perf_counter() - started) / 1000
+    print(f'split_message({args.size} символов): {len(parts)} частей '
+          f'({", ".join(str(len(part)) for part in parts)}), {per_split * 1e6:.0f} us')
+    assert all(len(part) <= MESSAGE_LIMIT for part in parts)
+
+    mock = await MockTelegram(latency=args.api_latency).start()
+    bot = Bot(token='42:BENCH', session=AiohttpSession(api=TelegramAPIServer.from_base(mock.base_url)))
+
+    latencies = []
+
+    async def reply(user_id):
+        placeholder = await bot.send_message(user_id, '🤔 Генерирую текст...')
+        started = time.perf_counter()
+        await deliver(placeholder, text, edit=True)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(reply(user_id) for user_id in range(1, args.replies + 1)))
+    elapsed = time.perf_counter() - started
+    print(f'{args.replies} ответов по {len(parts)} сообщения за {elapsed:.2f} с: '
+          f'доставка p50 {percentile(latencies, 50) * 1000:.0f} ms, p99 {percentile(latencies, 99) * 1000:.0f} ms, '
+          f'вызовов API {sum(mock.calls.values())}')
+
+    await bot.session.close()
+    await mock.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,189 @@
+"""
+Выгрузка истории (/export) и офлайн-статистика (history_stats.py) на
+большой базе: время и пиковая память Python (tracemalloc).
+
+1. Выгрузка всей истории одного пользователя: HistoryStore.export (пачки
+   по --chunk записей с keyset-курсором) против одного запроса с
+   fetchall() и записью файла после него.
+2. Статистика по дням и типам: history_stats.collect (один проход курсором)
+   против fetchall() всей таблицы и подсчета в Python и против GROUP BY
+   с COUNT(DISTINCT user_id) в SQLite.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_export --rows 20000 --users 4
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import history_stats
+from bench.bench_blobs import make_rows
+from blobs import decode_blob, make_preview, store_texts
+from export import ExportWriter
+from history import HistoryStore
+from migrations import migrate
+
+REQUEST_TYPES = ('vacancy_response', 'short_text', 'resume_improvement', 'free_question')
+
+FETCHALL_EXPORT = '''
+    SELECT h.id, h.date, h.request_type, i.codec, i.data, o.codec, o.data
+    FROM history h
+    JOIN blobs i ON i.hash = h.input_hash
+    JOIN blobs o ON o.hash = h.output_hash
+    WHERE h.user_id = ?
+    ORDER BY h.date, h.id
+'''
+GROUP_BY_STATS = '''
+    SELECT substr(date, 1, 10) AS day, request_type, COUNT(*), COUNT(DISTINCT user_id)
+    FROM history
+    GROUP BY day, request_type
+'''
+
+
+def measure(func, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def report(name, elapsed, peak):
+    print(f'  {name:38} {elapsed:6.2f} s, пик памяти {peak / 1024 / 1024:7.1f} MB')
+
+
+def fill(path, rows, users, days):
+    rows = make_rows(rows, users)
+    rng = random.Random(3)
+    started_at = datetime(2024, 1, 1)
+    step = days * 24 * 60 * 60 / len(rows)
+    rows = [(user_id, (started_at + timedelta(seconds=i * step)).isoformat(), rng.choice(REQUEST_TYPES),
+             input_data, output_data)
+            for i, (user_id, _, _, input_data, output_data) in enumerate(rows)]
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    migrate(conn)
+    conn.execute('BEGIN')
+    hashes = store_texts(conn, [text for row in rows for text in (row[3], row[4])])
+    conn.executemany('''
+        INSERT INTO history (user_id, date, request_type, input_preview, output_preview, input_hash, output_hash)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(*row[:3], make_preview(row[3]), make_preview(row[4]), hashes[2 * i], hashes[2 * i + 1])
+          for i, row in enumerate(rows)])
+    conn.execute('COMMIT')
+    conn.close()
+
+
+def export_chunked(path, user_id, out_path, chunk):
+    async def run():
+        store = HistoryStore(path)
+        await store.init()
+        try:
+            with open(out_path, 'w', encoding='utf-8', newline='') as out:
+                return await store.export(user_id, ExportWriter(out), chunk)
+        finally:
+            await store.close()
+    return asyncio.run(run())
+
+
+def export_fetchall(path, user_id, out_path):
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute(FETCHALL_EXPORT, (user_id,)).fetchall()
+        records = [(record_id, date, request_type, decode_blob(ic, idata), decode_blob(oc, odata))
+                   for record_id, date, request_type, ic, idata, oc, odata in rows]
+    finally:
+        conn.close()
+    with open(out_path, 'w', encoding='utf-8', newline='') as out:
+        writer = ExportWriter(out)
+        for record in records:
+            writer.write(record)
+    return writer.count
+
+
+def stats_single_pass(path, with_bytes):
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        days, _ = history_stats.collect(conn, with_bytes)
+    finally:
+        conn.close()
+    return {day: (stats.requests, stats.users) for day, stats in days.items()}
+
+
+def stats_fetchall(path):
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute('SELECT date, request_type, user_id FROM history').fetchall()
+    finally:
+        conn.close()
+    requests, users = {}, {}
+    for date, _, user_id in rows:
+        requests[date[:10]] = requests.get(date[:10], 0) + 1
+        users.setdefault(date[:10], set()).add(user_id)
+    return {day: (requests[day], len(users[day])) for day in requests}
+
+
+def stats_group_by(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(GROUP_BY_STATS).fetchall()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=4, help='мало пользователей - длинная история у каждого')
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--chunk', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'history.db')
+        started = time.perf_counter()
+        fill(path, args.rows, args.users, args.days)
+        print(f'база: {args.rows} записей, {os.path.getsize(path) / 1024 / 1024:.0f} MB, '
+              f'заполнена за {time.perf_counter() - started:.1f} s')
+
+        conn = sqlite3.connect(path)
+        user_id, user_rows = conn.execute(
+            'SELECT user_id, COUNT(*) FROM history GROUP BY user_id ORDER BY 2 DESC LIMIT 1'
+        ).fetchone()
+        for name, query in (('выгрузка', FETCHALL_EXPORT), ('статистика', 'SELECT date FROM history ORDER BY id')):
+            plan = conn.execute(f'EXPLAIN QUERY PLAN {query}', (user_id,) if '?' in query else ()).fetchall()
+            print(f'план ({name}): ' + '; '.join(row[-1] for row in plan))
+        conn.close()
+
+        print(f'выгрузка истории пользователя {user_id} ({user_rows} записей):')
+        out_path = os.path.join(tmp, 'export.jsonl')
+        count, elapsed, peak = measure(export_chunked, path, user_id, out_path, args.chunk)
+        report(f'пачками по {args.chunk}', elapsed, peak)
+        size = os.path.getsize(out_path)
+        fetched, elapsed, peak = measure(export_fetchall, path, user_id, out_path)
+        report('fetchall()', elapsed, peak)
+        assert count == fetched == user_rows and os.path.getsize(out_path) == size
+        print(f'  файл: {size / 1024 / 1024:.1f} MB')
+
+        print('статистика по всей базе:')
+        single, elapsed, peak = measure(stats_single_pass, path, False)
+        report('один проход курсором', elapsed, peak)
+        _, elapsed, peak = measure(stats_single_pass, path, True)
+        report('один проход курсором, --bytes', elapsed, peak)
+        naive, elapsed, peak = measure(stats_fetchall, path)
+        report('fetchall() и подсчет в Python', elapsed, peak)
+        assert single == naive
+        _, elapsed, peak = measure(stats_group_by, path)
+        report('GROUP BY в SQLite', elapsed, peak)
+
+
+if __name__ == '__main__':
+    main()
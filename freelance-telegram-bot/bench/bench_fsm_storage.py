@@ -0,0 +1,61 @@
+"""
+Память и задержка FSM-хранилищ при росте числа пользователей.
+
+Каждый пользователь проходит шаги диалога (set_state, update_data, get_data).
+Сравниваются MemoryStorage и SQLiteStorage с ограниченным LRU-кэшем.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_fsm_storage --users 50000 --cache-size 5000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from bench.utils import percentile
+from fsm_storage import SQLiteStorage
+
+
+async def run(name, storage, users):
+    latencies = []
+    tracemalloc.start()
+    for user_id in range(users):
+        key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+        started = time.perf_counter()
+        await storage.set_state(key, 'ShortText:waiting_for_request')
+        await storage.update_data(key, {'last_prompt': 'Напиши пост ' * 20, 'last_type': 'short_text'})
+        await storage.get_data(key)
+        latencies.append(time.perf_counter() - started)
+
+        if (user_id + 1) % (users // 5) == 0:
+            current, _ = tracemalloc.get_traced_memory()
+            print(f'  {name}: {user_id + 1} пользователей, память {current / 1024 / 1024:.1f} MB')
+    tracemalloc.stop()
+
+    print(f'{name}: шаг диалога p50 {percentile(latencies, 50) * 1000:.3f} ms, '
+          f'p99 {percentile(latencies, 99) * 1000:.3f} ms')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--cache-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    await run('MemoryStorage', MemoryStorage(), args.users)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SQLiteStorage(os.path.join(tmp, 'fsm.db'), cache_size=args.cache_size)
+        try:
+            await run('SQLiteStorage', storage, args.users)
+        finally:
+            await storage.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
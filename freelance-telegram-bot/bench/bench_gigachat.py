@@ -0,0 +1,106 @@
+"""
+Сравнение старого способа обращения к GigaChat (новая сессия и OAuth на каждый
+запрос) с долгоживущим GigaChatClient.
+
+Дополнительно сравнивает время до первого видимого текста при обычной
+и потоковой генерации.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_gigachat --requests 500 --concurrency 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+import uuid
+
+import aiohttp
+
+from bench.mock_gigachat import MockGigaChat
+from bench.utils import percentile
+from gigachat import GigaChatClient
+
+
+async def old_generate(mock, prompt):
+    # Повторяет прежнюю реализацию generate_with_gigachat
+    async with aiohttp.ClientSession() as session:
+        async with session.post(
+                mock.auth_url,
+                headers={'RqUID': str(uuid.uuid4())},
+                data={'scope': 'GIGACHAT_API_PERS'},
+                auth=aiohttp.BasicAuth('id', 'secret'),
+        ) as auth_response:
+            access_token = (await auth_response.json())['access_token']
+        async with session.post(
+                mock.chat_url,
+                headers={'Authorization': f'Bearer {access_token}'},
+                json={'model': 'GigaChat', 'messages': [{'role': 'user', 'content': prompt}]},
+        ) as chat_response:
+            result = await chat_response.json()
+            return result['choices'][0]['message']['content']
+
+
+async def run(name, mock, call, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            await call(f'Запрос {i}')
+            latencies.append(time.perf_counter() - started)
+
+    auth_before = mock.auth_calls
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    total = time.perf_counter() - started
+
+    print(f'{name}:')
+    print(f'  auth calls: {mock.auth_calls - auth_before}')
+    print(f'  p50: {percentile(latencies, 50) * 1000:.1f} ms')
+    print(f'  p99: {percentile(latencies, 99) * 1000:.1f} ms')
+    print(f'  mean: {statistics.mean(latencies) * 1000:.1f} ms')
+    print(f'  throughput: {requests / total:.1f} req/s')
+
+
+async def first_text_latency(client, streaming, requests):
+    latencies = []
+    for i in range(requests):
+        started = time.perf_counter()
+        if streaming:
+            first = None
+            async for _ in client.stream(f'Запрос {i}'):
+                if first is None:
+                    first = time.perf_counter() - started
+            latencies.append(first)
+        else:
+            await client.complete(f'Запрос {i}')
+            latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--auth-latency', type=float, default=0.05)
+    parser.add_argument('--chat-latency', type=float, default=0.1)
+    args = parser.parse_args()
+
+    mock = await MockGigaChat(auth_latency=args.auth_latency, chat_latency=args.chat_latency).start()
+    client = GigaChatClient('id', 'secret', auth_url=mock.auth_url, chat_url=mock.chat_url)
+    try:
+        await run('Сессия и OAuth на каждый запрос', mock,
+                  lambda prompt: old_generate(mock, prompt), args.requests, args.concurrency)
+        await run('GigaChatClient', mock, client.complete, args.requests, args.concurrency)
+
+        for name, streaming in (('Обычный запрос', False), ('Потоковый запрос', True)):
+            latencies = await first_text_latency(client, streaming, 20)
+            print(f'{name}: время до первого текста p50 {percentile(latencies, 50) * 1000:.1f} ms')
+    finally:
+        await client.close()
+        await mock.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
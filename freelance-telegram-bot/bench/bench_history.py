@@ -0,0 +1,96 @@
+"""
+Нагрузочный тест записи истории: сотни одновременных пользователей сохраняют
+ответы, а мы измеряем задержку event loop.
+
+Сравниваются прежний способ (sqlite3.connect и commit прямо в event loop),
+HistoryStore с записью каждой строки отдельно и HistoryStore с пачками.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_history --users 300 --writes 10
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+
+from bench.utils import LoopLagMonitor, percentile
+from history import HistoryStore
+from migrations import migrate
+
+
+def old_save_to_history(path, user_id, request_type, input_data, output_data):
+    # Повторяет прежнюю реализацию save_to_history
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO history (user_id, date, request_type, input_data, output_data)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (user_id, datetime.now().isoformat(), request_type, input_data, output_data))
+    conn.commit()
+    conn.close()
+
+
+async def simulate_users(save, users, writes):
+    async def user(user_id):
+        for i in range(writes):
+            # Пользователь "думает" между запросами
+            await asyncio.sleep(random.uniform(0, 0.02))
+            await save(user_id, 'short_text', f'Запрос {i}', 'Ответ ' * 200)
+
+    await asyncio.gather(*(user(user_id) for user_id in range(users)))
+
+
+async def run(name, save, users, writes):
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await simulate_users(save, users, writes)
+    total = time.perf_counter() - started
+    lag = await monitor.stop()
+
+    print(f'{name}:')
+    print(f'  writes/s: {users * writes / total:.1f}')
+    print(f'  event loop lag p50: {percentile(lag, 50) * 1000:.1f} ms')
+    print(f'  event loop lag p99: {percentile(lag, 99) * 1000:.1f} ms')
+    print(f'  event loop lag max: {max(lag) * 1000:.1f} ms')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--writes', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--flush-interval-ms', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        old_path = os.path.join(tmp, 'old.db')
+        # Старый код писал в схему версии 2, где тексты лежали прямо в history
+        migrate(sqlite3.connect(old_path), target=2)
+
+        async def old_save(*row):
+            old_save_to_history(old_path, *row)
+
+        await run('sqlite3.connect в event loop', old_save, args.users, args.writes)
+
+        for name, batch_size in (('HistoryStore без пачек', 1), ('HistoryStore с пачками', args.batch_size)):
+            store = HistoryStore(
+                os.path.join(tmp, f'store_{batch_size}.db'),
+                batch_size=batch_size,
+                flush_interval=args.flush_interval_ms / 1000,
+            )
+            await store.init()
+            try:
+                await run(name, store.add, args.users, args.writes)
+                await store.flush()
+                print(f'  {store.stats()}')
+            finally:
+                await store.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+Задержка запросов к истории на большой таблице до и после миграции
+с составным индексом (user_id, date).
+
+Заполняет временную базу синтетическими записями по схеме версии 1
+(без индекса), измеряет выборку последних записей пользователя и страницу
+keyset-пагинации, затем применяет миграции и повторяет измерения.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_history_index --rows 1000000 --users 10000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench.utils import percentile
+from migrations import migrate, schema_version
+
+LATEST_QUERY = '''
+    SELECT * FROM history
+    WHERE user_id = ?
+    ORDER BY date DESC, id DESC
+    LIMIT 10
+'''
+
+PAGE_QUERY = '''
+    SELECT * FROM history
+    WHERE user_id = ? AND (date, id) < (?, ?)
+    ORDER BY date DESC, id DESC
+    LIMIT 10
+'''
+
+
+def seed(conn, rows, users):
+    started_at = datetime(2024, 1, 1)
+    batch = []
+    for i in range(rows):
+        date = (started_at + timedelta(seconds=i * 7)).isoformat()
+        batch.append((random.randrange(users), date, 'short_text', f'Запрос {i}', 'Ответ ' * 50))
+        if len(batch) == 10000:
+            conn.executemany('''
+                INSERT INTO history (user_id, date, request_type, input_data, output_data)
+                VALUES (?, ?, ?, ?, ?)
+            ''', batch)
+            batch = []
+    if batch:
+        conn.executemany('''
+            INSERT INTO history (user_id, date, request_type, input_data, output_data)
+            VALUES (?, ?, ?, ?, ?)
+        ''', batch)
+    conn.commit()
+
+
+def measure(conn, users, queries):
+    latest = []
+    page = []
+    for _ in range(queries):
+        user_id = random.randrange(users)
+
+        started = time.perf_counter()
+        rows = conn.execute(LATEST_QUERY, (user_id,)).fetchall()
+        latest.append(time.perf_counter() - started)
+
+        if rows:
+            started = time.perf_counter()
+            conn.execute(PAGE_QUERY, (user_id, rows[-1][2], rows[-1][0])).fetchall()
+            page.append(time.perf_counter() - started)
+
+    return latest, page
+
+
+def report(name, latest, page):
+    print(f'{name}:')
+    print(f'  последние 10: p50 {percentile(latest, 50) * 1000:.2f} ms, p99 {percentile(latest, 99) * 1000:.2f} ms')
+    if page:
+        print(f'  следующая страница: p50 {percentile(page, 50) * 1000:.2f} ms, '
+              f'p99 {percentile(page, 99) * 1000:.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'history.db'))
+        migrate(conn, target=1)
+
+        started = time.perf_counter()
+        seed(conn, args.rows, args.users)
+        print(f'Заполнено {args.rows} строк за {time.perf_counter() - started:.1f} s')
+
+        report('Схема версии 1 (без индекса)', *measure(conn, args.users, args.queries))
+
+        started = time.perf_counter()
+        # Сравниваем только добавление индекса (версия 2)
+        migrate(conn, target=2)
+        print(f'Миграция до версии {schema_version(conn)} заняла {time.perf_counter() - started:.1f} s')
+
+        report(f'Схема версии {schema_version(conn)}', *measure(conn, args.users, args.queries))
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Фоновые задачи (BACKGROUND_FLOWS): сколько держится обработчик апдейта и
+когда пользователь получает ответ, а также восстановление задач после
+перезапуска.
+
+Бот (python main.py) запускается против моков Telegram Bot API и GigaChat.
+Пользователи одновременно просят улучшить резюме; мок GigaChat отвечает
+через --chat-latency секунд.
+
+1. Обычный режим и фоновый: время до первого ответа бота, время до
+   результата и среднее время обработчика (bot_handler_seconds из /metrics).
+2. Перезапуск: в фоновом режиме бот останавливается, как только принял все
+   запросы, и запускается снова; считаем, сколько результатов дошло.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_jobs --users 50
+"""
+import argparse
+import asyncio
+import os
+import re
+import signal
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from bench.mock_gigachat import MockGigaChat
+from bench.mock_telegram import MockTelegram
+from bench.utils import percentile
+
+METRICS_PORT = 19410
+HANDLER_SUM = re.compile(r'bot_handler_seconds_(sum|count)\{handler="route_flow_step",status="ok"\} (\S+)')
+
+
+def is_result(message):
+    buttons = (message.get('reply_markup') or {}).get('inline_keyboard', [])
+    return message['text'].startswith('❌') or any(
+        button.get('callback_data') == 'regenerate' for row in buttons for button in row
+    )
+
+
+async def start_bot(env):
+    return await asyncio.create_subprocess_exec(
+        sys.executable, 'main.py', env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+
+
+async def handler_seconds():
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f'http://127.0.0.1:{METRICS_PORT}/metrics') as response:
+            values = dict(HANDLER_SUM.findall(await response.text()))
+    return float(values['sum']) / float(values['count'])
+
+
+async def user(telegram, user_id, acks, results):
+    index = await telegram.wait_for(user_id, lambda message: True)
+    started = time.perf_counter()
+    await telegram.push(telegram.make_message_update(user_id, 'Python-разработчик, 5 лет, Django, asyncio ' * 20))
+    index = await telegram.wait_for(user_id, lambda message: True, start=index)
+    acks.append(time.perf_counter() - started)
+    if not is_result(telegram.sent[user_id][index - 1]):
+        await telegram.wait_for(user_id, is_result, start=index, timeout=300)
+    results.append(time.perf_counter() - started)
+
+
+async def run(args, background, restart=False):
+    telegram = await MockTelegram().start()
+    giga = await MockGigaChat(auth_latency=0.0, chat_latency=args.chat_latency).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            BOT_TOKEN='42:BENCH',
+            TELEGRAM_API_URL=telegram.base_url,
+            GIGACHAT_CLIENT_ID='bench',
+            GIGACHAT_CLIENT_SECRET='bench',
+            GIGACHAT_AUTH_URL=giga.auth_url,
+            GIGACHAT_CHAT_URL=giga.chat_url,
+            GIGACHAT_STREAMING='0',
+            MAX_CONCURRENT_GENERATIONS=str(args.concurrency),
+            JOB_WORKERS=str(args.concurrency),
+            JOB_DRAIN_TIMEOUT='0',
+            BACKGROUND_FLOWS='resume_improvement' if background else '',
+            HISTORY_DB_PATH=os.path.join(tmp, 'history.db'),
+            FSM_DB_PATH=os.path.join(tmp, 'fsm.db'),
+            JOBS_DB_PATH=os.path.join(tmp, 'jobs.db'),
+            METRICS_PORT=str(METRICS_PORT),
+        )
+        process = await start_bot(env)
+        for user_id in range(1, args.users + 1):
+            await telegram.push(telegram.make_callback_update(user_id, 'improve_resume'))
+
+        acks, results = [], []
+        users = asyncio.gather(*(user(telegram, user_id, acks, results) for user_id in range(1, args.users + 1)))
+        report = {}
+        if restart:
+            while len(acks) < args.users:
+                await asyncio.sleep(0.05)
+            # SIGINT - обычная остановка polling: начатые задачи прерываются, остальные ждут в базе
+            process.send_signal(signal.SIGINT)
+            await process.wait()
+            report['before_restart'] = len(results)
+            process = await start_bot(env)
+        await users
+        if not restart:
+            report['handler'] = await handler_seconds()
+        report['acks'], report['results'] = acks, results
+        report['duplicates'] = sum(
+            sum(is_result(message) for message in telegram.sent[user_id]) - 1 for user_id in range(1, args.users + 1)
+        )
+
+        process.send_signal(signal.SIGINT)
+        await process.wait()
+    await giga.stop()
+    await telegram.stop()
+    return report
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--chat-latency', type=float, default=2.0, help='время ответа мока GigaChat, с')
+    parser.add_argument('--concurrency', type=int, default=8, help='MAX_CONCURRENT_GENERATIONS и JOB_WORKERS')
+    args = parser.parse_args()
+
+    for name, background in (('обычный режим', False), ('фоновые задачи', True)):
+        report = await run(args, background)
+        print(f'{name}: обработчик в среднем {report["handler"] * 1000:.0f} ms, '
+              f'первый ответ p50 {percentile(report["acks"], 50) * 1000:.0f} ms, '
+              f'результат p50 {percentile(report["results"], 50):.1f} с, p99 {percentile(report["results"], 99):.1f} с')
+
+    report = await run(args, True, restart=True)
+    print(f'перезапуск: до остановки доставлено {report["before_restart"]} из {args.users}, '
+          f'после - {len(report["results"])}, повторов {report["duplicates"]}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,264 @@
+"""
+Нагрузочный тест всего бота: обработчики из main.py против моков Telegram Bot API и GigaChat.
+
+Симулированные пользователи проходят сценарии: отклик на вакансию, короткий
+текст, улучшение резюме, свободный вопрос, история и "Сгенерировать заново".
+Каждый шаг - апдейт в getUpdates и ожидание ответа бота в чат пользователя.
+
+Отчет: апдейты в секунду, задержки шагов от апдейта до ответа (p50/p95/p99),
+задержка event loop, ожидание в очередях SQLite (история и FSM), ошибки.
+С --output результаты пишутся в JSON, чтобы сравнивать прогоны между собой.
+
+Моки работают в том же процессе и event loop, что и бот, поэтому задержка
+loop включает и их работу - цифры годятся для сравнения прогонов, а не как
+абсолютные.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_load --users 2000 --ramp 10 --output load.json
+    python -m bench.bench_load --users 500 --error-rate 0.1 --streaming 0
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import logging
+import os
+import platform
+import random
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from bench.mock_gigachat import MockGigaChat
+from bench.mock_telegram import MockTelegram
+from bench.utils import LoopLagMonitor, percentile
+
+
+# --- чего ждать от бота после шага ---
+
+def any_message(message):
+    return True
+
+
+def generated(message):
+    # Ответ с генерацией заканчивается сообщением с клавиатурой действий или ошибкой
+    if message['text'].startswith('❌'):
+        return True
+    buttons = message['reply_markup'].get('inline_keyboard', [])
+    return any(button.get('callback_data') in ('regenerate', 'rephrase_question')
+               for row in buttons for button in row)
+
+
+def history_page(message):
+    return message['text'].startswith(('📊', '📭'))
+
+
+# --- сценарии: (название шага, апдейт, условие ответа) ---
+
+def text(value):
+    return lambda mock, user_id: mock.make_message_update(user_id, value)
+
+
+def button(data):
+    return lambda mock, user_id: mock.make_callback_update(user_id, data)
+
+
+FLOWS = {
+    'vacancy': [
+        ('vacancy.open', button('response_to_vacancy'), any_message),
+        ('vacancy.description', text('Ищем Python-разработчика для телеграм-бота, удаленно'), any_message),
+        ('vacancy.generate', text('3 года на aiogram и asyncio, делал ботов для магазинов'), generated),
+    ],
+    'short_text': [
+        ('short_text.open', button('short_text'), any_message),
+        ('short_text.generate', text('Пост о запуске нового сервиса доставки'), generated),
+    ],
+    'resume': [
+        ('resume.open', button('improve_resume'), any_message),
+        ('resume.generate', text('Backend-разработчик, Python, Django, PostgreSQL, 4 года опыта'), generated),
+    ],
+    'free_question': [
+        ('free_question.open', button('free_question'), any_message),
+        ('free_question.generate', text('Как оценить стоимость проекта на фрилансе?'), generated),
+    ],
+    'history': [
+        ('history.show', text('/history'), history_page),
+    ],
+    'regenerate': [
+        ('short_text.open', button('short_text'), any_message),
+        ('short_text.generate', text('Объявление о наборе на курс по дизайну'), generated),
+        ('regenerate', button('regenerate'), generated),
+    ],
+}
+
+
+class LoadResult:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.updates = 0
+        self.flows = Counter()
+
+
+async def simulate_user(mock, user_id, flow, result, step_timeout):
+    result.flows[flow] += 1
+    cursor = len(mock.sent.get(user_id, []))
+    for step, make_update, expect in FLOWS[flow]:
+        started = time.perf_counter()
+        await mock.push(make_update(mock, user_id))
+        result.updates += 1
+        try:
+            cursor = await mock.wait_for(user_id, expect, start=cursor, timeout=step_timeout)
+        except TimeoutError:
+            result.errors[f'{step}: timeout'] += 1
+            return
+        result.latencies[step].append(time.perf_counter() - started)
+        if mock.sent[user_id][cursor - 1]['text'].startswith('❌'):
+            result.errors[f'{step}: gigachat error'] += 1
+            return
+
+
+def summarize(samples):
+    if not samples:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'max_ms': max(samples) * 1000,
+    }
+
+
+async def run(args):
+    telegram = await MockTelegram(latency=args.telegram_latency).start()
+    giga = await MockGigaChat(
+        auth_latency=args.gigachat_latency / 2, chat_latency=args.gigachat_latency,
+        error_rate=args.error_rate, max_concurrent=args.gigachat_capacity,
+    ).start()
+    tmp = tempfile.TemporaryDirectory()
+
+    # main читает настройки при импорте, поэтому окружение задаем до него
+    os.environ.update(
+        BOT_TOKEN='42:BENCH',
+        TELEGRAM_API_URL=telegram.base_url,
+        GIGACHAT_CLIENT_ID='bench',
+        GIGACHAT_CLIENT_SECRET='bench',
+        GIGACHAT_AUTH_URL=giga.auth_url,
+        GIGACHAT_CHAT_URL=giga.chat_url,
+        GIGACHAT_STREAMING=str(args.streaming),
+        FSM_STORAGE=args.fsm_storage,
+        FSM_DB_PATH=os.path.join(tmp.name, 'fsm.db'),
+        METRICS_PORT='0',
+        HISTORY_DB_PATH=os.path.join(tmp.name, 'history.db'),
+    )
+    if args.max_concurrent:
+        os.environ['MAX_CONCURRENT_GENERATIONS'] = str(args.max_concurrent)
+    app = importlib.import_module('main')
+    logging.getLogger().setLevel(logging.WARNING)
+    app.create_app()
+
+    # on_startup/on_shutdown вызывает сам start_polling
+    polling = asyncio.create_task(app.dp.start_polling(app.bot, handle_signals=False))
+    result = LoadResult()
+    monitor = LoopLagMonitor()
+    flows = [flow.strip() for flow in args.flows.split(',')]
+    rng = random.Random(args.seed)
+
+    async def user(user_id):
+        # Пользователи приходят равномерно в течение ramp секунд
+        await asyncio.sleep(rng.uniform(0, args.ramp))
+        await simulate_user(telegram, user_id, rng.choice(flows), result, args.step_timeout)
+
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in range(1, args.users + 1)))
+    elapsed = time.perf_counter() - started
+    lag = await monitor.stop()
+
+    await app.dp.stop_polling()
+    await polling
+    tmp.cleanup()
+
+    all_steps = [value for samples in result.latencies.values() for value in samples]
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': vars(args),
+        'elapsed_s': elapsed,
+        'updates': result.updates,
+        'updates_per_s': result.updates / elapsed,
+        'flows': dict(result.flows),
+        'errors': dict(result.errors),
+        'latency': summarize(all_steps),
+        'steps': {step: summarize(samples) for step, samples in sorted(result.latencies.items())},
+        'loop_lag': summarize(lag),
+        'sqlite': {
+            'history': app.history_store.stats(),
+            'fsm': app.storage.stats() if hasattr(app.storage, 'stats') else None,
+        },
+        'scheduler': app.generation_scheduler.stats(),
+        'gigachat': {
+            'auth_calls': giga.auth_calls,
+            'chat_calls': giga.chat_calls,
+            'faults': giga.faults,
+            'rejected': giga.rejected,
+        },
+        'telegram_calls': dict(telegram.calls),
+    }
+
+    await giga.stop()
+    await telegram.stop()
+    return report
+
+
+def print_report(report):
+    print(f"{report['updates']} апдейтов за {report['elapsed_s']:.1f} с: {report['updates_per_s']:.0f} updates/s")
+    latency = report['latency']
+    if latency['count']:
+        print(f"шаг (апдейт -> ответ): p50 {latency['p50_ms']:.0f} ms, p95 {latency['p95_ms']:.0f} ms, "
+              f"p99 {latency['p99_ms']:.0f} ms")
+    for step, stats in report['steps'].items():
+        print(f"  {step:<24} n={stats['count']:<5} p50 {stats['p50_ms']:.0f} ms, p99 {stats['p99_ms']:.0f} ms")
+    lag = report['loop_lag']
+    if lag['count']:
+        print(f"задержка event loop: p50 {lag['p50_ms']:.1f} ms, p99 {lag['p99_ms']:.1f} ms, "
+              f"max {lag['max_ms']:.1f} ms")
+    history = report['sqlite']['history']
+    print(f"SQLite история: ожидание max {history['max_db_wait_ms']:.1f} ms, "
+          f"среднее {history['avg_db_wait_ms']:.2f} ms, запись пачки max {history['max_flush_ms']:.1f} ms")
+    fsm = report['sqlite']['fsm']
+    if fsm:
+        print(f"SQLite FSM: ожидание max {fsm['max_db_wait_ms']:.1f} ms, среднее {fsm['avg_db_wait_ms']:.2f} ms")
+    print(f"ошибки: {report['errors'] or 'нет'}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--ramp', type=float, default=10.0, help='за сколько секунд приходят все пользователи')
+    parser.add_argument('--flows', default=','.join(FLOWS), help='сценарии через запятую')
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help='задержка мока Bot API, с')
+    parser.add_argument('--gigachat-latency', type=float, default=0.3, help='время генерации мока GigaChat, с')
+    parser.add_argument('--gigachat-capacity', type=int, default=None, help='сверх скольких запросов мок отвечает 429')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов GigaChat с ошибкой 503')
+    parser.add_argument('--max-concurrent', type=int, default=None,
+                        help='MAX_CONCURRENT_GENERATIONS бота (по умолчанию как в main.py)')
+    parser.add_argument('--streaming', type=int, choices=(0, 1), default=1)
+    parser.add_argument('--fsm-storage', choices=('sqlite', 'memory'), default='sqlite')
+    parser.add_argument('--step-timeout', type=float, default=120.0)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='файл для результатов в JSON')
+    args = parser.parse_args()
+
+    report = await run(args)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'результаты записаны в {args.output}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
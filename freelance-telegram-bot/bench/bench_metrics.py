@@ -0,0 +1,53 @@
+"""
+Накладные расходы метрик: observe гистограммы и middleware вокруг обработчика.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_metrics --calls 200000
+"""
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+from metrics import HandlerMetricsMiddleware, Histogram, REGISTRY
+
+
+async def noop_handler(event, data):
+    return None
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+
+    histogram = Histogram('bench_seconds', 'bench', ('handler', 'status'))
+    started = time.perf_counter()
+    for i in range(args.calls):
+        histogram.observe(0.0123, handler='process_regenerate', status='ok')
+    per_call = (time.perf_counter() - started) / args.calls
+    print(f'Histogram.observe: {per_call * 1e9:.0f} ns')
+
+    event = SimpleNamespace(from_user=SimpleNamespace(id=1))
+    data = {'handler': SimpleNamespace(callback=noop_handler)}
+
+    started = time.perf_counter()
+    for _ in range(args.calls):
+        await noop_handler(event, data)
+    bare = (time.perf_counter() - started) / args.calls
+
+    middleware = HandlerMetricsMiddleware()
+    started = time.perf_counter()
+    for _ in range(args.calls):
+        await middleware(noop_handler, event, data)
+    wrapped = (time.perf_counter() - started) / args.calls
+    print(f'обработчик: без метрик {bare * 1e9:.0f} ns, с middleware {wrapped * 1e9:.0f} ns '
+          f'(+{(wrapped - bare) * 1e6:.2f} us на апдейт)')
+
+    started = time.perf_counter()
+    body = REGISTRY.render()
+    print(f'/metrics: {len(body)} байт за {(time.perf_counter() - started) * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,152 @@
+"""
+Сборка промптов: прежние f-строки с max_tokens=2000 против шаблонов
+prompts.py с бюджетом токенов и пределом ответа по типу запроса.
+
+Корпус похож на настоящий ввод: обычные резюме и вакансии и тексты,
+скопированные из PDF (лишние пробелы и пустые строки, до 4096 символов
+в сообщении). Мок GigaChat тратит время на каждый токен промпта и
+ответа, а без ограничения пишет ответ на answer_tokens токенов.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_prompts --per-type 20
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from bench.bench_blobs import make_text
+from bench.mock_gigachat import MockGigaChat
+from bench.utils import percentile
+from gigachat import GigaChatClient
+from prompts import (
+    DEFAULT_MAX_TOKENS,
+    FREE_QUESTION,
+    RESUME_IMPROVEMENT,
+    SHORT_TEXT,
+    VACANCY_RESPONSE,
+    estimate_tokens,
+)
+
+TELEGRAM_TEXT_LIMIT = 4096
+
+
+def old_vacancy_prompt(vacancy, skills):
+    return f"""
+    Напиши профессиональный отклик на вакансию.
+
+    Описание вакансии: {vacancy}
+
+    Мои навыки и опыт: {skills}
+
+    Сделай отклик:
+    - Убедительным и профессиональным
+    - Подчеркивающим соответствие моих навыков требованиям вакансии
+    - Не слишком длинным (до 200 слов)
+    - С предложением обсудить детали
+    """
+
+
+def old_resume_prompt(resume):
+    return f"""
+    Улучши этот текст резюме, сделай его более профессиональным и привлекательным для работодателя:
+
+    {resume}
+
+    Предложи улучшенную версию и кратко объясни, что было изменено.
+    """
+
+
+def old_short_text_prompt(request):
+    return f"Напиши текст по следующему запросу: {request}. Сделай его качественным и соответствующим цели."
+
+
+def pasted(rng, text):
+    # Так выглядит текст, скопированный из PDF: строки с отступами и пустыми строками между ними
+    words = text.split()
+    lines = [' '.join(words[i:i + 8]) for i in range(0, len(words), 8)]
+    return '\n\n\n'.join('      ' + line + '   ' for line in lines)[:TELEGRAM_TEXT_LIMIT]
+
+
+def make_corpus(per_type, seed=1):
+    """
+    Возвращает [(тип, старый промпт, новый промпт, max_tokens)], половина ввода - из PDF
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(per_type):
+        fix = (lambda text: pasted(rng, text)) if i % 2 else (lambda text: text)
+
+        vacancy, skills = fix(make_text(rng, 800, 4000)), fix(make_text(rng, 300, 4000))
+        corpus.append(('vacancy_response', old_vacancy_prompt(vacancy, skills),
+                       VACANCY_RESPONSE.build(vacancy=vacancy, skills=skills), VACANCY_RESPONSE.max_tokens))
+
+        resume = fix(make_text(rng, 1500, 4000))
+        corpus.append(('resume_improvement', old_resume_prompt(resume),
+                       RESUME_IMPROVEMENT.build(resume=resume), RESUME_IMPROVEMENT.max_tokens))
+
+        request = fix(make_text(rng, 50, 600))
+        corpus.append(('short_text', old_short_text_prompt(request),
+                       SHORT_TEXT.build(request=request), SHORT_TEXT.max_tokens))
+
+        question = fix(make_text(rng, 30, 1500))
+        corpus.append(('free_question', question, FREE_QUESTION.build(question=question), FREE_QUESTION.max_tokens))
+    return corpus
+
+
+async def run(client, mock, requests):
+    latencies = {}
+    prompt_before, completion_before = mock.prompt_tokens, mock.completion_tokens
+
+    async def one(request_type, prompt, max_tokens):
+        started = time.perf_counter()
+        await client.complete(prompt, max_tokens=max_tokens)
+        latencies.setdefault(request_type, []).append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(*request) for request in requests))
+    return latencies, mock.prompt_tokens - prompt_before, mock.completion_tokens - completion_before
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--per-type', type=int, default=20, help='запросов каждого типа')
+    parser.add_argument('--answer-tokens', type=int, default=1200, help='длина ответа модели без ограничения')
+    parser.add_argument('--prompt-token-ms', type=float, default=0.1, help='время на токен промпта, мс')
+    parser.add_argument('--completion-token-ms', type=float, default=1.0, help='время на токен ответа, мс')
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.per_type)
+
+    rng = random.Random(2)
+    vacancy, skills = pasted(rng, make_text(rng, 4000, 4000)), pasted(rng, make_text(rng, 4000, 4000))
+    started = time.perf_counter()
+    for _ in range(1000):
+        VACANCY_RESPONSE.build(vacancy=vacancy, skills=skills)
+    print(f'сборка отклика из двух сообщений по 4096 символов: {(time.perf_counter() - started) * 1000:.0f} us')
+
+    mock = await MockGigaChat(
+        auth_latency=0.0, chat_latency=0.05, answer_tokens=args.answer_tokens,
+        prompt_token_latency=args.prompt_token_ms / 1000, completion_token_latency=args.completion_token_ms / 1000,
+    ).start()
+    client = GigaChatClient('id', 'secret', auth_url=mock.auth_url, chat_url=mock.chat_url)
+    try:
+        old = await run(client, mock, [(kind, old, DEFAULT_MAX_TOKENS) for kind, old, _, _ in corpus])
+        new = await run(client, mock, [(kind, new, max_tokens) for kind, _, new, max_tokens in corpus])
+    finally:
+        await client.close()
+        await mock.stop()
+
+    for name, (latencies, prompt_tokens, completion_tokens) in (('f-строки, max_tokens=2000', old),
+                                                                 ('prompts.py', new)):
+        print(f'{name}: токенов на запрос - промпт {prompt_tokens / len(corpus):.0f}, '
+              f'ответ {completion_tokens / len(corpus):.0f}')
+        for request_type, values in latencies.items():
+            print(f'  {request_type:<20} p50 {percentile(values, 50) * 1000:6.0f} ms, '
+                  f'p99 {percentile(values, 99) * 1000:6.0f} ms')
+
+    estimated = sum(estimate_tokens(new) for _, _, new, _ in corpus) / len(corpus)
+    print(f'оценка prompts.py: {estimated:.0f} токенов промпта на запрос (мок считает 4 символа на токен)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""
+Ограничение частоты: сколько нажатий "Сгенерировать заново" доходит до
+GigaChat у спамера, сколько стоит проверка и сколько памяти занимают ведра.
+
+Время моделируется, поэтому бенчмарк работает мгновенно.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_ratelimit --users 100000
+"""
+import argparse
+import time
+import tracemalloc
+
+from ratelimit import TokenBucketLimiter, parse_rate
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--limit', default='3/30', help='лимит на "Сгенерировать заново"')
+    args = parser.parse_args()
+
+    # 1. Спамер жмет кнопку 10 раз в секунду в течение минуты
+    clock = FakeClock()
+    limiter = TokenBucketLimiter({'regenerate': parse_rate(args.limit)}, clock=clock)
+    presses = allowed = warnings = 0
+    while clock.now < 60:
+        ok, warn = limiter.hit(1, 'regenerate')
+        presses += 1
+        allowed += ok
+        warnings += warn
+        clock.now += 0.1
+    print(f'спамер: {presses} нажатий за 60 с, до GigaChat дошло {allowed}, предупреждений {warnings}')
+
+    # 2. Память и скорость на много пользователей
+    clock = FakeClock()
+    limiter = TokenBucketLimiter({
+        'regenerate': parse_rate(args.limit),
+        'message': parse_rate('20/10'),
+    }, clock=clock)
+    tracemalloc.start()
+    for user_id in range(args.users):
+        limiter.hit(user_id, 'message')
+        limiter.hit(user_id, 'regenerate')
+        clock.now += 0.0001
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Скорость меряем отдельно: tracemalloc сильно замедляет выделение памяти
+    started = time.perf_counter()
+    for user_id in range(args.users):
+        limiter.hit(user_id, 'message')
+        limiter.hit(user_id, 'regenerate')
+        clock.now += 0.0001
+    elapsed = time.perf_counter() - started
+    print(f'{args.users} пользователей: {len(limiter)} ведер, {current / len(limiter):.0f} байт на ведро, '
+          f'{elapsed / (2 * args.users) * 1e9:.0f} ns на проверку')
+
+    # 3. Пользователи ушли: через время полного наполнения ведра удаляются сами
+    clock.now += 60
+    limiter.hit(0, 'message')
+    print(f'через минуту простоя: {len(limiter)} ведер, удалено {limiter.evicted}')
+
+
+if __name__ == '__main__':
+    main()
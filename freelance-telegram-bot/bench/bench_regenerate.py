@@ -0,0 +1,86 @@
+"""
+"Сгенерировать заново" с запасными вариантами: сколько пользователь ждет
+нажатие и сколько токенов уходит впустую.
+
+Каждый пользователь нажимает кнопку от 1 до --max-presses раз (чаще
+один-два) с паузой на чтение. Варианты готовятся как в process_regenerate:
+K штук за раз (параметром n или параллельными запросами), неиспользованные
+остаются в "FSM", а число лишних вариантов ограничено бюджетом.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_regenerate --users 50
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from bench.mock_gigachat import MockGigaChat
+from bench.utils import percentile
+from gigachat import GigaChatClient
+from ratelimit import TokenBucketLimiter, parse_rate
+
+MODES = (
+    ('по одному варианту', 1, True),
+    ('K=3, параметр n', 3, True),
+    ('K=3, параллельные запросы', 3, False),
+)
+
+
+async def simulate_user(client, presses, variants, budget, user_id, waits, think_time):
+    prepared = []
+    for _ in range(presses):
+        started = time.perf_counter()
+        if prepared:
+            prepared.pop(0)
+        else:
+            extra = 0
+            while extra < variants - 1 and budget.hit(user_id, 'variant')[0]:
+                extra += 1
+            responses = await client.complete_many('Напиши пост про фриланс', extra + 1, max_tokens=800)
+            prepared = responses[1:]
+        waits.append(time.perf_counter() - started)
+        await asyncio.sleep(think_time)
+    return len(prepared)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--max-presses', type=int, default=6)
+    parser.add_argument('--budget', default='10/3600', help='лишних вариантов на пользователя')
+    parser.add_argument('--think-time', type=float, default=0.2, help='пауза между нажатиями, с')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    # Большинство нажимает один-два раза, немногие перебирают много вариантов
+    presses = [min(args.max_presses, int(rng.expovariate(0.6)) + 1) for _ in range(args.users)]
+    print(f'{args.users} пользователей, {sum(presses)} нажатий')
+
+    for name, variants, supports_n in MODES:
+        mock = await MockGigaChat(
+            auth_latency=0.0, chat_latency=0.05, answer_tokens=400,
+            prompt_token_latency=0.0001, completion_token_latency=0.002, supports_n=supports_n,
+        ).start()
+        client = GigaChatClient('id', 'secret', auth_url=mock.auth_url, chat_url=mock.chat_url,
+                                supports_n=supports_n)
+        budget = TokenBucketLimiter({'variant': parse_rate(args.budget)})
+        waits = []
+        try:
+            unused = await asyncio.gather(*(
+                simulate_user(client, count, variants, budget, user_id, waits, args.think_time)
+                for user_id, count in enumerate(presses)
+            ))
+        finally:
+            await client.close()
+            await mock.stop()
+        instant = sum(wait < 0.05 for wait in waits) / len(waits)
+        print(f'{name}:')
+        print(f'  ожидание нажатия: среднее {sum(waits) / len(waits) * 1000:.0f} ms, '
+              f'p90 {percentile(waits, 90) * 1000:.0f} ms, мгновенно {instant:.0%}')
+        print(f'  запросов {mock.chat_calls}, токенов ответа {mock.completion_tokens}, '
+              f'неиспользованных вариантов {sum(unused)}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Поведение GigaChatClient на моке с внедрением сбоев.
+
+Сценарии:
+  1. часть запросов получает 503 - повторы с backoff их спасают;
+  2. часть запросов зависает - срабатывает таймаут чтения;
+  3. API полностью лежит - circuit breaker размыкается и отвечает сразу;
+  4. API поднялся - после reset_timeout пробный запрос замыкает цепь.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_resilience
+"""
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+from bench.mock_gigachat import MockGigaChat
+from bench.utils import percentile
+from gigachat import GigaChatClient, GigaChatError
+
+
+async def run(name, client, requests, concurrency=10):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = Counter()
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await client.complete(f'Запрос {i}')
+            except GigaChatError as e:
+                errors[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    retries_before = client.retries
+    await asyncio.gather(*(one(i) for i in range(requests)))
+
+    print(f'{name}:')
+    print(f'  успешно: {requests - sum(errors.values())} из {requests}, ошибки: {dict(errors)}')
+    print(f'  повторов: {client.retries - retries_before}, состояние breaker: {client.breaker.state}')
+    print(f'  p50 {percentile(latencies, 50) * 1000:.0f} ms, p99 {percentile(latencies, 99) * 1000:.0f} ms')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--error-rate', type=float, default=0.3)
+    args = parser.parse_args()
+
+    mock = await MockGigaChat(chat_latency=0.05, hang_time=5).start()
+    client = GigaChatClient(
+        'id', 'secret', auth_url=mock.auth_url, chat_url=mock.chat_url,
+        read_timeout=0.5, total_timeout=2, max_retries=3, backoff_base=0.05,
+        breaker_threshold=5, breaker_reset_timeout=1,
+    )
+    try:
+        mock.error_rate = args.error_rate
+        await run(f'{args.error_rate:.0%} ответов 503', client, args.requests)
+        mock.error_rate = 0
+
+        mock.hang_rate = 0.1
+        await run('10% запросов зависают', client, args.requests)
+        mock.hang_rate = 0
+
+        mock.down = True
+        await run('API недоступен', client, args.requests)
+
+        mock.down = False
+        await asyncio.sleep(client.breaker.reset_timeout)
+        await run('API восстановился: пробный запрос', client, 1)
+        await run('API восстановился', client, args.requests)
+    finally:
+        await client.close()
+        await mock.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
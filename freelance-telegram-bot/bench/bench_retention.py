@@ -0,0 +1,125 @@
+"""
+Срок хранения истории: как меняются размер базы и время запросов истории
+по мере того, как в нее пишутся новые записи, с очисткой (лимит записей на
+пользователя, перенос в архив) и без нее.
+
+После каждого раунда записи меряются страница истории (get_history_page)
+и поиск (search) у случайных пользователей. В базе с очисткой сразу после
+записи запускается apply_retention, и пока он идет, те же запросы истории
+выполняются параллельно - видно, насколько очистка их задерживает.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_retention --rounds 5 --rows 10000 --users 500 --cap 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from bench.bench_blobs import make_text
+from bench.utils import percentile
+from history import HistoryStore
+
+SEARCH_WORDS = ('python', 'проект', 'опыт', 'клиент', 'дизайн', 'бюджет')
+
+
+def make_round(rng, start, rows, users):
+    return [
+        (rng.randrange(1, users + 1), (start + timedelta(seconds=i)).isoformat(), 'short_text',
+         make_text(rng, 200, 800), make_text(rng, 500, 1500))
+        for i in range(rows)
+    ]
+
+
+async def write(store, rows):
+    for start in range(0, len(rows), store.batch_size):
+        await store._db.run(store._write_batch, rows[start:start + store.batch_size])
+
+
+async def query_latencies(store, users, queries, seed):
+    rng = random.Random(seed)
+    pages, searches = [], []
+    for _ in range(queries):
+        user_id = rng.randrange(1, users + 1)
+        started = time.perf_counter()
+        await store.get_history_page(user_id, 10)
+        pages.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await store.search(user_id, rng.choice(SEARCH_WORDS), 5)
+        searches.append(time.perf_counter() - started)
+    return pages, searches
+
+
+async def during_retention(store, users):
+    """
+    apply_retention и параллельно запросы истории, пока он не закончится
+    """
+    retention = asyncio.ensure_future(store.apply_retention())
+    rng = random.Random(7)
+    latencies = []
+    while not retention.done():
+        started = time.perf_counter()
+        await store.get_history_page(rng.randrange(1, users + 1), 10)
+        latencies.append(time.perf_counter() - started)
+    return await retention, latencies
+
+
+def db_stats(store):
+    # В потоке хранилища: соединение принадлежит ему
+    conn = store._db.connect()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    rows, = conn.execute('SELECT COUNT(*) FROM history').fetchone()
+    return rows, os.path.getsize(store.path)
+
+
+def ms(values, q):
+    return percentile(values, q) * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--rows', type=int, default=10000, help='записей за раунд')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--cap', type=int, default=20, help='HISTORY_MAX_ROWS_PER_USER для базы с очисткой')
+    parser.add_argument('--queries', type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = HistoryStore(os.path.join(tmp, 'plain.db'), batch_size=500)
+        retained = HistoryStore(os.path.join(tmp, 'retained.db'), batch_size=500, max_rows_per_user=args.cap,
+                                archive_path=os.path.join(tmp, 'archive.db'))
+        await plain.init()
+        await retained.init()
+
+        rng = random.Random(1)
+        start = datetime(2024, 1, 1)
+        for round_number in range(1, args.rounds + 1):
+            rows = make_round(rng, start, args.rows, args.users)
+            start += timedelta(seconds=args.rows)
+            await write(plain, rows)
+            await write(retained, rows)
+
+            started = time.perf_counter()
+            retired, during = await during_retention(retained, args.users)
+            retention_time = time.perf_counter() - started
+
+            print(f'раунд {round_number}, записано всего {round_number * args.rows}:')
+            for name, store in (('без очистки', plain), ('с очисткой', retained)):
+                pages, searches = await query_latencies(store, args.users, args.queries, round_number)
+                rows_count, size = await store._db.run(db_stats, store)
+                print(f'  {name:12} записей {rows_count:7}, {size / 1024 / 1024:6.1f} MB, '
+                      f'страница p50 {ms(pages, 50):5.2f} ms p99 {ms(pages, 99):5.2f} ms, '
+                      f'поиск p50 {ms(searches, 50):6.2f} ms p99 {ms(searches, 99):6.2f} ms')
+            print(f'  очистка: убрано {retired} записей за {retention_time:.2f} s, страница во время очистки '
+                  f'p50 {ms(during, 50):.2f} ms p99 {ms(during, 99):.2f} ms, max {max(during) * 1000:.1f} ms')
+
+        await plain.close()
+        await retained.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,101 @@
+"""
+Стоимость разбора апдейта в aiogram: цепочка фильтров вида
+lambda c: c.data == '...' против одного фильтра с поиском в словаре,
+как в main.py (CALLBACK_ROUTES, TEXT_ROUTES).
+
+Для каждого числа кнопок собирается диспетчер с пустыми обработчиками и
+через dp.feed_update прогоняются нажатия случайных кнопок и сообщения
+без совпадений (они проверяются всеми фильтрами до последнего хендлера).
+Запросов к Bot API нет, меряется только маршрутизация.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_routing --buttons 12 50 200
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Update
+
+
+async def handled(*args, **kwargs):
+    pass
+
+
+def linear_router(names):
+    router = Router()
+    for name in names:
+        router.callback_query.register(handled, lambda c, name=name: c.data == name)
+        router.message.register(handled, lambda message, name=name: message.text == name)
+    router.message.register(handled)
+    return router
+
+
+def table_router(names):
+    routes = {name: handled for name in names}
+    router = Router()
+
+    def route(event):
+        found = routes.get(getattr(event, 'data', None) or getattr(event, 'text', None))
+        return {'route': found} if found is not None else False
+
+    router.callback_query.register(handled, route)
+    router.message.register(handled, route)
+    router.message.register(handled)
+    return router
+
+
+def make_updates(names, count, seed=1):
+    rng = random.Random(seed)
+    user = {'id': 1, 'is_bot': False, 'first_name': 'User'}
+    chat = {'id': 1, 'type': 'private'}
+    date = int(datetime.now().timestamp())
+    updates = []
+    for i in range(count):
+        if i % 2:
+            event = {'callback_query': {
+                'id': str(i), 'from': user, 'chat_instance': '1', 'data': rng.choice(names),
+                'message': {'message_id': 1, 'date': date, 'chat': chat, 'text': 'меню'},
+            }}
+        else:
+            event = {'message': {'message_id': i, 'date': date, 'chat': chat, 'from': user, 'text': f'текст {i}'}}
+        updates.append(Update.model_validate({'update_id': i, **event}))
+    return updates
+
+
+async def measure(router, bot, updates):
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(router)
+    for update in updates[:100]:
+        await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / len(updates)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--buttons', type=int, nargs='+', default=[12, 50, 200])
+    parser.add_argument('--updates', type=int, default=5000)
+    args = parser.parse_args()
+
+    bot = Bot(token='42:BENCH')
+    try:
+        for buttons in args.buttons:
+            names = [f'action_{i}' for i in range(buttons)]
+            updates = make_updates(names, args.updates)
+            linear = await measure(linear_router(names), bot, updates)
+            table = await measure(table_router(names), bot, updates)
+            print(f'кнопок {buttons:4}: цепочка фильтров {linear * 1e6:6.0f} us/апдейт, '
+                  f'словарь {table * 1e6:6.0f} us/апдейт')
+    finally:
+        await bot.session.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
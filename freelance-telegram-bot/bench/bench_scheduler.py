@@ -0,0 +1,83 @@
+"""
+Всплеск запросов к GigaChat: много обычных пользователей и один, который
+часто нажимает "Сгенерировать заново". Мок отвечает 429 сверх своей
+пропускной способности.
+
+Сравнивается прямой вызов клиента и вызов через GenerationScheduler.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_scheduler --users 200 --spam 100
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from bench.mock_gigachat import MockGigaChat
+from bench.utils import percentile
+from gigachat import GigaChatClient, GigaChatError
+from scheduler import GenerationScheduler
+
+
+async def burst(call, users, spam):
+    latencies = []
+    failures = 0
+
+    async def one(user_id, prompt):
+        nonlocal failures
+        await asyncio.sleep(random.uniform(0, 0.5))
+        started = time.perf_counter()
+        try:
+            await call(user_id, prompt)
+        except GigaChatError:
+            failures += 1
+            return
+        if user_id != 0:
+            latencies.append(time.perf_counter() - started)
+
+    jobs = [one(user_id, f'Вопрос пользователя {user_id}') for user_id in range(1, users + 1)]
+    # Пользователь 0 жмет кнопку много раз подряд с одним и тем же промптом
+    jobs += [one(0, 'Перегенерируй мой отклик') for _ in range(spam)]
+    await asyncio.gather(*jobs)
+    return latencies, failures
+
+
+def report(name, latencies, failures, total):
+    print(f'{name}:')
+    print(f'  ошибок: {failures} из {total}')
+    if latencies:
+        print(f'  обычные пользователи: p50 {percentile(latencies, 50) * 1000:.0f} ms, '
+              f'p99 {percentile(latencies, 99) * 1000:.0f} ms')
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--spam', type=int, default=100)
+    parser.add_argument('--api-capacity', type=int, default=10)
+    parser.add_argument('--max-concurrent', type=int, default=8)
+    args = parser.parse_args()
+
+    mock = await MockGigaChat(chat_latency=0.2, max_concurrent=args.api_capacity).start()
+    client = GigaChatClient('id', 'secret', auth_url=mock.auth_url, chat_url=mock.chat_url)
+    total = args.users + args.spam
+    try:
+        async def direct(user_id, prompt):
+            await client.complete(prompt)
+
+        report('Без планировщика', *await burst(direct, args.users, args.spam), total)
+
+        scheduler = GenerationScheduler(args.max_concurrent)
+
+        async def scheduled(user_id, prompt):
+            await scheduler.run(user_id, prompt, lambda: client.complete(prompt))
+
+        report('GenerationScheduler', *await burst(scheduled, args.users, args.spam), total)
+        print(f'  {scheduler.stats()}')
+    finally:
+        await client.close()
+        await mock.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
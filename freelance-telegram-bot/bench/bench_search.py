@@ -0,0 +1,155 @@
+"""
+Поиск по истории (/search): индекс FTS5 против перебора с LIKE.
+
+LIKE меряется на схеме 2, где тексты еще лежали прямо в history, и на
+схеме 3, где для перебора тела приходится распаковывать из blobs.
+У пользователя тысячи записей; запросы - частое слово, два слова и
+редкое слово, которое встречается в 1% записей.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_search --rows 20000 --users 10
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from bench.bench_blobs import make_rows
+from bench.utils import percentile
+from blobs import decode_blob
+from fulltext import make_match_query
+from migrations import migrate
+
+PAGE_SIZE = 5
+RARE_WORD = 'kubernetes'
+QUERIES = {
+    'частое слово': 'python',
+    'два слова': 'оптимизация сервис',
+    'редкое слово': RARE_WORD,
+}
+
+LIKE_QUERY = '''
+    SELECT id, user_id, date, request_type, substr(input_data, 1, 100), substr(output_data, 1, 100)
+    FROM history
+    WHERE user_id = ? AND {conditions}
+    ORDER BY date DESC, id DESC
+    LIMIT ?
+'''
+SCAN_QUERY = '''
+    SELECT h.id, h.user_id, h.date, h.request_type, h.input_preview, h.output_preview,
+           i.codec, i.data, o.codec, o.data
+    FROM history h
+    JOIN blobs i ON i.hash = h.input_hash
+    JOIN blobs o ON o.hash = h.output_hash
+    WHERE h.user_id = ?
+    ORDER BY h.date DESC, h.id DESC
+'''
+FTS_QUERY = '''
+    SELECT h.id, h.user_id, h.date, h.request_type, h.input_preview, h.output_preview
+    FROM (
+        SELECT rowid, rank FROM history_fts
+        WHERE history_fts MATCH ?
+        ORDER BY rank, rowid DESC
+        LIMIT ?
+    ) AS found
+    JOIN history h ON h.id = found.rowid
+    ORDER BY found.rank, h.id DESC
+'''
+
+
+def add_rare_word(rows, seed=3):
+    rng = random.Random(seed)
+    return [
+        (*row[:3], f'{row[3]} {RARE_WORD}' if rng.random() < 0.01 else row[3], row[4])
+        for row in rows
+    ]
+
+
+def like_search(conn, user_id, query):
+    words = query.lower().split()
+    conditions = ' AND '.join(['(input_data LIKE ? OR output_data LIKE ?)'] * len(words))
+    params = [value for word in words for value in (f'%{word}%', f'%{word}%')]
+    return conn.execute(LIKE_QUERY.format(conditions=conditions), (user_id, *params, PAGE_SIZE)).fetchall()
+
+
+def scan_search(conn, user_id, query):
+    words = query.lower().split()
+    found = []
+    for row in conn.execute(SCAN_QUERY, (user_id,)):
+        text = (decode_blob(row[6], row[7]) + '\n' + decode_blob(row[8], row[9])).lower()
+        if all(word in text for word in words):
+            found.append(row[:6])
+            if len(found) == PAGE_SIZE:
+                break
+    return found
+
+
+def fts_search(conn, user_id, query):
+    return conn.execute(FTS_QUERY, (make_match_query(user_id, query), PAGE_SIZE)).fetchall()
+
+
+def measure(search, conn, users, query, repeats):
+    latencies = []
+    found = 0
+    rng = random.Random(4)
+    for _ in range(repeats):
+        started = time.perf_counter()
+        found += len(search(conn, rng.randrange(users), query))
+        latencies.append(time.perf_counter() - started)
+    return latencies, found / repeats
+
+
+def report(name, latencies, found):
+    print(f'  {name:<22} p50 {percentile(latencies, 50) * 1000:7.2f} ms, '
+          f'p99 {percentile(latencies, 99) * 1000:7.2f} ms, найдено {found:.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    rows = add_rare_word(make_rows(args.rows, args.users))
+    print(f'{args.rows} записей, {args.rows // args.users} на пользователя')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'history.db')
+        conn = sqlite3.connect(path, isolation_level=None)
+        migrate(conn, target=2)
+        conn.execute('BEGIN')
+        conn.executemany('''
+            INSERT INTO history (user_id, date, request_type, input_data, output_data)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        conn.execute('COMMIT')
+        like_results = {
+            name: measure(like_search, conn, args.users, query, args.repeats) for name, query in QUERIES.items()
+        }
+
+        migrate(conn, target=3)
+        scan_results = {
+            name: measure(scan_search, conn, args.users, query, args.repeats) for name, query in QUERIES.items()
+        }
+
+        conn.execute('VACUUM')
+        size_before = os.path.getsize(path)
+        started = time.perf_counter()
+        migrate(conn)
+        print(f'построение индекса (миграция 4): {time.perf_counter() - started:.2f} s')
+        conn.execute('VACUUM')
+        print(f'размер базы: {size_before / 1024 / 1024:.1f} MB -> {os.path.getsize(path) / 1024 / 1024:.1f} MB')
+
+        for name, query in QUERIES.items():
+            print(f'{name} ({query}):')
+            report('LIKE, схема 2', *like_results[name])
+            report('перебор blobs, схема 3', *scan_results[name])
+            report('FTS5', *measure(fts_search, conn, args.users, query, args.repeats))
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Пропускная способность многопроцессного режима (sharding.py) в зависимости от числа воркеров.
+
+Бот запускается отдельным процессом против моков Telegram Bot API и GigaChat.
+Каждый пользователь нажимает "Короткий текст" и отправляет запрос, бот
+отвечает заглушкой и готовым текстом. Время считается после прогрева, когда
+все воркеры уже импортировали main и ответили на /start.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_sharding --users 500 --workers 1 2 4
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from bench.mock_gigachat import MockGigaChat
+from bench.mock_telegram import MockTelegram
+
+# Сообщений бота на одного пользователя: приглашение, заглушка, ответ
+MESSAGES_PER_USER = 3
+
+
+async def run(workers, users, chat_latency):
+    telegram = await MockTelegram().start()
+    giga = await MockGigaChat(auth_latency=0.0, chat_latency=chat_latency).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            BOT_TOKEN='42:BENCH',
+            BOT_WORKERS=str(workers),
+            TELEGRAM_API_URL=telegram.base_url,
+            GIGACHAT_CLIENT_ID='bench',
+            GIGACHAT_CLIENT_SECRET='bench',
+            GIGACHAT_AUTH_URL=giga.auth_url,
+            GIGACHAT_CHAT_URL=giga.chat_url,
+            GIGACHAT_STREAMING='0',
+            MAX_CONCURRENT_GENERATIONS='1000',
+            HISTORY_DB_PATH=os.path.join(tmp, 'history.db'),
+            FSM_DB_PATH=os.path.join(tmp, 'fsm.db'),
+            METRICS_PORT='0',
+        )
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, 'sharding.py', env=env,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+
+        # Прогрев: по одному /start в каждый воркер
+        for user_id in range(1, workers + 1):
+            await telegram.push(telegram.make_message_update(user_id, '/start'))
+        await telegram.wait_sent(2 * workers)
+        warmup = telegram.sent_count
+
+        started = time.perf_counter()
+        for user_id in range(1000, 1000 + users):
+            await telegram.push(telegram.make_callback_update(user_id, 'short_text'))
+            await telegram.push(telegram.make_message_update(user_id, f'Пост про котиков №{user_id}'))
+        await telegram.wait_sent(warmup + MESSAGES_PER_USER * users, timeout=300)
+        elapsed = time.perf_counter() - started
+
+        # Плавная остановка: воркеры должны доделать работу и выйти сами
+        stop_started = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        code = await process.wait()
+        drain = time.perf_counter() - stop_started
+
+    await giga.stop()
+    await telegram.stop()
+    return elapsed, drain, code
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--chat-latency', type=float, default=0.0, help='задержка ответа мока GigaChat, с')
+    args = parser.parse_args()
+
+    print(f'CPU: {os.cpu_count()}')
+    for workers in args.workers:
+        elapsed, drain, code = await run(workers, args.users, args.chat_latency)
+        print(f'workers={workers}: {args.users / elapsed:.0f} диалогов/с, '
+              f'остановка {drain:.1f} с, код выхода {code}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
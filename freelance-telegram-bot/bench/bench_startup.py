@@ -0,0 +1,118 @@
+"""
+Время запуска бота: что стоит импорт main и через сколько после старта
+процесса бот отвечает на первый апдейт.
+
+1. python -X importtime -c "import main": общее время и самые дорогие модули.
+2. python main.py против мока Telegram: от запуска процесса до ответа на /start.
+3. sharding.py с --workers воркерами при spawn и forkserver: от запуска до
+   ответа каждого воркера на свой /start.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_startup --workers 4
+"""
+import argparse
+import asyncio
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.mock_gigachat import MockGigaChat
+from bench.mock_telegram import MockTelegram
+
+IMPORT_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)')
+
+
+def import_profile(top):
+    """
+    Возвращает (время импорта main в мс, [(модуль, мс)] верхнего уровня по убыванию)
+    """
+    env = dict(os.environ, BOT_TOKEN='', GIGACHAT_CLIENT_ID='', GIGACHAT_CLIENT_SECRET='')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'],
+                            env=env, capture_output=True, text=True, check=True)
+    # importtime печатает модуль после всего, что он импортировал; отступ
+    # растет на 2 с каждым уровнем: у main он равен 1, у его импортов - 3
+    children = {}
+    modules = {}
+    total = 0
+    for match in IMPORT_LINE.finditer(result.stderr):
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if indent == 3:
+            package = name.split('.')[0]
+            children[package] = children.get(package, 0) + cumulative
+        elif indent == 1:
+            if name == 'main':
+                total, modules = cumulative, children
+            children = {}
+    ranked = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]
+    return total / 1000, [(name, us / 1000) for name, us in ranked]
+
+
+async def time_to_first_reply(command, users, extra_env):
+    """
+    Запускает бота командой command и ждет ответа на /start от users
+    пользователей. Возвращает секунды от запуска процесса
+    """
+    telegram = await MockTelegram().start()
+    giga = await MockGigaChat(auth_latency=0.0, chat_latency=0.0).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            BOT_TOKEN='42:BENCH',
+            TELEGRAM_API_URL=telegram.base_url,
+            GIGACHAT_CLIENT_ID='bench',
+            GIGACHAT_CLIENT_SECRET='bench',
+            GIGACHAT_AUTH_URL=giga.auth_url,
+            GIGACHAT_CHAT_URL=giga.chat_url,
+            HISTORY_DB_PATH=os.path.join(tmp, 'history.db'),
+            FSM_DB_PATH=os.path.join(tmp, 'fsm.db'),
+            METRICS_PORT='0',
+            **extra_env,
+        )
+        # Апдейты уже ждут в очереди: считаем время до готовности бота
+        for user_id in range(1, users + 1):
+            await telegram.push(telegram.make_message_update(user_id, '/start'))
+
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, *command, env=env,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+        )
+        # На /start бот присылает приветствие и клавиатуру
+        await telegram.wait_sent(2 * users, timeout=120)
+        elapsed = time.perf_counter() - started
+
+        process.send_signal(signal.SIGTERM)
+        await process.wait()
+    await giga.stop()
+    await telegram.stop()
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--top', type=int, default=8, help='сколько модулей показать')
+    args = parser.parse_args()
+
+    total, modules = import_profile(args.top)
+    print(f'import main: {total:.0f} ms')
+    for name, ms in modules:
+        print(f'  {name:<20} {ms:6.0f} ms')
+
+    elapsed = await time_to_first_reply(['main.py'], 1, {})
+    print(f'main.py: первый ответ через {elapsed:.2f} с')
+
+    for method in ('spawn', 'forkserver'):
+        elapsed = await time_to_first_reply(
+            ['sharding.py'], args.workers,
+            {'BOT_WORKERS': str(args.workers), 'WORKER_START_METHOD': method},
+        )
+        print(f'sharding.py, {args.workers} воркера, {method}: все ответили через {elapsed:.2f} с')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
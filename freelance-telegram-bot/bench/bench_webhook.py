@@ -0,0 +1,110 @@
+"""
+Пропускная способность доставки апдейтов: long polling против вебхука.
+
+Бот с простым обработчиком (отвечает на каждое сообщение) работает против
+мока Telegram Bot API. В режиме polling апдейты кладутся в getUpdates, в
+режиме webhook - отправляются POST-запросами на локальный сервер вебхука.
+
+Запуск из каталога freelance-telegram-bot:
+    python -m bench.bench_webhook --updates 2000 --concurrency 50
+"""
+import argparse
+import asyncio
+import time
+
+import aiohttp
+from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from bench.mock_telegram import MockTelegram
+from webhook import create_webhook_app
+
+SECRET = 'bench-secret'
+
+
+def make_bot(mock):
+    session = AiohttpSession(api=TelegramAPIServer.from_base(mock.base_url))
+    return Bot(token='42:BENCH', session=session)
+
+
+def make_dispatcher():
+    dp = Dispatcher()
+
+    @dp.message()
+    async def echo(message: types.Message):
+        await message.answer(f'Принято: {message.text}')
+
+    return dp
+
+
+async def bench_polling(updates, api_latency):
+    mock = await MockTelegram(latency=api_latency).start()
+    bot = make_bot(mock)
+    dp = make_dispatcher()
+    for i in range(updates):
+        await mock.push(mock.make_message_update(i % 500 + 1, f'Сообщение {i}'))
+
+    started = time.perf_counter()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False))
+    await mock.wait_sent(updates)
+    elapsed = time.perf_counter() - started
+
+    await dp.stop_polling()
+    await polling
+    await mock.stop()
+    return elapsed
+
+
+async def bench_webhook(updates, concurrency, api_latency):
+    mock = await MockTelegram(latency=api_latency).start()
+    bot = make_bot(mock)
+    dp = make_dispatcher()
+
+    runner = web.AppRunner(create_webhook_app(dp, bot, path='/webhook', secret_token=SECRET))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f'http://127.0.0.1:{runner.addresses[0][1]}/webhook'
+
+    payloads = [mock.make_message_update(i % 500 + 1, f'Сообщение {i}') for i in range(updates)]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession(headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}) as session:
+        # Без секрета запрос должен быть отклонен
+        async with session.post(url, json=payloads[0], headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'}) as r:
+            assert r.status == 401, r.status
+
+        async def post(update):
+            async with semaphore:
+                async with session.post(url, json=update) as response:
+                    response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(update) for update in payloads))
+        await mock.wait_sent(updates)
+        elapsed = time.perf_counter() - started
+
+    await runner.cleanup()
+    await bot.session.close()
+    await mock.stop()
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа мока Bot API, с')
+    args = parser.parse_args()
+
+    elapsed = await bench_polling(args.updates, args.api_latency)
+    print(f'polling: {args.updates / elapsed:.0f} updates/s')
+
+    elapsed = await bench_webhook(args.updates, args.concurrency, args.api_latency)
+    print(f'webhook: {args.updates / elapsed:.0f} updates/s')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+
+class MockGigaChat:
+    """
+    Локальная заглушка GigaChat: эндпоинты oauth и chat/completions
+    с настраиваемой задержкой и внедрением сбоев.
+
+    error_rate - доля запросов, на которые отвечаем error_status;
+    hang_rate - доля запросов, которые "зависают" на hang_time секунд;
+    down - API полностью недоступен (все запросы получают error_status).
+
+    prompt_token_latency и completion_token_latency добавляют к chat_latency
+    время на каждый токен промпта и ответа, как у настоящей модели; ответ
+    обрезается по max_tokens запроса. answer_tokens - сколько токенов модель
+    написала бы без ограничения. С supports_n=True параметр n запроса дает
+    n вариантов ответа за то же время (токены ответа считаются за каждый).
+    """
+
+    def __init__(self, auth_latency=0.05, chat_latency=0.1, token_lifetime=30 * 60, stream_chunks=20,
+                 max_concurrent=None, error_rate=0.0, error_status=503, hang_rate=0.0, hang_time=30,
+                 response_size=0, prompt_token_latency=0.0, completion_token_latency=0.0, answer_tokens=0,
+                 supports_n=True):
+        self.auth_latency = auth_latency
+        # Время генерации полного ответа; в потоковом режиме оно делится между фрагментами
+        self.chat_latency = chat_latency
+        self.stream_chunks = stream_chunks
+        # Дополнять ответ текстом до стольких символов (для проверки длинных ответов)
+        self.response_size = response_size
+        self.prompt_token_latency = prompt_token_latency
+        self.completion_token_latency = completion_token_latency
+        self.answer_tokens = answer_tokens
+        self.supports_n = supports_n
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Сверх этого числа одновременных запросов отвечаем 429, как перегруженный API
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.rejected = 0
+
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        self.hang_time = hang_time
+        self.down = False
+        self.faults = 0
+        self.token_lifetime = token_lifetime
+
+        self.auth_calls = 0
+        self.chat_calls = 0
+        self.tokens = set()
+
+        self._runner = None
+        self.port = None
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post('/api/v2/oauth', self.handle_oauth)
+        app.router.add_post('/api/v1/chat/completions', self.handle_chat)
+        return app
+
+    async def handle_oauth(self, request):
+        self.auth_calls += 1
+        await asyncio.sleep(self.auth_latency)
+        token = uuid.uuid4().hex
+        self.tokens.add(token)
+        expires_at = int((time.time() + self.token_lifetime) * 1000)
+        return web.json_response({'access_token': token, 'expires_at': expires_at})
+
+    async def handle_chat(self, request):
+        self.chat_calls += 1
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if token not in self.tokens:
+            return web.Response(status=401, text='Unauthorized')
+
+        if self.down or random.random() < self.error_rate:
+            self.faults += 1
+            return web.Response(status=self.error_status, text='Injected fault')
+
+        if self.max_concurrent is not None and self.in_flight >= self.max_concurrent:
+            self.rejected += 1
+            return web.Response(status=429, text='Too Many Requests')
+
+        self.in_flight += 1
+        try:
+            body = await request.json()
+            if random.random() < self.hang_rate:
+                self.faults += 1
+                await asyncio.sleep(self.hang_time)
+
+            prompt = body['messages'][-1]['content']
+            # Токены промпта - весь диалог, а не только последний вопрос
+            dialog = '\n'.join(message['content'] for message in body['messages'])
+            content = f'Ответ на: {prompt[:50]}'
+            size = max(self.response_size, self.answer_tokens * 4)
+            if len(content) < size:
+                paragraph = 'Это предложение ответа. ' * 20 + '\n\n'
+                content += '\n\n' + paragraph * (size // len(paragraph) + 1)
+                content = content[:size]
+            if body.get('max_tokens'):
+                content = content[:body['max_tokens'] * 4]
+
+            usage = self._usage(dialog, content)
+            n = body.get('n', 1) if self.supports_n and not body.get('stream') else 1
+            usage['completion_tokens'] *= n
+            usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+            self.prompt_tokens += usage['prompt_tokens']
+            self.completion_tokens += usage['completion_tokens']
+            prefill = usage['prompt_tokens'] * self.prompt_token_latency
+            decode = usage['completion_tokens'] // n * self.completion_token_latency
+
+            if body.get('stream'):
+                await asyncio.sleep(prefill)
+                return await self._stream_chat(request, content, dialog, decode)
+
+            await asyncio.sleep(self.chat_latency + prefill + decode)
+            variants = [f'Вариант {i + 1}. {content}' for i in range(n)] if n > 1 else [content]
+            return web.json_response({
+                'choices': [
+                    {'index': i, 'message': {'role': 'assistant', 'content': variant}}
+                    for i, variant in enumerate(variants)
+                ],
+                'usage': usage,
+            })
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    def _usage(prompt, content):
+        # Грубая оценка, как у настоящего API: около 4 символов на токен
+        prompt_tokens = len(prompt) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }
+
+    async def _stream_chat(self, request, content, prompt='', decode=0.0):
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+
+        step = max(1, len(content) // self.stream_chunks)
+        for i in range(0, len(content), step):
+            await asyncio.sleep((self.chat_latency + decode) / self.stream_chunks)
+            event = {'choices': [{'delta': {'content': content[i:i + step]}}]}
+            if i + step >= len(content):
+                event['usage'] = self._usage(prompt, content)
+            await response.write(f'data: {json.dumps(event, ensure_ascii=False)}\n\n'.encode())
+
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        return self
+
+    @property
+    def auth_url(self):
+        return f'http://127.0.0.1:{self.port}/api/v2/oauth'
+
+    @property
+    def chat_url(self):
+        return f'http://127.0.0.1:{self.port}/api/v1/chat/completions'
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
@@ -0,0 +1,236 @@
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+
+class MockTelegram:
+    """
+    Локальная заглушка Telegram Bot API.
+
+    Отдает апдейты через getUpdates (long polling), принимает sendMessage,
+    editMessageText и прочие методы, которые вызывает бот, и считает их.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._new_updates = asyncio.Condition()
+
+        self.calls = {}
+        # chat_id -> сообщения, отправленные или отредактированные ботом:
+        # {'method': ..., 'text': ..., 'reply_markup': {...}}
+        self.sent = {}
+        self.sent_count = 0
+        self._sent_event = asyncio.Event()
+        # chat_id -> событие "в этот чат что-то пришло"
+        self._chat_events = {}
+
+        self._runner = None
+        self.port = None
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle_method)
+        return app
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    async def start(self, host='127.0.0.1', port=0):
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    # --- апдейты ---
+
+    def make_message_update(self, user_id, text):
+        update = {
+            'update_id': self._next_update_id,
+            'message': {
+                'message_id': self._next_message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+                'text': text,
+            },
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            update['message']['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        self._next_update_id += 1
+        self._next_message_id += 1
+        return update
+
+    def make_callback_update(self, user_id, data, message_id=1):
+        update = {
+            'update_id': self._next_update_id,
+            'callback_query': {
+                'id': str(self._next_update_id),
+                'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': {'id': 1, 'is_bot': True, 'first_name': 'Bot'},
+                    'text': '...',
+                },
+            },
+        }
+        self._next_update_id += 1
+        return update
+
+    async def push(self, update):
+        """
+        Кладет апдейт в очередь getUpdates
+        """
+        async with self._new_updates:
+            self.updates.append(update)
+            self._new_updates.notify_all()
+
+    async def wait_sent(self, count, timeout=60):
+        """
+        Ждет, пока бот отправит или отредактирует count сообщений
+        """
+        deadline = time.monotonic() + timeout
+        while self.sent_count < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'Бот отправил {self.sent_count} из {count} сообщений')
+            self._sent_event.clear()
+            try:
+                await asyncio.wait_for(self._sent_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait_for(self, chat_id, predicate, start=0, timeout=60):
+        """
+        Ждет сообщение бота в чат chat_id (начиная с номера start), для
+        которого predicate вернет True. Возвращает номер следующего сообщения
+        """
+        deadline = time.monotonic() + timeout
+        event = self._chat_events.setdefault(chat_id, asyncio.Event())
+        while True:
+            messages = self.sent.get(chat_id, [])
+            for index in range(start, len(messages)):
+                if predicate(messages[index]):
+                    return index + 1
+            start = len(messages)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f'Бот не ответил в чат {chat_id}')
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- методы Bot API ---
+
+    async def handle_method(self, request):
+        method = request.match_info['method']
+        # Bot API принимает параметры и формой (так шлет aiogram), и JSON
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        handler = getattr(self, f'method_{method}', None)
+        result = await handler(params) if handler is not None else True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def method_getMe(self, params):
+        return {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'mock_bot'}
+
+    async def method_getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+
+        async with self._new_updates:
+            # Подтвержденные апдейты больше не отдаем
+            self.updates = [update for update in self.updates if update['update_id'] >= offset]
+            if not self.updates and timeout:
+                try:
+                    await asyncio.wait_for(self._new_updates.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return self.updates[:100]
+
+    def _record_sent(self, method, params):
+        chat_id = int(params['chat_id'])
+        markup = params.get('reply_markup') or {}
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        self.sent.setdefault(chat_id, []).append(
+            {'method': method, 'text': params.get('text', ''), 'reply_markup': markup}
+        )
+        self.sent_count += 1
+        self._sent_event.set()
+        event = self._chat_events.get(chat_id)
+        if event is not None:
+            event.set()
+        return chat_id, markup
+
+    async def method_sendMessage(self, params):
+        chat_id, markup = self._record_sent('sendMessage', params)
+        message = {
+            'message_id': self._next_message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'Bot'},
+            'text': params.get('text', ''),
+        }
+        # Как и Telegram, в ответе возвращаем только inline-клавиатуру
+        if 'inline_keyboard' in markup:
+            message['reply_markup'] = markup
+        self._next_message_id += 1
+        return message
+
+    async def method_sendDocument(self, params):
+        # Файл приходит отдельным multipart-полем, а document ссылается на него как attach://<поле>;
+        # сохраняем содержимое, чтобы бенчмарки могли его проверить
+        document = params.get('document')
+        if isinstance(document, str) and document.startswith('attach://'):
+            document = params.get(document[len('attach://'):])
+        chat_id, _ = self._record_sent('sendDocument', dict(params, text=params.get('caption', '')))
+        self.sent[chat_id][-1]['document'] = {
+            'filename': getattr(document, 'filename', None),
+            'content': document.file.read() if hasattr(document, 'file') else document,
+        }
+        message = {
+            'message_id': self._next_message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'Bot'},
+            'document': {'file_id': f'doc{self._next_message_id}', 'file_unique_id': f'doc{self._next_message_id}'},
+        }
+        self._next_message_id += 1
+        return message
+
+    async def method_editMessageText(self, params):
+        chat_id, _ = self._record_sent('editMessageText', params)
+        return {
+            'message_id': int(params.get('message_id') or 0),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'Bot'},
+            'text': params.get('text', ''),
+        }
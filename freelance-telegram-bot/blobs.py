@@ -0,0 +1,63 @@
+import hashlib
+import zlib
+
+# Кодеки тел в таблице blobs
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+
+# Короткие тексты не сжимаем: заголовок zlib съест весь выигрыш
+COMPRESS_MIN_BYTES = 128
+ZLIB_LEVEL = 6
+
+PREVIEW_LENGTH = 100
+
+
+def make_preview(text, length=PREVIEW_LENGTH):
+    """
+    Короткая версия текста для списка истории
+    """
+    return text[:length] + "..." if len(text) > length else text
+
+
+def encode_blob(text):
+    """
+    Готовит текст к записи в blobs: (hash, size, codec, data).
+    hash - sha256 от UTF-8 текста, по нему одинаковые тексты хранятся один раз
+    """
+    raw = text.encode('utf-8')
+    digest = hashlib.sha256(raw).digest()
+    if len(raw) >= COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(raw, ZLIB_LEVEL)
+        if len(compressed) < len(raw):
+            return digest, len(raw), CODEC_ZLIB, compressed
+    return digest, len(raw), CODEC_RAW, raw
+
+
+def decode_blob(codec, data):
+    if codec == CODEC_ZLIB:
+        data = zlib.decompress(data)
+    return bytes(data).decode('utf-8')
+
+
+def store_texts(conn, texts):
+    """
+    Записывает тексты в blobs (уже сохраненные пропускаются) и
+    возвращает их хэши в том же порядке
+    """
+    encoded = [encode_blob(text) for text in texts]
+    conn.executemany(
+        'INSERT OR IGNORE INTO blobs (hash, size, codec, data) VALUES (?, ?, ?, ?)', encoded
+    )
+    return [blob[0] for blob in encoded]
+
+
+def delete_orphans(conn, hashes):
+    """
+    Удаляет из blobs тела, на которые больше не ссылается ни одна запись истории
+    """
+    conn.executemany('''
+        DELETE FROM blobs
+        WHERE hash = ?
+          AND NOT EXISTS (SELECT 1 FROM history WHERE input_hash = blobs.hash)
+          AND NOT EXISTS (SELECT 1 FROM history WHERE output_hash = blobs.hash)
+    ''', [(digest,) for digest in set(hashes)])
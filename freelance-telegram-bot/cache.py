@@ -0,0 +1,145 @@
+import hashlib
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+
+from db_thread import DBThread
+
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt):
+    """
+    Приводит промпт к каноническому виду, чтобы почти одинаковые запросы
+    (регистр, лишние пробелы и переносы, точка в конце) попадали в один ключ
+    """
+    text = _SPACES.sub(' ', prompt).strip().lower()
+    return text.rstrip('.!?… ')
+
+
+def make_key(request_type, prompt):
+    normalized = normalize_prompt(prompt)
+    return hashlib.sha256(f'{request_type}\0{normalized}'.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    Кэш ответов GigaChat для повторяющихся промптов.
+
+    В памяти хранится LRU с ограничением по TTL и по суммарному размеру ответов.
+    Если задан db_path, ответы дополнительно пишутся в SQLite, и кэш
+    переживает перезапуск бота.
+    """
+
+    def __init__(self, ttl=24 * 60 * 60, max_bytes=16 * 1024 * 1024, db_path=None):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+
+        # key -> (response, created_at, size)
+        self._entries = OrderedDict()
+        self._size = 0
+
+        self._db = DBThread(self._open_db, 'response-cache') if db_path else None
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def _open_db(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        return conn
+
+    def _db_get(self, key):
+        row = self._db.connect().execute(
+            'SELECT response, created_at FROM response_cache WHERE key = ?', (key,)
+        ).fetchone()
+        return row
+
+    def _db_set(self, key, response, created_at):
+        conn = self._db.connect()
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, response, created_at) VALUES (?, ?, ?)',
+                (key, response, created_at),
+            )
+            # Попутно убираем просроченные записи
+            conn.execute('DELETE FROM response_cache WHERE created_at < ?', (time.time() - self.ttl,))
+
+    def _remember(self, key, response, created_at):
+        size = len(response.encode())
+        if size > self.max_bytes:
+            return
+
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= old[2]
+
+        self._entries[key] = (response, created_at, size)
+        self._size += size
+
+        # Вытесняем самые давно использованные записи, пока не уложимся в бюджет
+        while self._size > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+
+    def _forget(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+    async def get(self, request_type, prompt):
+        key = make_key(request_type, prompt)
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[1] > self.ttl:
+            self._forget(key)
+            entry = None
+
+        if entry is None and self._db is not None:
+            row = await self._db.run(self._db_get, key)
+            if row is not None and now - row[1] <= self.ttl:
+                self._remember(key, row[0], row[1])
+                entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.bytes_saved += entry[2]
+        return entry[0]
+
+    async def set(self, request_type, prompt, response):
+        key = make_key(request_type, prompt)
+        created_at = time.time()
+        self._remember(key, response, created_at)
+        if self._db is not None:
+            await self._db.run(self._db_set, key, response, created_at)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self._size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'bytes_saved': self.bytes_saved,
+        }
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
@@ -0,0 +1,45 @@
+from prompts import estimate_tokens, trim_text
+
+# Окно диалога по умолчанию: последние 5 вопросов с ответами
+MAX_MESSAGES = 10
+# Сколько токенов может занять одно сохраненное сообщение. Длинные ответы
+# хранятся укороченными: для контекста хватает начала и конца
+MESSAGE_TOKENS = 300
+# Сколько токенов контекста и нового вопроса отправлять в одном запросе
+TOKEN_BUDGET = 2000
+
+
+def build_messages(window, question, budget=TOKEN_BUDGET):
+    """
+    Собирает сообщения для GigaChat: новый вопрос и столько последних
+    сообщений окна, сколько помещается в budget токенов. Самые старые
+    сообщения отбрасываются первыми, так что размер запроса ограничен
+    при любой длине диалога.
+
+    window - список [роль, текст] из FSM, от старых к новым
+    """
+    remaining = budget - estimate_tokens(question)
+    context = []
+    for role, content in reversed(window):
+        remaining -= estimate_tokens(content)
+        if remaining < 0:
+            break
+        context.append({"role": role, "content": content})
+    context.reverse()
+
+    # Диалог должен начинаться с вопроса пользователя
+    while context and context[0]["role"] != "user":
+        context.pop(0)
+    return context + [{"role": "user", "content": question}]
+
+
+def append_turn(window, question, answer, max_messages=MAX_MESSAGES, message_tokens=MESSAGE_TOKENS):
+    """
+    Возвращает окно с новой парой вопрос-ответ: тексты укорочены до
+    message_tokens, в окне не больше max_messages сообщений
+    """
+    window = window + [
+        ["user", trim_text(question, message_tokens)],
+        ["assistant", trim_text(answer, message_tokens)],
+    ]
+    return window[-max_messages:]
@@ -0,0 +1,78 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DBThread:
+    """
+    Отдельный поток для одного SQLite-соединения хранилища.
+
+    Все вызовы выполняются по очереди в одном потоке, поэтому соединение
+    открывается лениво функцией open_db() при первом connect() и дальше
+    используется только там. Если заданы гистограммы latency (с меткой op -
+    имя функции без "_") и wait, в них пишутся время запроса и ожидание
+    своей очереди; calls, max_wait и total_wait считаются всегда.
+    """
+
+    def __init__(self, open_db, name, latency=None, wait=None):
+        self._open_db = open_db
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._conn = None
+        self._latency = latency
+        self._wait = wait
+
+        self.calls = 0
+        self.max_wait = 0.0
+        self.total_wait = 0.0
+
+    def connect(self):
+        # Только из потока хранилища
+        if self._conn is None:
+            self._conn = self._open_db()
+        return self._conn
+
+    def _disconnect(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _timed(self, func, *args):
+        submitted = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            wait = started - submitted
+            self.calls += 1
+            self.max_wait = max(self.max_wait, wait)
+            self.total_wait += wait
+            if self._wait is not None:
+                self._wait.observe(wait)
+            try:
+                return func(*args)
+            finally:
+                if self._latency is not None:
+                    self._latency.observe(time.perf_counter() - started, op=func.__name__.lstrip('_'))
+
+        return job
+
+    def submit(self, func, *args):
+        """
+        Ставит func(*args) в очередь потока и сразу возвращает asyncio-future
+        """
+        return asyncio.get_running_loop().run_in_executor(self._executor, self._timed(func, *args))
+
+    async def run(self, func, *args):
+        return await self.submit(func, *args)
+
+    def wait_stats(self):
+        return {
+            'max_db_wait_ms': self.max_wait * 1000,
+            'avg_db_wait_ms': self.total_wait / self.calls * 1000 if self.calls else 0.0,
+        }
+
+    async def close(self):
+        """
+        Закрывает соединение и останавливает поток после уже поставленных вызовов
+        """
+        await self.run(self._disconnect)
+        self._executor.shutdown(wait=True)
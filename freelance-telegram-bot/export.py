@@ -0,0 +1,35 @@
+import csv
+import json
+
+# Поля записи истории в выгрузке /export
+EXPORT_FIELDS = ('id', 'date', 'request_type', 'input', 'output')
+EXPORT_FORMATS = ('jsonl', 'csv')
+
+
+class ExportWriter:
+    """
+    Пишет записи истории в открытый текстовый файл по одной: JSONL (объект
+    на строку) или CSV с заголовком. Файл для CSV открывается с newline=''
+    """
+
+    def __init__(self, out, fmt='jsonl'):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f'Неизвестный формат выгрузки: {fmt}')
+        self.out = out
+        self.fmt = fmt
+        self.count = 0
+        self._csv = None
+        if fmt == 'csv':
+            self._csv = csv.writer(out)
+            self._csv.writerow(EXPORT_FIELDS)
+
+    def write(self, record):
+        """
+        record - (id, date, request_type, input, output)
+        """
+        if self._csv is not None:
+            self._csv.writerow(record)
+        else:
+            self.out.write(json.dumps(dict(zip(EXPORT_FIELDS, record)), ensure_ascii=False))
+            self.out.write('\n')
+        self.count += 1
@@ -0,0 +1,194 @@
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+
+from prompts import FREE_QUESTION, RESUME_IMPROVEMENT, SHORT_TEXT, VACANCY_RESPONSE
+
+
+# Создаем состояния для FSM
+class ResponseToVacancy(StatesGroup):
+    waiting_for_vacancy = State()
+    waiting_for_skills = State()
+
+
+class ShortText(StatesGroup):
+    waiting_for_request = State()
+
+
+class ImproveResume(StatesGroup):
+    waiting_for_resume = State()
+
+
+class FreeQuestion(StatesGroup):
+    waiting_for_question = State()
+
+
+# Кнопки с параметрами. В дате истории есть ":", поэтому разделитель "|"
+class HistoryPage(CallbackData, prefix="history", sep="|"):
+    direction: str
+    date: str
+    record_id: int
+
+
+class SearchPage(CallbackData, prefix="search_page"):
+    offset: int
+
+
+# Клавиатуры собираются один раз при импорте и переиспользуются в каждом ответе
+MAIN_MENU_BUTTON = InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")
+
+REGENERATE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔄 Сгенерировать заново", callback_data="regenerate")],
+    [InlineKeyboardButton(text="💾 Сохранить", callback_data="save")],
+    [MAIN_MENU_BUTTON]
+])
+
+QUESTION_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🔄 Перефразировать", callback_data="rephrase_question")],
+    [InlineKeyboardButton(text="🆕 Новый диалог", callback_data="new_conversation")],
+    [MAIN_MENU_BUTTON]
+])
+
+START_KEYBOARD = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text="🏠 Главное меню")],
+        [KeyboardButton(text="📊 История запросов")],
+        [KeyboardButton(text="💬 Задать вопрос")]
+    ],
+    resize_keyboard=True,
+    one_time_keyboard=False
+)
+
+
+class Step:
+    """
+    Шаг сценария: в состоянии state бот ждет от пользователя поле field,
+    а перед этим задает вопрос question
+    """
+
+    def __init__(self, state, field, question):
+        self.state = state
+        self.field = field
+        self.question = question
+
+
+class Flow:
+    """
+    Сценарий генерации одного типа запроса.
+
+    request_type - тип в истории и в FSM, action - callback_data кнопки
+    главного меню. Шаги собирают поля шаблона промпта по одному сообщению,
+    после последнего бот генерирует ответ. history_input - как записать
+    ввод в историю (format по полям шагов). conversation - вопросы
+    сценария образуют диалог, и в запрос уходят предыдущие сообщения.
+    """
+
+    def __init__(self, request_type, action, button, history_title, steps, template, placeholder, title,
+                 regenerate_title, history_input, keyboard=REGENERATE_KEYBOARD, cache=False, conversation=False):
+        self.request_type = request_type
+        self.action = action
+        self.button = button
+        self.history_title = history_title
+        self.steps = steps
+        self.template = template
+        self.placeholder = placeholder
+        self.title = title
+        self.regenerate_title = regenerate_title
+        self.history_input = history_input
+        self.keyboard = keyboard
+        self.cache = cache
+        self.conversation = conversation
+
+
+FLOWS = [
+    Flow(
+        "vacancy_response",
+        action="response_to_vacancy",
+        button="📝 Отклик на вакансию",
+        history_title="📝 Отклик на вакансию",
+        steps=[
+            Step(ResponseToVacancy.waiting_for_vacancy, "vacancy",
+                 "📝 Расскажи о вакансии: чем занимается компания, какие требования, что нужно делать?"),
+            Step(ResponseToVacancy.waiting_for_skills, "skills", "💼 Теперь расскажи о своих навыках и опыте:"),
+        ],
+        template=VACANCY_RESPONSE,
+        placeholder="🤔 Генерирую отклик...",
+        title="📨 Вот твой отклик:\n\n",
+        regenerate_title="📨 Вот твой обновленный отклик:\n\n",
+        history_input="Вакансия: {vacancy}\nНавыки: {skills}",
+    ),
+    Flow(
+        "short_text",
+        action="short_text",
+        button="✍️ Короткий текст",
+        history_title="✍️ Короткий текст",
+        steps=[
+            Step(ShortText.waiting_for_request, "request",
+                 "✍️ Опиши, какой текст тебе нужен (пост для соцсетей, email, объявление и т.д.):"),
+        ],
+        template=SHORT_TEXT,
+        placeholder="🤔 Генерирую текст...",
+        title="📝 Вот твой текст:\n\n",
+        regenerate_title="📝 Вот твой обновленный текст:\n\n",
+        history_input="{request}",
+        cache=True,
+    ),
+    Flow(
+        "resume_improvement",
+        action="improve_resume",
+        button="📄 Улучшить резюме",
+        history_title="📄 Улучшение резюме",
+        steps=[
+            Step(ImproveResume.waiting_for_resume, "resume",
+                 "📄 Пришли текст своего резюме (или его части), и я помогу его улучшить:"),
+        ],
+        template=RESUME_IMPROVEMENT,
+        placeholder="🤔 Улучшаю резюме...",
+        title="📄 Вот улучшенная версия:\n\n",
+        regenerate_title="📄 Вот улучшенная версия:\n\n",
+        history_input="{resume}",
+    ),
+    Flow(
+        "free_question",
+        action="free_question",
+        button="💬 Задать вопрос",
+        history_title="💬 Вопрос",
+        steps=[
+            Step(FreeQuestion.waiting_for_question, "question",
+                 "💬 Задай любой вопрос, и я постараюсь на него ответить:"),
+        ],
+        template=FREE_QUESTION,
+        placeholder="🤔 Думаю над ответом...",
+        title="💡 Ответ на твой вопрос:\n\n",
+        regenerate_title="🔄 Вот обновленная версия:\n\n",
+        history_input="{question}",
+        keyboard=QUESTION_KEYBOARD,
+        cache=True,
+        conversation=True,
+    ),
+]
+
+# Таблицы для поиска за O(1): по типу запроса, по кнопке меню и по состоянию FSM
+FLOWS_BY_TYPE = {flow.request_type: flow for flow in FLOWS}
+FLOWS_BY_ACTION = {flow.action: flow for flow in FLOWS}
+# Строка состояния -> (сценарий, номер шага)
+FLOW_STEPS = {step.state.state: (flow, i) for flow in FLOWS for i, step in enumerate(flow.steps)}
+
+# Заголовок повторной генерации для типов без сценария
+DEFAULT_REGENERATE_TITLE = "🔄 Вот обновленная версия:\n\n"
+
+MAIN_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    *([InlineKeyboardButton(text=flow.button, callback_data=flow.action)] for flow in FLOWS),
+    [InlineKeyboardButton(text="📊 История запросов", callback_data="history")],
+    [InlineKeyboardButton(text="❓ Помощь", callback_data="help")]
+])
+
+
+def history_title(request_type):
+    flow = FLOWS_BY_TYPE.get(request_type)
+    return flow.history_title if flow is not None else request_type
+
+
+def regenerate_title(request_type):
+    flow = FLOWS_BY_TYPE.get(request_type)
+    return flow.regenerate_title if flow is not None else DEFAULT_REGENERATE_TITLE
@@ -0,0 +1,163 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+from db_thread import DBThread
+from metrics import REGISTRY
+
+DB_LATENCY = REGISTRY.histogram('fsm_db_seconds', 'Время запроса к базе FSM-хранилища', ('op',))
+DB_WAIT = REGISTRY.histogram('fsm_db_wait_seconds', 'Ожидание своей очереди в потоке базы FSM')
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище на SQLite с LRU-кэшем в памяти.
+
+    Состояние и данные каждого диалога пишутся в базу сразу (в отдельном
+    потоке, как и история), поэтому переживают перезапуск бота. В памяти
+    держим не больше cache_size последних диалогов. Диалоги, которые не
+    менялись дольше ttl секунд, считаются завершенными и удаляются.
+    """
+
+    def __init__(self, path='bot_fsm.db', ttl=24 * 60 * 60, cache_size=10000, purge_interval=10 * 60):
+        self.path = path
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.purge_interval = purge_interval
+
+        self._db = DBThread(self._open_db, 'fsm-db', DB_LATENCY, DB_WAIT)
+        # ключ -> (state, data, updated_at)
+        self._cache = OrderedDict()
+        self._last_purge = time.time()
+        self._closed = False
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(key):
+        return (f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:"
+                f"{key.business_connection_id or ''}:{key.destiny}")
+
+    def _open_db(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS fsm (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_updated_at ON fsm (updated_at)')
+        conn.commit()
+        return conn
+
+    def _db_load(self, key):
+        return self._db.connect().execute(
+            'SELECT state, data, updated_at FROM fsm WHERE key = ?', (key,)
+        ).fetchone()
+
+    def _db_save(self, key, state, data, updated_at):
+        conn = self._db.connect()
+        with conn:
+            if state is None and not data:
+                conn.execute('DELETE FROM fsm WHERE key = ?', (key,))
+            else:
+                conn.execute(
+                    'INSERT OR REPLACE INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?)',
+                    (key, state, json.dumps(data, ensure_ascii=False), updated_at),
+                )
+
+    def _db_purge(self, expired_before):
+        conn = self._db.connect()
+        with conn:
+            return conn.execute('DELETE FROM fsm WHERE updated_at < ?', (expired_before,)).rowcount
+
+    def _remember(self, key, record):
+        self._cache[key] = record
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def _load(self, key):
+        now = time.time()
+        record = self._cache.get(key)
+        if record is None:
+            self.misses += 1
+            row = await self._db.run(self._db_load, key)
+            # Пока читали базу, запись могла появиться в кэше - она новее
+            record = self._cache.get(key)
+            if record is None:
+                if row is None:
+                    record = (None, {}, now)
+                else:
+                    record = (row[0], json.loads(row[1]), row[2])
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+
+        # Диалог давно не менялся - начинаем с чистого листа
+        if now - record[2] > self.ttl:
+            record = (None, {}, now)
+
+        self._remember(key, record)
+        return record
+
+    async def _save(self, key, state, data):
+        now = time.time()
+        self._remember(key, (state, data, now))
+        await self._db.run(self._db_save, key, state, data, now)
+
+        if now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            await self.purge_expired()
+
+    async def purge_expired(self):
+        """
+        Удаляет из базы диалоги, которые не менялись дольше ttl
+        """
+        return await self._db.run(self._db_purge, time.time() - self.ttl)
+
+    async def set_state(self, key, state=None):
+        key = self._key(key)
+        _, data, _ = await self._load(key)
+        await self._save(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key):
+        state, _, _ = await self._load(self._key(key))
+        return state
+
+    async def set_data(self, key, data):
+        if not isinstance(data, dict):
+            msg = f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            raise DataNotDictLikeError(msg)
+        key = self._key(key)
+        state, _, _ = await self._load(key)
+        await self._save(key, state, data.copy())
+
+    async def get_data(self, key):
+        _, data, _ = await self._load(self._key(key))
+        return data.copy()
+
+    def stats(self):
+        return {
+            'cached': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            **self._db.wait_stats(),
+        }
+
+    async def close(self):
+        # Dispatcher сам закрывает хранилище при остановке, поэтому повторный вызов ничего не делает
+        if self._closed:
+            return
+        self._closed = True
+        await self._db.close()
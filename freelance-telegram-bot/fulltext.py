@@ -0,0 +1,63 @@
+import re
+
+# Слова запроса: буквы и цифры, как их режет токенайзер unicode61.
+# Каждое слово должно давать ровно один токен: с detail=column фразы не поддерживаются
+QUERY_TERM = re.compile(r'[^\W_]+')
+# Больше слов в запросе не берем: длинный запрос только замедляет поиск
+MAX_QUERY_TERMS = 8
+
+
+def user_token(user_id):
+    """
+    Токен пользователя в колонке user индекса: записи ищутся только
+    внутри истории самого пользователя
+    """
+    return f'u{user_id}'
+
+
+def index_rows(conn, rows):
+    """
+    Добавляет записи истории в history_fts. rows - (id, user_id, input, output)
+    """
+    conn.executemany(
+        'INSERT INTO history_fts (rowid, user, input, output) VALUES (?, ?, ?, ?)',
+        [(record_id, user_token(user_id), input_data, output_data)
+         for record_id, user_id, input_data, output_data in rows]
+    )
+
+
+def unindex_rows(conn, rows):
+    """
+    Убирает записи из history_fts. Индекс contentless, поэтому FTS5 нужно
+    передать те же тексты, что были проиндексированы
+    """
+    conn.executemany(
+        "INSERT INTO history_fts (history_fts, rowid, user, input, output) VALUES ('delete', ?, ?, ?, ?)",
+        [(record_id, user_token(user_id), input_data, output_data)
+         for record_id, user_id, input_data, output_data in rows]
+    )
+
+
+def merge_index(conn, pages):
+    """
+    Шаг слияния сегментов history_fts: удаления в FTS5 копятся отметками в
+    новых сегментах и освобождают место только при слиянии. pages - сколько
+    страниц индекса записать за шаг. Возвращает False, когда сливать больше нечего
+    """
+    before = conn.total_changes
+    with conn:
+        conn.execute("INSERT INTO history_fts (history_fts, rank) VALUES ('merge', ?)", (pages,))
+    return conn.total_changes - before >= 2
+
+
+def make_match_query(user_id, text):
+    """
+    Собирает выражение MATCH из текста пользователя: все слова запроса
+    (по префиксу) в истории этого пользователя. Синтаксис FTS5 в тексте
+    не интерпретируется. None, если искать нечего
+    """
+    terms = QUERY_TERM.findall(text.lower())[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    words = ' '.join(f'"{term}"*' for term in terms)
+    return f'user:{user_token(user_id)} AND {{input output}}: ({words})'
@@ -0,0 +1,467 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import aiohttp
+
+from metrics import REGISTRY
+
+AUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+CHAT_URL = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+REQUEST_LATENCY = REGISTRY.histogram(
+    'gigachat_request_seconds', 'Время HTTP-запроса к GigaChat до получения статуса', ('endpoint', 'status'),
+)
+COMPLETION_LATENCY = REGISTRY.histogram(
+    'gigachat_completion_seconds', 'Полное время генерации ответа с учетом повторов', ('mode', 'status'),
+)
+TOKENS_USED = REGISTRY.counter(
+    'gigachat_tokens_total', 'Токены, израсходованные по данным ответа API', ('kind',),
+)
+
+
+class GigaChatError(Exception):
+    """
+    Ошибка при обращении к GigaChat API
+    """
+    retryable = False
+
+
+class GigaChatHTTPError(GigaChatError):
+    """
+    GigaChat ответил статусом, отличным от 200
+    """
+
+    def __init__(self, status, text=''):
+        self.status = status
+        self.text = text
+        self.retryable = status in RETRYABLE_STATUSES
+        super().__init__(f"{status} - {text}" if text else str(status))
+
+
+class GigaChatAuthError(GigaChatHTTPError):
+    """
+    Не удалось получить access token
+    """
+
+
+class GigaChatAPIError(GigaChatHTTPError):
+    """
+    Ошибка запроса к chat/completions
+    """
+
+
+class GigaChatTimeoutError(GigaChatError):
+    """
+    GigaChat не ответил за отведенное время
+    """
+    retryable = True
+
+
+class GigaChatConnectionError(GigaChatError):
+    """
+    Не удалось соединиться с GigaChat
+    """
+    retryable = True
+
+
+class GigaChatUnavailableError(GigaChatError):
+    """
+    Circuit breaker разомкнут: API недавно не отвечал, запрос не отправлялся
+    """
+
+
+class GigaChatResponseError(GigaChatError):
+    """
+    Ответ GigaChat не удалось разобрать
+    """
+
+
+class CircuitBreaker:
+    """
+    Размыкается после failure_threshold неудач подряд и сразу отклоняет запросы.
+    Через reset_timeout секунд пропускает один пробный запрос (half-open):
+    если он успешен, цепь замыкается, иначе снова размыкается.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+        # half-open: пропускаем только один пробный запрос
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self):
+        # Пробный запрос прервали, не дождавшись результата
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class GigaChatClient:
+    """
+    Долгоживущий клиент GigaChat.
+
+    Кэширует access token до момента незадолго до его истечения, обновляет его
+    ровно одним запросом, даже если токен нужен сразу многим корутинам, и
+    использует один пул keep-alive соединений для всех обработчиков.
+
+    Запросы ограничены таймаутами, временные ошибки повторяются с
+    экспоненциальной задержкой и jitter, а при недоступности API circuit
+    breaker отклоняет запросы сразу. Все ошибки - подклассы GigaChatError.
+    """
+
+    def __init__(self, client_id, client_secret, scope='GIGACHAT_API_PERS',
+                 auth_url=AUTH_URL, chat_url=CHAT_URL,
+                 token_margin=60, pool_size=100, keepalive_timeout=60,
+                 connect_timeout=5, read_timeout=60, total_timeout=120,
+                 max_retries=3, backoff_base=0.5, backoff_max=8,
+                 breaker_threshold=5, breaker_reset_timeout=30, supports_n=True):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.auth_url = auth_url
+        self.chat_url = chat_url
+        # За сколько секунд до истечения токена считаем его устаревшим
+        self.token_margin = token_margin
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(
+            total=total_timeout,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout,
+        )
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_timeout)
+        # Умеет ли API вернуть несколько вариантов ответа за один запрос (параметр n)
+        self.supports_n = supports_n
+
+        self._session = None
+        self._token = None
+        self._token_expires_at = 0.0
+        self._token_lock = asyncio.Lock()
+
+        # Счетчики для мониторинга и бенчмарков
+        self.auth_calls = 0
+        self.chat_calls = 0
+        self.retries = 0
+
+    def _get_session(self):
+        # Сессия создается лениво, чтобы она принадлежала работающему event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ssl=False,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    def _token_is_valid(self):
+        return self._token is not None and time.monotonic() < self._token_expires_at
+
+    async def get_token(self):
+        """
+        Возвращает действующий access token, при необходимости обновляя его
+        """
+        if self._token_is_valid():
+            return self._token
+
+        async with self._token_lock:
+            # Пока мы ждали блокировку, токен мог обновить кто-то другой
+            if not self._token_is_valid():
+                await self._refresh_token()
+            return self._token
+
+    def invalidate_token(self):
+        self._token = None
+        self._token_expires_at = 0.0
+
+    async def _refresh_token(self):
+        auth_headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Accept': 'application/json',
+            'RqUID': str(uuid.uuid4()),
+        }
+        auth_data = {
+            'scope': self.scope,
+        }
+
+        self.auth_calls += 1
+        session = self._get_session()
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            async with session.post(
+                    self.auth_url,
+                    headers=auth_headers,
+                    data=auth_data,
+                    auth=aiohttp.BasicAuth(self.client_id, self.client_secret),
+            ) as auth_response:
+                status = auth_response.status
+
+                if auth_response.status != 200:
+                    raise GigaChatAuthError(auth_response.status, await auth_response.text())
+
+                auth_result = await auth_response.json()
+        except asyncio.TimeoutError as e:
+            status = 'timeout'
+            raise GigaChatTimeoutError("Превышено время ожидания аутентификации") from e
+        except aiohttp.ClientError as e:
+            raise GigaChatConnectionError(f"Ошибка соединения при аутентификации: {e}") from e
+        finally:
+            REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint='auth', status=status)
+
+        # expires_at приходит в миллисекундах от начала эпохи
+        expires_at = auth_result.get('expires_at')
+        if expires_at:
+            lifetime = expires_at / 1000 - time.time()
+        else:
+            lifetime = 30 * 60
+
+        self._token = auth_result['access_token']
+        self._token_expires_at = time.monotonic() + lifetime - self.token_margin
+
+    def _chat_payload(self, prompt, temperature, max_tokens):
+        # prompt - текст одного вопроса или готовый список сообщений диалога
+        if isinstance(prompt, str):
+            messages = [{"role": "user", "content": prompt}]
+        else:
+            messages = list(prompt)
+        return {
+            "model": "GigaChat",
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+        # Экспоненциальная задержка с full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _post_chat(self, chat_data, accept='application/json'):
+        """
+        Отправляет запрос к chat/completions и возвращает открытый ответ со статусом 200.
+        Ответ нужно закрыть вызывающей стороне.
+        """
+        if not self.breaker.allow():
+            raise GigaChatUnavailableError("GigaChat временно недоступен")
+
+        try:
+            response = await self._post_chat_with_retries(chat_data, accept)
+        except GigaChatError as e:
+            if e.retryable:
+                self.breaker.record_failure()
+            else:
+                # API отвечает, просто отклонил этот запрос
+                self.breaker.record_success()
+            raise
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+
+        self.breaker.record_success()
+        return response
+
+    async def _post_chat_with_retries(self, chat_data, accept):
+        token_refreshed = False
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                access_token = await self.get_token()
+                chat_headers = {
+                    'Content-Type': 'application/json',
+                    'Accept': accept,
+                    'Authorization': f'Bearer {access_token}',
+                }
+
+                self.chat_calls += 1
+                session = self._get_session()
+                started = time.perf_counter()
+                try:
+                    chat_response = await session.post(
+                        self.chat_url,
+                        headers=chat_headers,
+                        json=chat_data,
+                    )
+                except asyncio.TimeoutError:
+                    REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint='chat', status='timeout')
+                    raise
+                except aiohttp.ClientError:
+                    REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint='chat', status='error')
+                    raise
+                REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint='chat', status=chat_response.status)
+
+                if chat_response.status == 200:
+                    return chat_response
+
+                # Токен отозвали раньше срока - обновляем один раз, это не считается попыткой
+                if chat_response.status == 401 and not token_refreshed:
+                    chat_response.release()
+                    self.invalidate_token()
+                    token_refreshed = True
+                    continue
+
+                retry_after = chat_response.headers.get('Retry-After')
+                error = GigaChatAPIError(chat_response.status, await chat_response.text())
+                chat_response.release()
+            except GigaChatError as e:
+                error = e
+            except asyncio.TimeoutError as e:
+                error = GigaChatTimeoutError("Превышено время ожидания ответа GigaChat")
+                error.__cause__ = e
+            except aiohttp.ClientError as e:
+                error = GigaChatConnectionError(f"Ошибка соединения с GigaChat: {e}")
+                error.__cause__ = e
+
+            if not error.retryable or attempt >= self.max_retries:
+                raise error
+
+            self.retries += 1
+            delay = self._backoff(attempt, float(retry_after) if retry_after and retry_after.isdigit() else None)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _post_completion(self, chat_data, mode):
+        """
+        Отправляет запрос к chat/completions и возвращает тексты всех вариантов ответа
+        """
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            async with await self._post_chat(chat_data) as chat_response:
+                try:
+                    result = await chat_response.json()
+                    contents = [choice['message']['content'] for choice in result['choices']]
+                    if not contents:
+                        raise IndexError('пустой список choices')
+                except asyncio.TimeoutError as e:
+                    raise GigaChatTimeoutError("Превышено время ожидания ответа GigaChat") from e
+                except aiohttp.ClientError as e:
+                    raise GigaChatConnectionError(f"Ошибка соединения с GigaChat: {e}") from e
+                except (KeyError, IndexError, TypeError, ValueError) as e:
+                    raise GigaChatResponseError(f"Некорректный ответ GigaChat: {e}") from e
+            status = 'ok'
+            self._count_tokens(result.get('usage'))
+            return contents
+        finally:
+            COMPLETION_LATENCY.observe(time.perf_counter() - started, mode=mode, status=status)
+
+    async def complete(self, prompt, temperature=0.7, max_tokens=2000):
+        """
+        Отправляет запрос к chat/completions и возвращает текст ответа
+        """
+        chat_data = self._chat_payload(prompt, temperature, max_tokens)
+        return (await self._post_completion(chat_data, 'complete'))[0]
+
+    async def complete_many(self, prompt, n, temperature=0.7, max_tokens=2000):
+        """
+        Возвращает n разных вариантов ответа на один промпт.
+
+        Если API поддерживает параметр n, все варианты приходят одним
+        запросом; недостающие варианты (или все, если n не поддерживается)
+        запрашиваются параллельными обычными запросами
+        """
+        contents = []
+        if n > 1 and self.supports_n:
+            chat_data = self._chat_payload(prompt, temperature, max_tokens)
+            chat_data['n'] = n
+            contents = (await self._post_completion(chat_data, 'batch'))[:n]
+
+        missing = n - len(contents)
+        if missing > 0:
+            contents += await asyncio.gather(
+                *(self.complete(prompt, temperature, max_tokens) for _ in range(missing))
+            )
+        return contents
+
+    @staticmethod
+    def _count_tokens(usage):
+        if not isinstance(usage, dict):
+            return
+        for kind in ('prompt_tokens', 'completion_tokens'):
+            if usage.get(kind):
+                TOKENS_USED.inc(usage[kind], kind=kind.removesuffix('_tokens'))
+
+    async def stream(self, prompt, temperature=0.7, max_tokens=2000):
+        """
+        Потоковая генерация: читает server-sent events из chat/completions
+        и отдает текст ответа по кусочкам по мере поступления
+        """
+        chat_data = self._chat_payload(prompt, temperature, max_tokens)
+        chat_data['stream'] = True
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            async with await self._post_chat(chat_data, accept='text/event-stream') as chat_response:
+                try:
+                    async for line in chat_response.content:
+                        line = line.strip()
+                        if not line.startswith(b'data:'):
+                            continue
+
+                        data = line[5:].strip()
+                        if data == b'[DONE]':
+                            break
+
+                        event = json.loads(data)
+                        # usage приходит в последнем событии потока
+                        self._count_tokens(event.get('usage'))
+                        delta = event['choices'][0].get('delta', {}).get('content')
+                        if delta:
+                            yield delta
+                except asyncio.TimeoutError as e:
+                    raise GigaChatTimeoutError("Превышено время ожидания ответа GigaChat") from e
+                except aiohttp.ClientError as e:
+                    raise GigaChatConnectionError(f"Ошибка соединения с GigaChat: {e}") from e
+                except (KeyError, IndexError, ValueError) as e:
+                    raise GigaChatResponseError(f"Некорректный ответ GigaChat: {e}") from e
+            status = 'ok'
+        finally:
+            COMPLETION_LATENCY.observe(time.perf_counter() - started, mode='stream', status=status)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
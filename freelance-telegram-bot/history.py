@@ -0,0 +1,473 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+from blobs import decode_blob, delete_orphans, make_preview, store_texts
+from db_thread import DBThread
+from fulltext import index_rows, make_match_query, merge_index, unindex_rows
+from metrics import REGISTRY
+from migrations import migrate
+from retention import (
+    attach_archive, clear_archive, expired_ids, incremental_vacuum, last_id, over_cap_ids, recent_users, retire_rows,
+    users_page,
+)
+
+DB_LATENCY = REGISTRY.histogram('history_db_seconds', 'Время запроса к базе истории', ('op',))
+DB_WAIT = REGISTRY.histogram('history_db_wait_seconds', 'Ожидание своей очереди в потоке базы истории')
+
+# Ошибки записи, после которых пачку стоит повторить: база занята другим процессом
+# (SQLITE_BUSY, например очисткой истории), заблокирована, сбой ввода-вывода или кончилось место
+RETRYABLE_ERRORS = {sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED, sqlite3.SQLITE_IOERR, sqlite3.SQLITE_FULL}
+# Пауза перед повтором записи пачки растет вдвое от MIN_RETRY_DELAY до MAX_RETRY_DELAY секунд
+MIN_RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 5.0
+# Сколько секунд при остановке повторять запись последних строк
+CLOSE_RETRY_TIMEOUT = 10.0
+
+
+def _retryable(error):
+    code = getattr(error, 'sqlite_errorcode', None)
+    # Расширенные коды (SQLITE_BUSY_SNAPSHOT и т.п.) несут основной код в младшем байте
+    return code is not None and code & 0xff in RETRYABLE_ERRORS
+
+
+def _check_row(user_id, request_type, input_data, output_data):
+    """
+    Проверяет запись до буфера: строка, которую нельзя записать, иначе
+    сорвала бы запись всей пачки вместе с записями других пользователей
+    """
+    if not isinstance(user_id, int):
+        raise TypeError(f'user_id должен быть int, а не {type(user_id).__name__}')
+    for value in (request_type, input_data, output_data):
+        if not isinstance(value, str):
+            raise TypeError(f'Поля записи истории должны быть строками, а не {type(value).__name__}')
+        # Одиночные суррогаты (битый JSON от клиента) не кодируются в UTF-8 и не пишутся в SQLite
+        value.encode()
+
+
+class HistoryStore:
+    """
+    Хранилище истории запросов.
+
+    Все обращения к SQLite выполняются в отдельном потоке через одно постоянное
+    соединение (WAL, кэш подготовленных запросов sqlite3), а обработчики только
+    ждут результат через await и не блокируют event loop.
+
+    Новые записи сначала копятся в памяти и пишутся пачкой в одной транзакции,
+    как только наберется batch_size строк или пройдет flush_interval секунд.
+    Если база временно недоступна (занята другим процессом, сбой диска),
+    пачка возвращается в буфер и пишется повторно с растущей паузой.
+
+    Тексты запросов и ответов лежат сжатыми в таблице blobs по хэшу (одинаковые
+    хранятся один раз), а в самой истории - ссылки на них и готовые превью,
+    так что страница истории не читает и не распаковывает полные тексты.
+    Для /search тексты дополнительно проиндексированы в FTS5 (history_fts),
+    индекс обновляется в тех же транзакциях, что и сама история.
+
+    Срок хранения: apply_retention() убирает записи старше max_age_days и
+    записи пользователя сверх max_rows_per_user самых новых (0 - без
+    ограничения), переносит их в архивную базу archive_path (None - просто
+    удаляет) и возвращает освободившееся место файлу. Работа идет пачками
+    по retention_batch записей, каждая - отдельная короткая транзакция в
+    потоке хранилища, так что запросы пользователей не ждут всю очистку.
+    """
+
+    def __init__(self, path='bot_history.db', batch_size=50, flush_interval=0.2,
+                 max_rows_per_user=0, max_age_days=0, archive_path=None, retention_batch=500,
+                 vacuum_pages=500):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_rows_per_user = max_rows_per_user
+        self.max_age_days = max_age_days
+        self.archive_path = archive_path
+        self.retention_batch = retention_batch
+        self.vacuum_pages = vacuum_pages
+        self._db = DBThread(self._open_db, 'history-db', DB_LATENCY, DB_WAIT)
+        self._archive_attached = False
+
+        self._buffer = []
+        self._flush_timer = None
+        self._pending_rows = 0
+
+        # Счетчики для настройки размера пачки и интервала
+        self.flush_count = 0
+        self.rows_flushed = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+        # Повторы записи пачки после временной ошибки базы и строки, потерянные из-за остальных ошибок
+        self.write_retries = 0
+        self.rows_dropped = 0
+        self._retry_delay = 0.0
+
+        # До какого id записи уже проверены на лимит записей пользователя.
+        # None - первая проверка после запуска обходит всех пользователей
+        self._checked_id = None
+        self._vacuum_warned = False
+        self.rows_retired = 0
+
+    def _open_db(self):
+        conn = sqlite3.connect(self.path, cached_statements=64)
+        # Действует только для новой базы: до создания первой таблицы
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        migrate(conn)
+        # Архив нужен и при выключенной очистке: "Очистить историю" удаляет записи и из него
+        if self.archive_path and (self.retention_enabled or os.path.exists(self.archive_path)):
+            attach_archive(conn, self.archive_path)
+            self._archive_attached = True
+        return conn
+
+    def _write_batch(self, rows):
+        started = time.perf_counter()
+        conn = self._db.connect()
+        with conn:
+            hashes = store_texts(conn, [text for row in rows for text in (row[3], row[4])])
+            indexed = []
+            # По одной строке: id новых записей нужны для полнотекстового индекса
+            for i, (user_id, date, request_type, input_data, output_data) in enumerate(rows):
+                cursor = conn.execute('''
+                    INSERT INTO history (user_id, date, request_type, input_preview, output_preview,
+                                         input_hash, output_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, date, request_type, make_preview(input_data), make_preview(output_data),
+                      hashes[2 * i], hashes[2 * i + 1]))
+                indexed.append((cursor.lastrowid, user_id, input_data, output_data))
+            index_rows(conn, indexed)
+        return time.perf_counter() - started
+
+    def _get_history_page(self, user_id, limit, before, after):
+        conn = self._db.connect()
+        if after is not None:
+            # Листаем к более новым записям: идем по индексу вверх и разворачиваем
+            cursor = conn.execute('''
+                SELECT id, user_id, date, request_type, input_preview, output_preview FROM history
+                WHERE user_id = ? AND (date, id) > (?, ?)
+                ORDER BY date ASC, id ASC
+                LIMIT ?
+            ''', (user_id, after[0], after[1], limit + 1))
+            rows = cursor.fetchall()
+            has_newer = len(rows) > limit
+            return rows[:limit][::-1], True, has_newer
+
+        if before is not None:
+            cursor = conn.execute('''
+                SELECT id, user_id, date, request_type, input_preview, output_preview FROM history
+                WHERE user_id = ? AND (date, id) < (?, ?)
+                ORDER BY date DESC, id DESC
+                LIMIT ?
+            ''', (user_id, before[0], before[1], limit + 1))
+        else:
+            cursor = conn.execute('''
+                SELECT id, user_id, date, request_type, input_preview, output_preview FROM history
+                WHERE user_id = ?
+                ORDER BY date DESC, id DESC
+                LIMIT ?
+            ''', (user_id, limit + 1))
+        rows = cursor.fetchall()
+        has_older = len(rows) > limit
+        return rows[:limit], has_older, before is not None
+
+    def _search(self, match, limit, offset):
+        conn = self._db.connect()
+        cursor = conn.execute('''
+            SELECT h.id, h.user_id, h.date, h.request_type, h.input_preview, h.output_preview
+            FROM (
+                SELECT rowid, rank FROM history_fts
+                WHERE history_fts MATCH ?
+                ORDER BY rank, rowid DESC
+                LIMIT ? OFFSET ?
+            ) AS found
+            JOIN history h ON h.id = found.rowid
+            ORDER BY found.rank, h.id DESC
+        ''', (match, limit + 1, offset))
+        rows = cursor.fetchall()
+        return rows[:limit], len(rows) > limit
+
+    def _export_chunk(self, user_id, after, limit, writer):
+        # Курсор читается построчно, без fetchall: в памяти одна запись
+        conn = self._db.connect()
+        cursor = conn.execute('''
+            SELECT h.id, h.date, h.request_type, i.codec, i.data, o.codec, o.data
+            FROM history h
+            JOIN blobs i ON i.hash = h.input_hash
+            JOIN blobs o ON o.hash = h.output_hash
+            WHERE h.user_id = ? AND (h.date, h.id) > (?, ?)
+            ORDER BY h.date, h.id
+            LIMIT ?
+        ''', (user_id, after[0], after[1], limit))
+        last = None
+        for record_id, date, request_type, input_codec, input_data, output_codec, output_data in cursor:
+            writer.write((record_id, date, request_type,
+                          decode_blob(input_codec, input_data), decode_blob(output_codec, output_data)))
+            last = (date, record_id)
+        return last
+
+    def _clear(self, user_id):
+        conn = self._db.connect()
+        # Записи читаются и удаляются в одной транзакции записи: иначе между чтением и
+        # удалением очистка истории в другом процессе (retire_rows) может успеть удалить
+        # часть из них, и запись завершится SQLITE_BUSY или повторным удалением из индекса
+        conn.execute('BEGIN IMMEDIATE')
+        with conn:
+            rows = conn.execute('''
+                SELECT h.id, h.input_hash, h.output_hash, i.codec, i.data, o.codec, o.data
+                FROM history h
+                JOIN blobs i ON i.hash = h.input_hash
+                JOIN blobs o ON o.hash = h.output_hash
+                WHERE h.user_id = ?
+            ''', (user_id,)).fetchall()
+            unindex_rows(conn, [
+                (row[0], user_id, decode_blob(row[3], row[4]), decode_blob(row[5], row[6])) for row in rows
+            ])
+            conn.execute('DELETE FROM history WHERE user_id = ?', (user_id,))
+            delete_orphans(conn, [digest for row in rows for digest in (row[1], row[2])])
+            if self._archive_attached:
+                clear_archive(conn, user_id)
+
+    def _retire_expired(self, before):
+        conn = self._db.connect()
+        return retire_rows(conn, expired_ids(conn, before, self.retention_batch), self._archive_attached)
+
+    def _users_over_cap(self, after_user):
+        page = users_page(self._db.connect(), after_user, self.retention_batch)
+        over_cap = [user_id for user_id, count in page if count > self.max_rows_per_user]
+        return over_cap, page[-1][0] if page else None
+
+    def _recent_users(self, after_id):
+        return recent_users(self._db.connect(), after_id, self.retention_batch)
+
+    def _last_id(self):
+        return last_id(self._db.connect())
+
+    def _retire_over_cap(self, user_id):
+        conn = self._db.connect()
+        ids = over_cap_ids(conn, user_id, self.max_rows_per_user, self.retention_batch)
+        return retire_rows(conn, ids, self._archive_attached)
+
+    def _merge_step(self):
+        return merge_index(self._db.connect(), self.vacuum_pages)
+
+    def _vacuum_step(self):
+        conn = self._db.connect()
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return None
+        return incremental_vacuum(conn, self.vacuum_pages)
+
+    async def init(self):
+        await self._db.run(self._db.connect)
+
+    def _schedule_flush(self):
+        """
+        Забирает накопленные строки и ставит их запись в очередь потока хранилища.
+        Поток один, поэтому все запросы, поставленные после, увидят эти строки.
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+        if not self._buffer:
+            return None
+
+        rows, self._buffer = self._buffer, []
+        self._pending_rows += len(rows)
+        future = self._db.submit(self._write_batch, rows)
+        future.add_done_callback(lambda f: self._flush_done(f, rows))
+        return future
+
+    def _flush_done(self, future, rows):
+        self._pending_rows -= len(rows)
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None and _retryable(error):
+            # Транзакция пачки откатилась целиком: возвращаем строки в начало буфера и повторяем позже
+            self._buffer[:0] = rows
+            self.write_retries += 1
+            self._retry_delay = min(max(self._retry_delay * 2, MIN_RETRY_DELAY), MAX_RETRY_DELAY)
+            logging.warning("База истории недоступна (%s), повтор записи %s строк через %.1f s",
+                            error, len(rows), self._retry_delay)
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = asyncio.get_running_loop().call_later(self._retry_delay, self._schedule_flush)
+            return
+        if error is not None:
+            self.rows_dropped += len(rows)
+            logging.error("Не удалось записать %s строк истории", len(rows), exc_info=error)
+            return
+
+        self._retry_delay = 0.0
+        latency = future.result()
+        self.flush_count += 1
+        self.rows_flushed += len(rows)
+        self.last_flush_latency = latency
+        self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.total_flush_latency += latency
+
+    @property
+    def queue_depth(self):
+        """
+        Сколько строк еще не записано в базу
+        """
+        return len(self._buffer) + self._pending_rows
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'flush_count': self.flush_count,
+            'rows_flushed': self.rows_flushed,
+            'last_flush_ms': self.last_flush_latency * 1000,
+            'max_flush_ms': self.max_flush_latency * 1000,
+            'avg_flush_ms': self.total_flush_latency / self.flush_count * 1000 if self.flush_count else 0.0,
+            'write_retries': self.write_retries,
+            'rows_dropped': self.rows_dropped,
+            **self._db.wait_stats(),
+            'rows_retired': self.rows_retired,
+        }
+
+    @property
+    def retention_enabled(self):
+        return bool(self.max_rows_per_user or self.max_age_days)
+
+    async def add(self, user_id, request_type, input_data, output_data):
+        _check_row(user_id, request_type, input_data, output_data)
+        self._buffer.append((user_id, datetime.now().isoformat(), request_type, input_data, output_data))
+
+        if len(self._buffer) >= self.batch_size:
+            # Пачка набралась: ждем записи, чтобы буфер не рос быстрее, чем пишет диск.
+            # Ошибку записи обрабатывает _flush_done, вызывающему она не нужна
+            await asyncio.wait((self._schedule_flush(),))
+        elif self._flush_timer is None:
+            self._flush_timer = asyncio.get_running_loop().call_later(self.flush_interval, self._schedule_flush)
+
+    async def flush(self):
+        future = self._schedule_flush()
+        if future is not None:
+            await future
+
+    async def get_history_page(self, user_id, limit=10, before=None, after=None):
+        """
+        Страница истории с keyset-пагинацией, от новых записей к старым.
+
+        before/after - курсор (date, id) записи, от которой листаем к более
+        старым или более новым записям. Возвращает (rows, has_older, has_newer);
+        в строках вместо полных текстов - превью по 100 символов.
+        """
+        self._schedule_flush()
+        return await self._db.run(self._get_history_page, user_id, limit, before, after)
+
+    async def search(self, user_id, query, limit=5, offset=0):
+        """
+        Полнотекстовый поиск по запросам и ответам пользователя, лучшие
+        совпадения (bm25) первыми. Возвращает (rows, has_more); строки в том же
+        виде, что и у get_history_page
+        """
+        match = make_match_query(user_id, query)
+        if match is None:
+            return [], False
+        self._schedule_flush()
+        return await self._db.run(self._search, match, limit, offset)
+
+    async def export(self, user_id, writer, chunk_size=500):
+        """
+        Выгружает все записи пользователя с полными текстами, от старых к
+        новым, в writer (export.ExportWriter). Записи читаются пачками по
+        chunk_size с keyset-курсором: память не зависит от размера истории,
+        а между пачками поток базы обслуживает остальные запросы.
+        Возвращает число выгруженных записей
+        """
+        self._schedule_flush()
+        exported = writer.count
+        after = ('', 0)
+        while after is not None:
+            after = await self._db.run(self._export_chunk, user_id, after, chunk_size, writer)
+        return writer.count - exported
+
+    async def clear(self, user_id):
+        self._schedule_flush()
+        await self._db.run(self._clear, user_id)
+
+    async def apply_retention(self):
+        """
+        Один проход очистки по сроку хранения и лимиту записей на
+        пользователя, затем incremental vacuum. Возвращает, сколько записей
+        убрано из истории
+        """
+        if not self.retention_enabled:
+            return 0
+        retired = 0
+
+        if self.max_age_days:
+            before = (datetime.now() - timedelta(days=self.max_age_days)).isoformat()
+            while True:
+                count = await self._db.run(self._retire_expired, before)
+                retired += count
+                if count < self.retention_batch:
+                    break
+
+        if self.max_rows_per_user:
+            users = set()
+            if self._checked_id is None:
+                checked_id = await self._db.run(self._last_id)
+                # Пользователи обходятся по индексу частями, каждая часть - отдельный запрос.
+                # id пользователей Telegram положительные
+                after_user = 0
+                while after_user is not None:
+                    over_cap, after_user = await self._db.run(self._users_over_cap, after_user)
+                    users.update(over_cap)
+                self._checked_id = checked_id
+            else:
+                # Дальше проверяются только пользователи с новыми записями - в том числе
+                # записанными другими процессами (воркерами шардинга)
+                while True:
+                    found, checked_id = await self._db.run(self._recent_users, self._checked_id)
+                    if checked_id is None:
+                        break
+                    users.update(found)
+                    self._checked_id = checked_id
+            for user_id in users:
+                while True:
+                    count = await self._db.run(self._retire_over_cap, user_id)
+                    retired += count
+                    if count < self.retention_batch:
+                        break
+
+        self.rows_retired += retired
+        if retired:
+            # Индекс и свободные страницы обрабатываются понемногу, чтобы не держать блокировку записи
+            while await self._db.run(self._merge_step):
+                pass
+            while True:
+                free_pages = await self._db.run(self._vacuum_step)
+                if not free_pages:
+                    break
+            if free_pages is None and not self._vacuum_warned:
+                self._vacuum_warned = True
+                logging.info("База истории создана без auto_vacuum=INCREMENTAL: место от удаленных записей "
+                             "переиспользуется, но файл не уменьшится до ручного VACUUM")
+        return retired
+
+    async def close(self):
+        # Последние строки повторяем, пока база временно недоступна, но не дольше CLOSE_RETRY_TIMEOUT
+        deadline = time.monotonic() + CLOSE_RETRY_TIMEOUT
+        while True:
+            try:
+                await self.flush()
+                break
+            except Exception as e:
+                if not _retryable(e) or time.monotonic() >= deadline:
+                    break
+                await asyncio.sleep(self._retry_delay)
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if self._buffer:
+            self.rows_dropped += len(self._buffer)
+            logging.error("При остановке не записано %s строк истории", len(self._buffer))
+            self._buffer = []
+        await self._db.close()
@@ -0,0 +1,160 @@
+"""
+Статистика использования бота по базе истории: сколько запросов каждого
+типа и сколько разных пользователей было за каждый день.
+
+База открывается только на чтение и читается одним проходом по таблице
+history в порядке id, так что скрипт можно запускать на рабочей базе
+рядом с ботом. В памяти только счетчики по дням и пользователи последних
+дней: записи добавляются в историю по времени, поэтому день, от которого
+ушли дальше чем на USERS_WINDOW_DAYS, уже не встретится и его множество
+пользователей заменяется числом.
+
+Запуск из каталога freelance-telegram-bot (архив HISTORY_ARCHIVE_PATH
+читается так же):
+    python history_stats.py bot_history.db
+    python history_stats.py bot_history.db --bytes --csv > stats.csv
+"""
+import argparse
+import csv
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+# Сколько последних дней держать множества пользователей
+USERS_WINDOW_DAYS = 2
+# Сколько строк забирать из курсора за раз
+FETCH_SIZE = 5000
+
+
+class DayStats:
+    __slots__ = ('requests', 'by_type', 'input_bytes', 'output_bytes', 'users', 'user_ids')
+
+    def __init__(self):
+        self.requests = 0
+        self.by_type = {}
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.users = 0
+        self.user_ids = set()
+
+
+def collect(conn, with_bytes=False):
+    """
+    Считает статистику одним проходом. Возвращает (days, late): days -
+    словарь день -> DayStats, late - сколько записей пришло в день, который
+    уже был закрыт (пользователи таких дней могли посчитаться дважды)
+    """
+    if with_bytes:
+        # Размеры лежат рядом с телами в blobs; сами тела не читаются и не распаковываются
+        query = '''
+            SELECT h.date, h.request_type, h.user_id, i.size, o.size
+            FROM history h
+            JOIN blobs i ON i.hash = h.input_hash
+            JOIN blobs o ON o.hash = h.output_hash
+            ORDER BY h.id
+        '''
+    else:
+        query = 'SELECT date, request_type, user_id, 0, 0 FROM history ORDER BY id'
+
+    days = {}
+    open_days = []
+    # Дни, которые пришлось открыть заново: все их следующие записи пришли не по порядку
+    reopened = set()
+    newest = ''
+    late = 0
+    cursor = conn.execute(query)
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            break
+        for record_date, request_type, user_id, input_size, output_size in rows:
+            day = record_date[:10]
+            stats = days.get(day)
+            if stats is None:
+                stats = days[day] = DayStats()
+                open_days.append(day)
+            elif stats.user_ids is None:
+                stats.user_ids = set()
+                open_days.append(day)
+                reopened.add(day)
+            if day in reopened:
+                late += 1
+            stats.requests += 1
+            stats.by_type[request_type] = stats.by_type.get(request_type, 0) + 1
+            stats.input_bytes += input_size
+            stats.output_bytes += output_size
+            stats.user_ids.add(user_id)
+
+            if day > newest:
+                newest = day
+                _close_days(days, open_days, newest)
+
+    for day in open_days:
+        _close_day(days[day])
+    return days, late
+
+
+def _close_days(days, open_days, newest):
+    border = (date.fromisoformat(newest) - timedelta(days=USERS_WINDOW_DAYS - 1)).isoformat()
+    for day in [day for day in open_days if day < border]:
+        _close_day(days[day])
+        open_days.remove(day)
+
+
+def _close_day(stats):
+    stats.users += len(stats.user_ids)
+    stats.user_ids = None
+
+
+def write_table(days, request_types, with_bytes, out):
+    columns = ['day', 'requests', 'users', *request_types]
+    if with_bytes:
+        columns += ['input_kb', 'output_kb']
+    widths = [max(len(column), 10) for column in columns]
+    out.write('  '.join(column.rjust(width) for column, width in zip(columns, widths)) + '\n')
+    for row in _rows(days, request_types, with_bytes):
+        out.write('  '.join(str(value).rjust(width) for value, width in zip(row, widths)) + '\n')
+
+
+def write_csv(days, request_types, with_bytes, out):
+    writer = csv.writer(out)
+    columns = ['day', 'requests', 'users', *request_types]
+    if with_bytes:
+        columns += ['input_kb', 'output_kb']
+    writer.writerow(columns)
+    writer.writerows(_rows(days, request_types, with_bytes))
+
+
+def _rows(days, request_types, with_bytes):
+    for day in sorted(days):
+        stats = days[day]
+        row = [day, stats.requests, stats.users, *(stats.by_type.get(name, 0) for name in request_types)]
+        if with_bytes:
+            row += [stats.input_bytes // 1024, stats.output_bytes // 1024]
+        yield row
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Статистика использования по базе истории')
+    parser.add_argument('path', nargs='?', default='bot_history.db')
+    parser.add_argument('--bytes', action='store_true', help='объем запросов и ответов (читает размеры из blobs)')
+    parser.add_argument('--csv', action='store_true', help='вывести CSV вместо таблицы')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(f'file:{args.path}?mode=ro', uri=True)
+    try:
+        days, late = collect(conn, args.bytes)
+    finally:
+        conn.close()
+
+    request_types = sorted({name for stats in days.values() for name in stats.by_type})
+    if args.csv:
+        write_csv(days, request_types, args.bytes, sys.stdout)
+    else:
+        write_table(days, request_types, args.bytes, sys.stdout)
+    if late:
+        print(f'Записей не по порядку дат: {late}; пользователи этих дней могут быть завышены', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
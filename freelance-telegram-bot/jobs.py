@@ -0,0 +1,217 @@
+import asyncio
+import itertools
+import json
+import logging
+import sqlite3
+import time
+
+from db_thread import DBThread
+from metrics import REGISTRY
+
+JOBS_FINISHED = REGISTRY.counter('bot_jobs_total', 'Фоновые задачи по результату', ('status',))
+JOB_WAIT = REGISTRY.histogram(
+    'bot_job_wait_seconds', 'Сколько фоновая задача ждала воркера',
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+
+class Job:
+    __slots__ = ('id', 'user_id', 'kind', 'payload', 'attempts', 'created_at')
+
+    def __init__(self, id, user_id, kind, payload, attempts=0, created_at=None):
+        self.id = id
+        self.user_id = user_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.created_at = time.time() if created_at is None else created_at
+
+
+class JobQueue:
+    """
+    Очередь фоновых задач.
+
+    submit() записывает задачу и сразу возвращается, а workers воркеров
+    выполняют задачи функцией runner(job). Задача хранится в SQLite (в
+    отдельном потоке, как FSM и история), пока runner не завершится, поэтому
+    задачи, которые не успели выполниться до остановки, выполняются после
+    перезапуска. Задача может выполниться повторно, если бот остановился
+    посреди нее. Упавшая задача повторяется до max_attempts раз.
+    path=None - очередь только в памяти.
+    """
+
+    def __init__(self, runner, path='bot_jobs.db', workers=8, max_attempts=3, retry_delay=5.0):
+        self.runner = runner
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+        self._db = DBThread(self._open_db, 'jobs-db') if path else None
+        self._queue = asyncio.Queue()
+        self._ids = itertools.count(1)
+        self._tasks = []
+        self._busy = set()
+        self._closed = False
+
+        self.submitted = 0
+        self.restored = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _open_db(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        return conn
+
+    def _db_pending(self):
+        return self._db.connect().execute(
+            'SELECT id, user_id, kind, payload, attempts, created_at FROM jobs ORDER BY id'
+        ).fetchall()
+
+    def _db_insert(self, user_id, kind, payload, created_at):
+        conn = self._db.connect()
+        with conn:
+            return conn.execute(
+                'INSERT INTO jobs (user_id, kind, payload, created_at) VALUES (?, ?, ?, ?)',
+                (user_id, kind, payload, created_at),
+            ).lastrowid
+
+    def _db_attempt(self, job_id):
+        conn = self._db.connect()
+        with conn:
+            conn.execute('UPDATE jobs SET attempts = attempts + 1 WHERE id = ?', (job_id,))
+
+    def _db_delete(self, job_id):
+        conn = self._db.connect()
+        with conn:
+            conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def running(self):
+        return len(self._busy)
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'running': self.running,
+            'submitted': self.submitted,
+            'restored': self.restored,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+    async def start(self):
+        """
+        Возвращает в очередь задачи, оставшиеся с прошлого запуска, и запускает воркеры
+        """
+        if self._db is not None:
+            for job_id, user_id, kind, payload, attempts, created_at in await self._db.run(self._db_pending):
+                self._queue.put_nowait(Job(job_id, user_id, kind, json.loads(payload), attempts, created_at))
+                self.restored += 1
+            if self.restored:
+                logging.info("Восстановлено фоновых задач: %s", self.restored)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def submit(self, user_id, kind, payload):
+        """
+        Ставит задачу в очередь. payload - словарь, который можно записать в JSON
+        """
+        job = Job(None, user_id, kind, payload)
+        if self._db is not None:
+            job.id = await self._db.run(
+                self._db_insert, user_id, kind, json.dumps(payload, ensure_ascii=False), job.created_at
+            )
+        else:
+            job.id = next(self._ids)
+        self.submitted += 1
+        self._queue.put_nowait(job)
+        return job.id
+
+    async def _work(self):
+        while not self._closed:
+            job = await self._queue.get()
+            task = asyncio.current_task()
+            self._busy.add(task)
+            try:
+                await self._execute(job)
+            except Exception:
+                # Например, база задач недоступна: воркер должен пережить ошибку, иначе пул тихо уменьшится
+                logging.exception("Ошибка воркера фоновых задач на задаче %s (%s)", job.id, job.kind)
+            finally:
+                self._busy.discard(task)
+
+    async def _execute(self, job):
+        JOB_WAIT.observe(max(0.0, time.time() - job.created_at))
+        if job.attempts >= self.max_attempts:
+            logging.error("Фоновая задача %s (%s) не выполнена за %s попыток", job.id, job.kind, job.attempts)
+            await self._finish(job, 'failed')
+            return
+
+        # Попытка записывается до запуска: если бот упадет посреди задачи,
+        # после перезапуска она не будет повторяться бесконечно
+        job.attempts += 1
+        if self._db is not None:
+            await self._db.run(self._db_attempt, job.id)
+
+        try:
+            await self.runner(job)
+        except asyncio.CancelledError:
+            # Остановка бота: задача остается в базе и выполнится после перезапуска
+            raise
+        except Exception:
+            logging.exception("Ошибка фоновой задачи %s (%s), попытка %s", job.id, job.kind, job.attempts)
+            if job.attempts < self.max_attempts and not self._closed:
+                asyncio.get_running_loop().call_later(self.retry_delay * job.attempts, self._retry, job)
+            elif job.attempts >= self.max_attempts:
+                await self._finish(job, 'failed')
+            return
+        await self._finish(job, 'ok')
+
+    def _retry(self, job):
+        if not self._closed:
+            self._queue.put_nowait(job)
+
+    async def _finish(self, job, status):
+        if self._db is not None:
+            await self._db.run(self._db_delete, job.id)
+        if status == 'ok':
+            self.completed += 1
+        else:
+            self.failed += 1
+        JOBS_FINISHED.inc(status=status)
+
+    async def close(self, timeout=30.0):
+        """
+        Останавливает воркеры: начатые задачи получают timeout секунд на
+        завершение, ожидающие остаются в базе до следующего запуска
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for task in self._tasks:
+            if task not in self._busy:
+                task.cancel()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._db is not None:
+            await self._db.close()
@@ -1,228 +1,453 @@
 import os
 import logging
 import asyncio
-import aiohttp
-import uuid
-import sqlite3
+import tempfile
 from datetime import datetime
-from aiogram import Bot, Dispatcher, types
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, KeyboardButton
-from aiogram.filters import Command
-from aiogram.fsm.state import State, StatesGroup
+from aiogram import Bot, Dispatcher, Router, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNotFound
+from aiogram.types import FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
 from dotenv import load_dotenv
 
+from cache import ResponseCache
+from conversation import append_turn, build_messages
+from flows import (
+    FLOW_STEPS,
+    FLOWS,
+    FLOWS_BY_ACTION,
+    FLOWS_BY_TYPE,
+    MAIN_KEYBOARD,
+    MAIN_MENU_BUTTON,
+    QUESTION_KEYBOARD,
+    REGENERATE_KEYBOARD,
+    START_KEYBOARD,
+    FreeQuestion,
+    HistoryPage,
+    SearchPage,
+    history_title,
+    regenerate_title,
+)
+from fsm_storage import SQLiteStorage
+from gigachat import (
+    AUTH_URL,
+    CHAT_URL,
+    GigaChatClient,
+    GigaChatError,
+    GigaChatTimeoutError,
+    GigaChatUnavailableError,
+)
+from export import EXPORT_FORMATS, ExportWriter
+from history import HistoryStore
+from jobs import JobQueue
+from metrics import REGISTRY, HandlerMetricsMiddleware, monitor_loop_lag, start_metrics_server
+from prompts import DEFAULT_MAX_TOKENS, REPHRASE_QUESTION, max_tokens_for
+from ratelimit import RateLimitMiddleware, TokenBucketLimiter, parse_rate
+from scheduler import GenerationScheduler
+from streaming import EditThrottle, deliver, redeliver, safe_edit, send_text, split_message, stream_to_message
+
 # Загружаем переменные из .env файла
 load_dotenv()
 
 # Получаем токены
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Адрес Bot API; переопределяется для локального сервера или мока в бенчмарках
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
 GIGACHAT_CLIENT_ID = os.getenv("GIGACHAT_CLIENT_ID")
 GIGACHAT_CLIENT_SECRET = os.getenv("GIGACHAT_CLIENT_SECRET")
+GIGACHAT_AUTH_URL = os.getenv("GIGACHAT_AUTH_URL", AUTH_URL)
+GIGACHAT_CHAT_URL = os.getenv("GIGACHAT_CHAT_URL", CHAT_URL)
+
+# Таймауты (в секундах), повторы и circuit breaker для запросов к GigaChat
+GIGACHAT_CONNECT_TIMEOUT = float(os.getenv("GIGACHAT_CONNECT_TIMEOUT", "5"))
+GIGACHAT_READ_TIMEOUT = float(os.getenv("GIGACHAT_READ_TIMEOUT", "60"))
+GIGACHAT_TOTAL_TIMEOUT = float(os.getenv("GIGACHAT_TOTAL_TIMEOUT", "120"))
+GIGACHAT_MAX_RETRIES = int(os.getenv("GIGACHAT_MAX_RETRIES", "3"))
+GIGACHAT_BREAKER_THRESHOLD = int(os.getenv("GIGACHAT_BREAKER_THRESHOLD", "5"))
+GIGACHAT_BREAKER_RESET = float(os.getenv("GIGACHAT_BREAKER_RESET", "30"))
+# Поддерживает ли API параметр n (несколько вариантов ответа одним запросом)
+GIGACHAT_SUPPORTS_N = os.getenv("GIGACHAT_SUPPORTS_N", "1") == "1"
+
+# Потоковая генерация с постепенным редактированием сообщения
+GIGACHAT_STREAMING = os.getenv("GIGACHAT_STREAMING", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook.
+# В режиме webhook несколько процессов за балансировщиком должны
+# получать апдейты одного пользователя в один и тот же процесс
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Хранилище состояний диалогов: sqlite (переживает перезапуск) или memory
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "bot_fsm.db")
+FSM_TTL_HOURS = float(os.getenv("FSM_TTL_HOURS", "24"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+
+# База истории запросов
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", "bot_history.db")
+# Новые записи истории пишутся пачками: по HISTORY_BATCH_SIZE строк или раз в HISTORY_FLUSH_INTERVAL_MS
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "50"))
+HISTORY_FLUSH_INTERVAL_MS = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "200"))
+
+# Сколько запросов к GigaChat может выполняться одновременно. Лимит общий на бота:
+# в многопроцессном режиме (sharding.py) он делится между воркерами
+MAX_CONCURRENT_GENERATIONS = int(os.getenv("MAX_CONCURRENT_GENERATIONS", "8"))
+
+# Кэш ответов для повторяющихся промптов (включается явно)
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(24 * 60 * 60)))
+RESPONSE_CACHE_MAX_MB = int(os.getenv("RESPONSE_CACHE_MAX_MB", "16"))
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "")
+
+# Ограничение частоты действий одного пользователя: "N/секунд", 0 - без ограничения.
+# Отдельно для самых дорогих кнопок (каждое нажатие - запрос к GigaChat)
+RATE_LIMIT_REGENERATE = os.getenv("RATE_LIMIT_REGENERATE", "3/30")
+RATE_LIMIT_REPHRASE = os.getenv("RATE_LIMIT_REPHRASE", "3/30")
+RATE_LIMIT_CALLBACK = os.getenv("RATE_LIMIT_CALLBACK", "20/10")
+RATE_LIMIT_MESSAGE = os.getenv("RATE_LIMIT_MESSAGE", "20/10")
+
+# "Сгенерировать заново" заранее получает REGENERATE_VARIANTS вариантов (1 - выключено):
+# первый показывается сразу, остальные ждут следующих нажатий в FSM.
+# Лишние варианты тратят токены, поэтому их число на пользователя ограничено
+# REGENERATE_VARIANT_BUDGET ("N/секунд", 0 - без ограничения)
+REGENERATE_VARIANTS = int(os.getenv("REGENERATE_VARIANTS", "1"))
+REGENERATE_VARIANT_BUDGET = os.getenv("REGENERATE_VARIANT_BUDGET", "10/3600")
+
+# Сценарии, ответ на которые генерируется фоновой задачей (типы через запятую,
+# например "resume_improvement"): обработчик сразу отвечает и освобождается,
+# а результат приходит отдельным сообщением. Задачи хранятся в JOBS_DB_PATH
+# и выполняются после перезапуска, если не успели до остановки.
+# JOB_WORKERS - сколько задач выполняется одновременно (как и лимит генераций,
+# делится между воркерами sharding.py), JOB_DRAIN_TIMEOUT - сколько секунд при
+# остановке ждать уже начатые задачи
+BACKGROUND_FLOWS = {name.strip() for name in os.getenv("BACKGROUND_FLOWS", "").split(",") if name.strip()}
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "bot_jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", str(MAX_CONCURRENT_GENERATIONS)))
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", "30"))
+
+# Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (0 - выключено).
+# Обработчики дольше SLOW_REQUEST_MS пишутся в лог slow_requests (доля SLOW_REQUEST_SAMPLE)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "2000"))
+SLOW_REQUEST_SAMPLE = float(os.getenv("SLOW_REQUEST_SAMPLE", "1.0"))
+
+# /export читает историю из базы пачками по EXPORT_CHUNK_SIZE записей
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "500"))
+# Больше Bot API не дает отправить файлом
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+
+# Срок хранения истории: записи старше HISTORY_MAX_AGE_DAYS дней и сверх
+# HISTORY_MAX_ROWS_PER_USER последних записей пользователя (0 - без ограничения)
+# раз в HISTORY_RETENTION_INTERVAL секунд переносятся в HISTORY_ARCHIVE_PATH
+# (пустая строка - удаляются без архива); за одну транзакцию - не больше
+# HISTORY_RETENTION_BATCH записей
+HISTORY_MAX_AGE_DAYS = float(os.getenv("HISTORY_MAX_AGE_DAYS", "0"))
+HISTORY_MAX_ROWS_PER_USER = int(os.getenv("HISTORY_MAX_ROWS_PER_USER", "0"))
+HISTORY_ARCHIVE_PATH = os.getenv("HISTORY_ARCHIVE_PATH", "bot_history_archive.db")
+HISTORY_RETENTION_INTERVAL = float(os.getenv("HISTORY_RETENTION_INTERVAL", "3600"))
+HISTORY_RETENTION_BATCH = int(os.getenv("HISTORY_RETENTION_BATCH", "500"))
+
+# Сколько токенов ввода пользователя отправлять в одном промпте; длинный ввод
+# обрезается. 0 - бюджет по умолчанию для каждого типа запроса (prompts.py)
+PROMPT_INPUT_BUDGET = int(os.getenv("PROMPT_INPUT_BUDGET", "0")) or None
+
+# Память диалога в режиме "Задать вопрос": сколько последних сообщений хранить,
+# до скольких токенов укорачивать каждое и сколько токенов контекста отправлять
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "10"))
+CONVERSATION_MESSAGE_TOKENS = int(os.getenv("CONVERSATION_MESSAGE_TOKENS", "300"))
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "2000"))
+
+# Объекты приложения создаются в create_app(), а не при импорте: модуль можно
+# импортировать без токенов (в тестах, бенчмарках, воркерах до fork), а
+# соединения и пулы потоков появляются только у работающего бота
+bot = None
+dp = None
+storage = None
+gigachat = None
+edit_throttle = None
+generation_scheduler = None
+response_cache = None
+history_store = None
+rate_limiter = None
+variant_budget = None
+job_queue = None
+
+# Обработчики регистрируются на роутере, диспетчер подключает его в create_app()
+router = Router()
+
+
+# Текущее состояние очередей для /metrics
+# (метрики отдаются только после create_app, когда все объекты уже созданы)
+REGISTRY.gauge('bot_generations_running', 'Запросы к GigaChat, которые выполняются сейчас',
+               lambda: generation_scheduler.stats()['running'])
+REGISTRY.gauge('bot_generation_queue_depth', 'Запросы к GigaChat, ожидающие в очереди',
+               lambda: generation_scheduler.stats()['queue_depth'])
+REGISTRY.gauge('bot_rate_limit_buckets', 'Активные ведра ограничения частоты', lambda: len(rate_limiter))
+REGISTRY.gauge('bot_history_queue_depth', 'Строки истории, еще не записанные в базу',
+               lambda: history_store.queue_depth)
+REGISTRY.gauge('bot_job_queue_depth', 'Фоновые задачи, ожидающие воркера',
+               lambda: job_queue.queue_depth if job_queue is not None else 0)
+REGENERATE_SERVED = REGISTRY.counter(
+    'bot_regenerate_total', 'Нажатия "Сгенерировать заново" по источнику варианта', ('source',),
+)
+
+# Порт метрик можно переопределить в create_app (у каждого воркера шардинга свой)
+metrics_port = METRICS_PORT
+metrics_runner = None
+loop_lag_task = None
+retention_task = None
+retention_here = True
+
+
+# Функция для сохранения запроса в историю
+async def save_to_history(user_id, request_type, input_data, output_data):
+    await history_store.add(user_id, request_type, input_data, output_data)
+
+
+# Сколько записей истории показываем на одной странице
+HISTORY_PAGE_SIZE = 10
+# Сколько найденных записей показываем на одной странице /search
+HISTORY_SEARCH_PAGE_SIZE = 5
+
+
+# Функция для запроса к GigaChat
+async def generate_with_gigachat(prompt, max_tokens=DEFAULT_MAX_TOKENS):
+    """
+    Генерация текста через GigaChat API.
+    При ошибке выбрасывает GigaChatError
+    """
+    return await gigachat.complete(prompt, max_tokens=max_tokens)
+
 
-# Проверяем, что токены загружены
-if not all([BOT_TOKEN, GIGACHAT_CLIENT_ID, GIGACHAT_CLIENT_SECRET]):
-    exit("Ошибка: не все необходимые токены заданы в .env файле")
-
-# Включаем логирование
-logging.basicConfig(level=logging.INFO)
-
-# Инициализируем бота и диспетчер
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-
-
-# Инициализация базы данных
-def init_db():
-    conn = sqlite3.connect('bot_history.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            date TEXT NOT NULL,
-            request_type TEXT NOT NULL,
-            input_data TEXT NOT NULL,
-            output_data TEXT NOT NULL
+# Текст ошибки генерации для пользователя
+def format_gigachat_error(error):
+    if isinstance(error, GigaChatUnavailableError):
+        return "❌ GigaChat сейчас недоступен, попробуй через минуту."
+    if isinstance(error, GigaChatTimeoutError):
+        return "❌ GigaChat не ответил вовремя, попробуй еще раз."
+    return f"❌ Ошибка при запросе к GigaChat: {error}"
+
+
+# Функция для генерации ответа с выводом в чат
+async def generate_reply(message, placeholder_text, title, prompt, reply_markup, cache_type=None,
+                         max_tokens=DEFAULT_MAX_TOKENS):
+    """
+    Отправляет сообщение-заглушку и выводит в чат ответ GigaChat.
+
+    В потоковом режиме заглушка постепенно редактируется по мере генерации.
+    Если стрим недоступен или оборвался, используется обычный запрос.
+    Если передан cache_type и кэш включен, ответ сначала ищется в кэше.
+    max_tokens - предел длины ответа для этого типа запроса.
+    При ошибке генерации показывает ее пользователю и возвращает None.
+    """
+    use_cache = response_cache is not None and cache_type is not None
+    if use_cache:
+        cached = await response_cache.get(cache_type, prompt)
+        if cached is not None:
+            await deliver(message, f"{title}{cached}", reply_markup=reply_markup)
+            return cached
+
+    response = await _generate_reply(message, placeholder_text, title, prompt, reply_markup, max_tokens)
+
+    if use_cache and response is not None:
+        await response_cache.set(cache_type, prompt, response)
+    return response
+
+
+async def _generate_reply(message, placeholder_text, title, prompt, reply_markup, max_tokens):
+    placeholder = await message.answer(placeholder_text)
+    queued = False
+    delivered = False
+
+    async def show_position(position):
+        nonlocal queued
+        queued = True
+        await show_queue_position(placeholder, position)
+
+    async def generate():
+        nonlocal delivered
+        delivered = True
+
+        if GIGACHAT_STREAMING:
+            try:
+                response = await stream_to_message(
+                    placeholder, gigachat.stream(prompt, max_tokens=max_tokens), title, edit_throttle, reply_markup=reply_markup
+                )
+                if response:
+                    return response
+            except GigaChatError as e:
+                # Временные сбои клиент уже повторял - обычный запрос их не исправит.
+                # Ошибки разбора потока клиент отдает как GigaChatResponseError, а ошибки
+                # Telegram (например, сообщение удалено) обычный запрос тоже не исправит
+                if e.retryable or isinstance(e, GigaChatUnavailableError):
+                    raise
+                logging.warning("Потоковая генерация не удалась, переходим на обычный запрос: %s", e)
+
+            response = await generate_with_gigachat(prompt, max_tokens)
+            await deliver(placeholder, f"{title}{response}", reply_markup=reply_markup, edit=True)
+            return response
+
+        if queued:
+            await safe_edit(placeholder, placeholder_text)
+        response = await generate_with_gigachat(prompt, max_tokens)
+        await deliver(message, f"{title}{response}", reply_markup=reply_markup)
+        return response
+
+    try:
+        response = await generation_scheduler.run(
+            message.from_user.id, ("reply", request_key(prompt)), generate, on_position=show_position
         )
-    ''')
-    conn.commit()
-    conn.close()
+    except GigaChatError as e:
+        logging.warning("Ошибка генерации для пользователя %s: %r", message.from_user.id, e)
+        await safe_edit(placeholder, format_gigachat_error(e))
+        return None
+    finally:
+        # Место в очереди отмечает чат в троттлинге и без потоковой генерации -
+        # убираем его, иначе запись о чате остается навсегда
+        edit_throttle.forget(placeholder.chat.id)
+
+    if not delivered:
+        # Такой же запрос уже выполнялся - показываем его результат
+        await deliver(placeholder, f"{title}{response}", reply_markup=reply_markup, edit=True)
+    return response
+
+
+# Ключ одинаковых запросов для очереди: промпт - строка или список сообщений диалога
+def request_key(prompt):
+    if isinstance(prompt, str):
+        return prompt
+    return tuple((message["role"], message["content"]) for message in prompt)
+
+
+# Функция для перегенерации через очередь без вывода в чат.
+# Повторные нажатия кнопки, пока генерация еще идет, получают тот же результат
+async def generate_for_user(user_id, prompt, max_tokens=DEFAULT_MAX_TOKENS):
+    return await generation_scheduler.run(
+        user_id, ("regenerate", request_key(prompt)), lambda: generate_with_gigachat(prompt, max_tokens)
+    )
 
 
-# Функция для сохранения запроса в историю
-def save_to_history(user_id, request_type, input_data, output_data):
-    conn = sqlite3.connect('bot_history.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO history (user_id, date, request_type, input_data, output_data)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, datetime.now().isoformat(), request_type, input_data, output_data))
-    conn.commit()
-    conn.close()
+# Функция для генерации сразу нескольких вариантов для "Сгенерировать заново"
+async def generate_variants_for_user(user_id, prompt, max_tokens, n):
+    return await generation_scheduler.run(
+        user_id, ("variants", request_key(prompt), n), lambda: gigachat.complete_many(prompt, n, max_tokens=max_tokens)
+    )
+
 
+# Сколько лишних вариантов можно сгенерировать пользователю, не выходя из бюджета
+def take_variant_budget(user_id, wanted):
+    taken = 0
+    while taken < wanted and variant_budget.hit(user_id, "variant")[0]:
+        taken += 1
+    return taken
 
-# Функция для получения истории пользователя
-def get_user_history(user_id, limit=10):
-    conn = sqlite3.connect('bot_history.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM history 
-        WHERE user_id = ? 
-        ORDER BY date DESC 
-        LIMIT ?
-    ''', (user_id, limit))
-    history = cursor.fetchall()
-    conn.close()
-    return history
 
+# Показываем пользователю его место в очереди на генерацию
+async def show_queue_position(placeholder, position):
+    chat_id = placeholder.chat.id
+    if edit_throttle.delay(chat_id) > 0:
+        return
+    edit_throttle.mark(chat_id)
+    await safe_edit(placeholder, f"⏳ Сейчас много запросов, ты в очереди: {position}")
 
-# Инициализируем базу данных при запуске
-init_db()
 
+# Клавиатура страницы истории: курсор кнопок листания - дата и id крайней записи на странице
+def get_history_keyboard(older=None, newer=None):
+    buttons = []
 
-# Создаем состояния для FSM
-class ResponseToVacancy(StatesGroup):
-    waiting_for_vacancy = State()
-    waiting_for_skills = State()
+    navigation = []
+    if newer:
+        navigation.append(InlineKeyboardButton(
+            text="⬅️ Новее", callback_data=HistoryPage(direction="newer", date=newer[0], record_id=newer[1]).pack()
+        ))
+    if older:
+        navigation.append(InlineKeyboardButton(
+            text="Старше ➡️", callback_data=HistoryPage(direction="older", date=older[0], record_id=older[1]).pack()
+        ))
+    if navigation:
+        buttons.append(navigation)
 
+    buttons.append([InlineKeyboardButton(text="🗑️ Очистить историю", callback_data="clear_history")])
+    buttons.append([MAIN_MENU_BUTTON])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-class ShortText(StatesGroup):
-    waiting_for_request = State()
 
+def get_search_keyboard(previous_offset=None, next_offset=None):
+    navigation = []
+    if previous_offset is not None:
+        navigation.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=SearchPage(offset=previous_offset).pack()))
+    if next_offset is not None:
+        navigation.append(InlineKeyboardButton(text="Дальше ➡️", callback_data=SearchPage(offset=next_offset).pack()))
 
-class ImproveResume(StatesGroup):
-    waiting_for_resume = State()
+    buttons = [navigation] if navigation else []
+    buttons.append([MAIN_MENU_BUTTON])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-class FreeQuestion(StatesGroup):
-    waiting_for_question = State()
+# Таблицы маршрутов: callback_data кнопки или текст кнопки клавиатуры -> обработчик.
+# Апдейт разбирается одним поиском в словаре вместо цепочки фильтров, поэтому
+# новые кнопки и сценарии не добавляют работы на каждый апдейт
+CALLBACK_ROUTES = {}
+TEXT_ROUTES = {}
 
 
-# Функция для запроса к GigaChat
-async def generate_with_gigachat(prompt):
-    """
-    Генерация текста через GigaChat API
-    """
-    try:
-        # 1. Получаем access token
-        auth_url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-        auth_headers = {
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Accept': 'application/json',
-            'RqUID': str(uuid.uuid4()),
-        }
-        auth_data = {
-            'scope': 'GIGACHAT_API_PERS',
-        }
-
-        # Используем aiohttp для асинхронного запроса
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                    auth_url,
-                    headers=auth_headers,
-                    data=auth_data,
-                    auth=aiohttp.BasicAuth(GIGACHAT_CLIENT_ID, GIGACHAT_CLIENT_SECRET),
-                    ssl=False
-            ) as auth_response:
-
-                if auth_response.status != 200:
-                    return f"❌ Ошибка аутентификации: {auth_response.status}"
-
-                auth_result = await auth_response.json()
-                access_token = auth_result['access_token']
-
-                # 2. Отправляем запрос к GigaChat
-                chat_url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
-                chat_headers = {
-                    'Content-Type': 'application/json',
-                    'Authorization': f'Bearer {access_token}',
-                }
-                chat_data = {
-                    "model": "GigaChat",
-                    "messages": [
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    "temperature": 0.7,
-                    "max_tokens": 2000
-                }
-
-                async with session.post(
-                        chat_url,
-                        headers=chat_headers,
-                        json=chat_data,
-                        ssl=False
-                ) as chat_response:
-
-                    if chat_response.status == 200:
-                        result = await chat_response.json()
-                        return result['choices'][0]['message']['content']
-                    else:
-                        error_text = await chat_response.text()
-                        return f"❌ Ошибка GigaChat API: {chat_response.status} - {error_text}"
+def on_callback(data):
+    def register(handler):
+        CALLBACK_ROUTES[data] = handler
+        return handler
+    return register
+
+
+def on_text(text):
+    def register(handler):
+        TEXT_ROUTES[text] = handler
+        return handler
+    return register
 
-    except Exception as e:
-        return f"❌ Ошибка при запросе к GigaChat: {str(e)}"
-
-
-# Создаем клавиатуру с кнопками
-def get_main_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📝 Отклик на вакансию", callback_data="response_to_vacancy")],
-        [InlineKeyboardButton(text="✍️ Короткий текст", callback_data="short_text")],
-        [InlineKeyboardButton(text="📄 Улучшить резюме", callback_data="improve_resume")],
-        [InlineKeyboardButton(text="💬 Задать вопрос", callback_data="free_question")],
-        [InlineKeyboardButton(text="📊 История запросов", callback_data="history")],
-        [InlineKeyboardButton(text="❓ Помощь", callback_data="help")]
-    ])
-    return keyboard
-
-
-def get_regenerate_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔄 Сгенерировать заново", callback_data="regenerate")],
-        [InlineKeyboardButton(text="💾 Сохранить", callback_data="save")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-    ])
-    return keyboard
-
-
-def get_start_keyboard():
-    keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="🏠 Главное меню")],
-            [KeyboardButton(text="📊 История запросов")],
-            [KeyboardButton(text="💬 Задать вопрос")]
-        ],
-        resize_keyboard=True,
-        one_time_keyboard=False
-    )
-    return keyboard
 
+# Фильтры маршрутизации: найденный обработчик попадает в хендлер аргументом route
+def callback_route(callback_query: types.CallbackQuery):
+    route = CALLBACK_ROUTES.get(callback_query.data)
+    return {"route": route} if route is not None else False
 
-def get_history_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🗑️ Очистить историю", callback_data="clear_history")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-    ])
-    return keyboard
 
+def text_route(message: types.Message):
+    route = TEXT_ROUTES.get(message.text)
+    return {"route": route} if route is not None else False
 
-def get_question_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔄 Перефразировать", callback_data="rephrase_question")],
-        [InlineKeyboardButton(text="🏠 Главное меню", callback_data="main_menu")]
-    ])
-    return keyboard
+
+# Шаг сценария, которого ждет пользователь, - по строке состояния FSM
+def flow_step_route(message: types.Message, raw_state):
+    found = FLOW_STEPS.get(raw_state)
+    if found is None:
+        return False
+    flow, step = found
+    return {"flow": flow, "step": step}
+
+
+MAIN_MENU_TEXT = """
+🏠 Главное меню
+
+Выбери нужную опцию:
+• 📝 Отклик на вакансию
+• ✍️ Короткий текст  
+• 📄 Улучшить резюме
+• 💬 Задать вопрос
+• 📊 История запросов
+    """
 
 
 # Обработчик команды /start
-@dp.message(Command("start"))
+@router.message(Command("start"))
 async def cmd_start(message: types.Message):
     welcome_text = """
 🤖 Привет! Я AI-помощник для фрилансеров!
@@ -236,251 +461,345 @@ async def cmd_start(message: types.Message):
 
 Выбери нужную опцию ниже 👇
     """
-    await message.answer(welcome_text, reply_markup=get_main_keyboard())
-    await message.answer("Используй кнопки ниже для быстрого доступа:", reply_markup=get_start_keyboard())
+    await message.answer(welcome_text, reply_markup=MAIN_KEYBOARD)
+    await message.answer("Используй кнопки ниже для быстрого доступа:", reply_markup=START_KEYBOARD)
 
 
 # Обработчик команды /history
-@dp.message(Command("history"))
+@router.message(Command("history"))
 async def cmd_history(message: types.Message):
     await show_history(message.from_user.id, message)
 
 
-# Обработчик текстового сообщения "История запросов"
-@dp.message(lambda message: message.text == "📊 История запросов")
-async def process_history_text(message: types.Message):
-    await show_history(message.from_user.id, message)
+# Обработчик команды /search <запрос>
+@router.message(Command("search"))
+async def cmd_search(message: types.Message, command: CommandObject, state: FSMContext):
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("🔎 Напиши, что искать в истории, например:\n/search отклик python")
+        return
 
+    # Запрос не помещается в callback_data (64 байта), поэтому для листания храним его в FSM
+    await state.update_data(search_query=query)
+    await show_search_results(message.from_user.id, message, query)
 
-# Обработчик текстового сообщения "Задать вопрос"
-@dp.message(lambda message: message.text == "💬 Задать вопрос")
-async def process_question_text(message: types.Message, state: FSMContext):
-    await state.set_state(FreeQuestion.waiting_for_question)
-    await message.answer("💬 Задай любой вопрос, и я постараюсь на него ответить:")
 
+# Обработчик команды /export [jsonl|csv]
+@router.message(Command("export"))
+async def cmd_export(message: types.Message, command: CommandObject):
+    fmt = (command.args or "jsonl").strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        await message.answer("📤 Формат выгрузки: /export jsonl или /export csv")
+        return
 
-# Функция для отображения истории
-async def show_history(user_id, message):
-    history = get_user_history(user_id, limit=10)
+    user_id = message.from_user.id
+    # Записи пишутся во временный файл по мере чтения из базы, вся история в память не попадает
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=f".{fmt}")
+    try:
+        with open(fd, "w", encoding="utf-8", newline="") as out:
+            count = await history_store.export(user_id, ExportWriter(out, fmt), EXPORT_CHUNK_SIZE)
+        if not count:
+            await message.answer("📭 История запросов пуста.")
+            return
+        if os.path.getsize(path) > EXPORT_MAX_BYTES:
+            await message.answer("❌ История слишком большая для отправки файлом. Очисти старые запросы и попробуй снова.")
+            return
+        await message.answer_document(
+            FSInputFile(path, filename=f"history_{user_id}.{fmt}"),
+            caption=f"📤 История запросов: {count}",
+        )
+    except Exception as e:
+        logging.warning("Ошибка выгрузки истории пользователя %s: %r", user_id, e)
+        await message.answer("❌ Не удалось выгрузить историю. Попробуй позже.")
+    finally:
+        os.remove(path)
 
-    if not history:
-        await message.answer("📭 История запросов пуста.")
-        return
 
-    history_text = "📊 Последние 10 запросов:\n\n"
+# Кнопки клавиатуры под полем ввода
+@router.message(text_route)
+async def route_text(message: types.Message, state: FSMContext, route):
+    await route(message, state)
 
-    for i, record in enumerate(history, 1):
-        record_id, user_id, date, request_type, input_data, output_data = record
-        date_formatted = datetime.fromisoformat(date).strftime("%d.%m.%Y %H:%M")
 
-        # Определяем тип запроса
-        if request_type == "vacancy_response":
-            type_text = "📝 Отклик на вакансию"
-        elif request_type == "short_text":
-            type_text = "✍️ Короткий текст"
-        elif request_type == "resume_improvement":
-            type_text = "📄 Улучшение резюме"
-        elif request_type == "free_question":
-            type_text = "💬 Вопрос"
-        else:
-            type_text = request_type
+# Сообщение в сценарии генерации
+@router.message(flow_step_route)
+async def route_flow_step(message: types.Message, state: FSMContext, flow, step):
+    await process_flow_step(message, state, flow, step)
 
-        # Обрезаем длинные тексты для удобства чтения
-        short_input = input_data[:100] + "..." if len(input_data) > 100 else input_data
-        short_output = output_data[:100] + "..." if len(output_data) > 100 else output_data
 
-        history_text += f"{i}. {type_text}\n"
-        history_text += f"   📅 {date_formatted}\n"
-        history_text += f"   📥 Ввод: {short_input}\n"
-        history_text += f"   📤 Результат: {short_output}\n\n"
+# Кнопки без параметров
+@router.callback_query(callback_route)
+async def route_callback(callback_query: types.CallbackQuery, state: FSMContext, route):
+    await route(callback_query, state)
 
-    await message.answer(history_text, reply_markup=get_history_keyboard())
 
+# Обработчик текстового сообщения "История запросов"
+@on_text("📊 История запросов")
+async def process_history_text(message: types.Message, state: FSMContext):
+    await show_history(message.from_user.id, message)
 
-# Обработчик для кнопки "Очистить историю"
-@dp.callback_query(lambda c: c.data == 'clear_history')
-async def process_clear_history(callback_query: types.CallbackQuery):
-    user_id = callback_query.from_user.id
-    conn = sqlite3.connect('bot_history.db')
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM history WHERE user_id = ?', (user_id,))
-    conn.commit()
-    conn.close()
 
-    await callback_query.answer("🗑️ История очищена!")
-    await bot.send_message(user_id, "🗑️ История запросов очищена.")
+# Обработчик текстового сообщения "Задать вопрос"
+@on_text("💬 Задать вопрос")
+async def process_question_text(message: types.Message, state: FSMContext):
+    step = FLOWS_BY_TYPE["free_question"].steps[0]
+    await state.set_state(step.state)
+    # Каждый вход в режим - новый диалог; варианты прошлого текста больше не нужны
+    await state.update_data(conversation=[], variants=[])
+    await message.answer(step.question)
 
 
-# Обработчик текстового сообщения "Главное меню"
-@dp.message(lambda message: message.text == "🏠 Главное меню")
-async def process_main_menu_text(message: types.Message, state: FSMContext):
-    await state.clear()  # Очищаем состояние
-    welcome_text = """
-🏠 Главное меню
+# Строки одной записи истории для списка
+def format_history_record(i, record):
+    # Вместо полных текстов хранилище отдает готовые превью
+    record_id, user_id, date, request_type, short_input, short_output = record
+    date_formatted = datetime.fromisoformat(date).strftime("%d.%m.%Y %H:%M")
 
-Выбери нужную опцию:
-• 📝 Отклик на вакансию
-• ✍️ Короткий текст  
-• 📄 Улучшить резюме
-• 💬 Задать вопрос
-• 📊 История запросов
-    """
-    await message.answer(welcome_text, reply_markup=get_main_keyboard())
+    return [
+        f"{i}. {history_title(request_type)}",
+        f"   📅 {date_formatted}",
+        f"   📥 Ввод: {short_input}",
+        f"   📤 Результат: {short_output}\n",
+    ]
 
 
-# Обработчик для кнопки "Отклик на вакансию"
-@dp.callback_query(lambda c: c.data == 'response_to_vacancy')
-async def process_response_to_vacancy(callback_query: types.CallbackQuery, state: FSMContext):
-    await callback_query.answer()
-    await state.clear()  # Очищаем состояние при начале новой операции
-    await state.set_state(ResponseToVacancy.waiting_for_vacancy)
-    await bot.send_message(
-        callback_query.from_user.id,
-        "📝 Расскажи о вакансии: чем занимается компания, какие требования, что нужно делать?"
+# Функция для отображения истории
+async def show_history(user_id, message, before=None, after=None, edit=False):
+    history, has_older, has_newer = await history_store.get_history_page(
+        user_id, HISTORY_PAGE_SIZE, before=before, after=after
     )
 
+    if not history:
+        await message.answer("📭 История запросов пуста.")
+        return
 
-# Обработчик для получения описания вакансии
-@dp.message(ResponseToVacancy.waiting_for_vacancy)
-async def process_vacancy_description(message: types.Message, state: FSMContext):
-    await state.update_data(vacancy=message.text)
-    await state.set_state(ResponseToVacancy.waiting_for_skills)
-    await message.answer("💼 Теперь расскажи о своих навыках и опыте:")
-
+    # Собираем строки в список и склеиваем один раз в конце
+    if has_newer:
+        lines = ["📊 История запросов:\n"]
+    else:
+        lines = [f"📊 Последние {HISTORY_PAGE_SIZE} запросов:\n"]
 
-# Обработчик для получения навыков и генерации отклика
-@dp.message(ResponseToVacancy.waiting_for_skills)
-async def process_skills_and_generate(message: types.Message, state: FSMContext):
-    user_data = await state.get_data()
-    vacancy = user_data.get('vacancy', '')
-    skills = message.text
+    for i, record in enumerate(history, 1):
+        lines.extend(format_history_record(i, record))
 
-    await message.answer("🤔 Генерирую отклик...")
+    newest, oldest = history[0], history[-1]
+    keyboard = get_history_keyboard(
+        older=(oldest[2], oldest[0]) if has_older else None,
+        newer=(newest[2], newest[0]) if has_newer else None,
+    )
 
-    prompt = f"""
-    Напиши профессиональный отклик на вакансию.
+    await deliver(message, "\n".join(lines), reply_markup=keyboard, edit=edit)
 
-    Описание вакансии: {vacancy}
 
-    Мои навыки и опыт: {skills}
+# Обработчик для кнопок листания истории
+@router.callback_query(HistoryPage.filter())
+async def process_history_page(callback_query: types.CallbackQuery, callback_data: HistoryPage):
+    await callback_query.answer()
+    key = (callback_data.date, callback_data.record_id)
 
-    Сделай отклик:
-    - Убедительным и профессиональным
-    - Подчеркивающим соответствие моих навыков требованиям вакансии
-    - Не слишком длинным (до 200 слов)
-    - С предложением обсудить детали
-    """
+    if callback_data.direction == "older":
+        await show_history(callback_query.from_user.id, callback_query.message, before=key, edit=True)
+    else:
+        await show_history(callback_query.from_user.id, callback_query.message, after=key, edit=True)
 
-    response = await generate_with_gigachat(prompt)
-    # Сохраняем промпт и ответ для возможной повторной генерации
-    await state.update_data(last_response=response, last_prompt=prompt, last_type="vacancy_response")
 
-    # Сохраняем в историю
-    input_data = f"Вакансия: {vacancy}\nНавыки: {skills}"
-    save_to_history(message.from_user.id, "vacancy_response", input_data, response)
+# Функция для отображения результатов поиска по истории
+async def show_search_results(user_id, message, query, offset=0, edit=False):
+    results, has_more = await history_store.search(user_id, query, HISTORY_SEARCH_PAGE_SIZE, offset)
 
-    await message.answer(f"📨 Вот твой отклик:\n\n{response}", reply_markup=get_regenerate_keyboard())
+    if not results:
+        text = f"🔎 По запросу «{query}» ничего не найдено." if offset == 0 else "🔎 Больше результатов нет."
+        await message.answer(text)
+        return
 
+    lines = [f"🔎 Результаты поиска «{query}»:\n"]
+    for i, record in enumerate(results, offset + 1):
+        lines.extend(format_history_record(i, record))
 
-# Обработчик для кнопки "Короткий текст"
-@dp.callback_query(lambda c: c.data == 'short_text')
-async def process_short_text(callback_query: types.CallbackQuery, state: FSMContext):
-    await callback_query.answer()
-    await state.clear()  # Очищаем состояние при начале новой операции
-    await state.set_state(ShortText.waiting_for_request)
-    await bot.send_message(
-        callback_query.from_user.id,
-        "✍️ Опиши, какой текст тебе нужен (пост для соцсетей, email, объявление и т.д.):"
+    keyboard = get_search_keyboard(
+        previous_offset=max(offset - HISTORY_SEARCH_PAGE_SIZE, 0) if offset else None,
+        next_offset=offset + HISTORY_SEARCH_PAGE_SIZE if has_more else None,
     )
+    await deliver(message, "\n".join(lines), reply_markup=keyboard, edit=edit)
 
 
-# Обработчик для генерации короткого текста
-@dp.message(ShortText.waiting_for_request)
-async def generate_short_text(message: types.Message, state: FSMContext):
-    request = message.text
+# Обработчик для кнопок листания результатов поиска
+@router.callback_query(SearchPage.filter())
+async def process_search_page(callback_query: types.CallbackQuery, callback_data: SearchPage, state: FSMContext):
+    await callback_query.answer()
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        await bot.send_message(callback_query.from_user.id, "🔎 Поиск устарел, повтори команду /search")
+        return
 
-    await message.answer("🤔 Генерирую текст...")
+    await show_search_results(
+        callback_query.from_user.id, callback_query.message, query, callback_data.offset, edit=True
+    )
 
-    prompt = f"Напиши текст по следующему запросу: {request}. Сделай его качественным и соответствующим цели."
 
-    response = await generate_with_gigachat(prompt)
-    # Сохраняем промпт и ответ для возможной повторной генерации
-    await state.update_data(last_response=response, last_prompt=prompt, last_type="short_text")
+# Обработчик для кнопки "Очистить историю"
+@on_callback("clear_history")
+async def process_clear_history(callback_query: types.CallbackQuery, state: FSMContext):
+    user_id = callback_query.from_user.id
+    await history_store.clear(user_id)
 
-    # Сохраняем в историю
-    save_to_history(message.from_user.id, "short_text", request, response)
+    await callback_query.answer("🗑️ История очищена!")
+    await bot.send_message(user_id, "🗑️ История запросов очищена.")
 
-    await message.answer(f"📝 Вот твой текст:\n\n{response}", reply_markup=get_regenerate_keyboard())
 
+# Обработчик текстового сообщения "Главное меню"
+@on_text("🏠 Главное меню")
+async def process_main_menu_text(message: types.Message, state: FSMContext):
+    await state.clear()  # Очищаем состояние
+    await message.answer(MAIN_MENU_TEXT, reply_markup=MAIN_KEYBOARD)
 
-# Обработчик для кнопки "Улучшить резюме"
-@dp.callback_query(lambda c: c.data == 'improve_resume')
-async def process_improve_resume(callback_query: types.CallbackQuery, state: FSMContext):
+
+# Обработчик для кнопок сценариев в главном меню: начинаем сценарий с первого шага
+async def start_flow(callback_query: types.CallbackQuery, state: FSMContext):
+    flow = FLOWS_BY_ACTION[callback_query.data]
     await callback_query.answer()
     await state.clear()  # Очищаем состояние при начале новой операции
-    await state.set_state(ImproveResume.waiting_for_resume)
-    await bot.send_message(
-        callback_query.from_user.id,
-        "📄 Пришли текст своего резюме (или его части), и я помогу его улучшить:"
-    )
-
+    await state.set_state(flow.steps[0].state)
+    await bot.send_message(callback_query.from_user.id, flow.steps[0].question)
 
-# Обработчик для улучшения резюме
-@dp.message(ImproveResume.waiting_for_resume)
-async def improve_resume_text(message: types.Message, state: FSMContext):
-    resume_text = message.text
 
-    await message.answer("🤔 Улучшаю резюме...")
+for _flow in FLOWS:
+    CALLBACK_ROUTES[_flow.action] = start_flow
 
-    prompt = f"""
-    Улучши этот текст резюме, сделай его более профессиональным и привлекательным для работодателя:
-
-    {resume_text}
-
-    Предложи улучшенную версию и кратко объясни, что было изменено.
-    """
 
-    response = await generate_with_gigachat(prompt)
-    # Сохраняем промпт и ответ для возможной повторной генерации
-    await state.update_data(last_response=response, last_prompt=prompt, last_type="resume_improvement")
-
-    # Сохраняем в историю
-    save_to_history(message.from_user.id, "resume_improvement", resume_text, response)
+# Обработчик сообщения на шаге сценария: запоминаем поле и задаем следующий
+# вопрос, а после последнего шага генерируем ответ
+async def process_flow_step(message: types.Message, state: FSMContext, flow, step):
+    if message.text is None:
+        # Фото, стикер, голосовое: шаблоны ждут текст, поэтому повторяем вопрос шага
+        await message.answer(f"✍️ Пришли ответ текстом.\n\n{flow.steps[step].question}")
+        return
 
-    await message.answer(f"📄 Вот улучшенная версия:\n\n{response}", reply_markup=get_regenerate_keyboard())
+    if step + 1 < len(flow.steps):
+        next_step = flow.steps[step + 1]
+        await state.update_data({flow.steps[step].field: message.text})
+        await state.set_state(next_step.state)
+        await message.answer(next_step.question)
+        return
 
+    values = {flow.steps[step].field: message.text}
+    if step:
+        user_data = await state.get_data()
+        for previous in flow.steps[:step]:
+            values[previous.field] = user_data.get(previous.field) or ''
+    await generate_flow(message, state, flow, values)
+
+
+# Генерация ответа по собранным полям сценария
+async def generate_flow(message: types.Message, state: FSMContext, flow, values):
+    prompt = flow.template.build(PROMPT_INPUT_BUDGET, **values)
+    request = prompt
+    cache_type = flow.request_type if flow.cache else None
+
+    if flow.conversation:
+        # Вопросы в этом режиме - один диалог: отправляем вместе с вопросом
+        # последние сообщения, сколько помещается в бюджет токенов
+        window = (await state.get_data()).get("conversation", [])
+        if window:
+            # Ответ зависит от предыдущих сообщений, поэтому мимо кэша ответов
+            request = build_messages(window, prompt, CONVERSATION_TOKEN_BUDGET)
+            cache_type = None
+
+    if job_queue is not None and flow.request_type in BACKGROUND_FLOWS:
+        # Обработчик только ставит задачу: ответ придет отдельным сообщением
+        await job_queue.submit(message.from_user.id, "flow", {
+            "type": flow.request_type,
+            "chat_id": message.chat.id,
+            "values": values,
+            "prompt": prompt,
+            "request": request,
+            "cache_type": cache_type,
+        })
+        await message.answer(f"{flow.placeholder}\n⏳ Пришлю результат отдельным сообщением, когда он будет готов.")
+        return
 
-# Обработчик для кнопки "Задать вопрос"
-@dp.callback_query(lambda c: c.data == 'free_question')
-async def process_free_question(callback_query: types.CallbackQuery, state: FSMContext):
-    await callback_query.answer()
-    await state.clear()  # Очищаем состояние при начале новой операции
-    await state.set_state(FreeQuestion.waiting_for_question)
-    await bot.send_message(
-        callback_query.from_user.id,
-        "💬 Задай любой вопрос, и я постараюсь на него ответить:"
+    response = await generate_reply(
+        message, flow.placeholder, flow.title, request, flow.keyboard,
+        cache_type=cache_type, max_tokens=flow.template.max_tokens,
     )
+    if response is not None:
+        await finish_flow(state, message.from_user.id, flow, values, prompt, response)
+
+
+# Сохранение результата сценария в FSM и в историю
+async def finish_flow(state, user_id, flow, values, prompt, response):
+    # Сохраняем промпт и ответ для возможной повторной генерации, а также
+    # сколько сообщений занял ответ: от этого зависит, можно ли заменить его правкой
+    parts = len(split_message(f"{flow.title}{response}"))
+    if flow.conversation:
+        # ...и для следующих вопросов диалога
+        window = (await state.get_data()).get("conversation", [])
+        await state.update_data(
+            last_response=response, last_prompt=prompt, last_type=flow.request_type, last_parts=parts,
+            conversation=append_turn(window, prompt, response, CONVERSATION_MAX_MESSAGES, CONVERSATION_MESSAGE_TOKENS),
+        )
+    else:
+        # ...а варианты прошлого текста сбрасываем
+        await state.update_data(
+            last_response=response, last_prompt=prompt, last_type=flow.request_type, last_parts=parts, variants=[]
+        )
 
+    # Сохраняем в историю
+    await save_to_history(user_id, flow.request_type, flow.history_input.format(**values), response)
 
-# Обработчик для свободного вопроса
-@dp.message(FreeQuestion.waiting_for_question)
-async def process_question(message: types.Message, state: FSMContext):
-    question = message.text
-
-    await message.answer("🤔 Думаю над ответом...")
 
-    response = await generate_with_gigachat(question)
-    # Сохраняем промпт и ответ для возможной повторной генерации
-    await state.update_data(last_response=response, last_prompt=question, last_type="free_question")
+# Ошибки Telegram, которые повтор не исправит: бот заблокирован, чата нет, запрос отклонен
+FINAL_TELEGRAM_ERRORS = (TelegramForbiddenError, TelegramNotFound, TelegramBadRequest)
 
-    # Сохраняем в историю
-    save_to_history(message.from_user.id, "free_question", question, response)
 
-    await message.answer(f"💡 Ответ на твой вопрос:\n\n{response}", reply_markup=get_question_keyboard())
+# Отправка результата фоновой задачи. False - доставить нельзя, повторять задачу бессмысленно
+async def send_job_result(job, chat_id, text, reply_markup=None):
+    try:
+        await send_text(bot, chat_id, text, reply_markup=reply_markup)
+    except FINAL_TELEGRAM_ERRORS as e:
+        logging.warning("Результат фоновой задачи %s не доставлен пользователю %s: %r", job.id, job.user_id, e)
+        return False
+    return True
+
+
+# Фоновая задача сценария: генерирует ответ и присылает его новым сообщением
+async def run_flow_job(job):
+    payload = job.payload
+    flow = FLOWS_BY_TYPE[payload["type"]]
+    chat_id, request, cache_type = payload["chat_id"], payload["request"], payload["cache_type"]
+    use_cache = response_cache is not None and cache_type is not None
+
+    # Готовый ответ запоминается в задаче: если отправка упадет и задача повторится
+    # в этом же процессе, GigaChat второй раз не вызывается
+    response = payload.get("response")
+    if response is None and use_cache:
+        response = await response_cache.get(cache_type, request)
+    if response is None:
+        try:
+            response = await generation_scheduler.run(
+                job.user_id, ("reply", request_key(request)),
+                lambda: generate_with_gigachat(request, flow.template.max_tokens),
+            )
+        except GigaChatError as e:
+            logging.warning("Ошибка фоновой генерации для пользователя %s: %r", job.user_id, e)
+            await send_job_result(job, chat_id, format_gigachat_error(e))
+            return
+        if use_cache:
+            await response_cache.set(cache_type, request, response)
+    payload["response"] = response
+
+    if not await send_job_result(job, chat_id, f"{flow.title}{response}", reply_markup=flow.keyboard):
+        return
+    # Результат уже у пользователя: ошибка сохранения не должна повторять задачу
+    try:
+        state = dp.fsm.get_context(bot, chat_id=chat_id, user_id=job.user_id)
+        await finish_flow(state, job.user_id, flow, payload["values"], payload["prompt"], response)
+    except Exception:
+        logging.exception("Не удалось сохранить результат фоновой задачи %s", job.id)
 
 
 # Обработчик для кнопки "Перефразировать"
-@dp.callback_query(lambda c: c.data == 'rephrase_question')
+@on_callback("rephrase_question")
 async def process_rephrase_question(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer("🔄 Перефразирую ответ...")
 
@@ -491,31 +810,56 @@ async def process_rephrase_question(callback_query: types.CallbackQuery, state:
         await callback_query.answer("❌ Нечего перефразировать")
         return
 
-    # Генерируем новый ответ на тот же вопрос
-    new_response = await generate_with_gigachat(f"Ответь на этот вопрос по-другому: {last_prompt}")
+    # Последняя пара вопрос-ответ в окне диалога - та, которую перефразируем
+    window = user_data.get("conversation", [])[:-2]
+    prompt = REPHRASE_QUESTION.build(PROMPT_INPUT_BUDGET, question=last_prompt)
+    request = build_messages(window, prompt, CONVERSATION_TOKEN_BUDGET) if window else prompt
+
+    # Генерируем новый ответ на тот же вопрос (всегда мимо кэша ответов)
+    try:
+        new_response = await generate_for_user(callback_query.from_user.id, request, REPHRASE_QUESTION.max_tokens)
+    except GigaChatError as e:
+        await bot.send_message(callback_query.from_user.id, format_gigachat_error(e))
+        return
 
     # Обновляем состояние с новым ответом
-    await state.update_data(last_response=new_response)
+    text = f"💡 Ответ на твой вопрос (перефразировано):\n\n{new_response}"
+    await state.update_data(
+        last_response=new_response,
+        last_parts=len(split_message(text)),
+        conversation=append_turn(
+            window, last_prompt, new_response, CONVERSATION_MAX_MESSAGES, CONVERSATION_MESSAGE_TOKENS
+        ),
+    )
 
     # Сохраняем в историю
-    save_to_history(callback_query.from_user.id, "free_question", last_prompt, new_response)
+    await save_to_history(callback_query.from_user.id, "free_question", last_prompt, new_response)
+
+    # Заменяем старый ответ новым (правкой, если оба - одно сообщение)
+    await redeliver(callback_query.message, text, shown_parts(user_data), reply_markup=QUESTION_KEYBOARD)
+
 
-    # Редактируем сообщение с новым текстом
-    await callback_query.message.edit_text(
-        f"💡 Ответ на твой вопрос (перефразировано):\n\n{new_response}",
-        reply_markup=get_question_keyboard()
+# Обработчик для кнопки "Новый диалог"
+@on_callback("new_conversation")
+async def process_new_conversation(callback_query: types.CallbackQuery, state: FSMContext):
+    await callback_query.answer()
+    await state.set_state(FreeQuestion.waiting_for_question)
+    await state.update_data(conversation=[])
+    await bot.send_message(
+        callback_query.from_user.id,
+        "🆕 Начнем новый диалог. Задай вопрос:"
     )
 
 
 # Обработчик для кнопки "История запросов"
-@dp.callback_query(lambda c: c.data == 'history')
-async def process_history(callback_query: types.CallbackQuery):
+@on_callback("history")
+async def process_history(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer()
     await show_history(callback_query.from_user.id, callback_query.message)
 
 
 # Обработчик для кнопки "Сгенерировать заново"
-@dp.callback_query(lambda c: c.data == 'regenerate')
+@on_callback("regenerate")
 async def process_regenerate(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer("🔄 Генерирую заново...")
 
@@ -527,31 +871,45 @@ async def process_regenerate(callback_query: types.CallbackQuery, state: FSMCont
         await callback_query.answer("❌ Нечего перегенерировать")
         return
 
-    # Генерируем новый текст
-    new_response = await generate_with_gigachat(last_prompt)
-
-    # Обновляем состояние с новым ответом
-    await state.update_data(last_response=new_response)
-
-    # Определяем заголовок в зависимости от типа контента
-    if last_type == "vacancy_response":
-        title = "📨 Вот твой обновленный отклик:\n\n"
-    elif last_type == "short_text":
-        title = "📝 Вот твой обновленный текст:\n\n"
-    elif last_type == "resume_improvement":
-        title = "📄 Вот улучшенная версия:\n\n"
+    variants = user_data.get('variants') or []
+    if variants and user_data.get('variants_prompt') == last_prompt:
+        # Вариант уже сгенерирован заранее - показываем без обращения к GigaChat
+        new_response, variants = variants[0], variants[1:]
+        REGENERATE_SERVED.inc(source="prepared")
     else:
-        title = "🔄 Вот обновленная версия:\n\n"
-
-    # Редактируем сообщение с новым текстом
-    await callback_query.message.edit_text(
-        f"{title}{new_response}",
-        reply_markup=get_regenerate_keyboard()
+        # Генерируем новый текст (всегда мимо кэша ответов), а если разрешено -
+        # сразу и запасные варианты для следующих нажатий
+        user_id = callback_query.from_user.id
+        extra = take_variant_budget(user_id, REGENERATE_VARIANTS - 1) if REGENERATE_VARIANTS > 1 else 0
+        try:
+            if extra:
+                responses = await generate_variants_for_user(user_id, last_prompt, max_tokens_for(last_type), extra + 1)
+            else:
+                responses = [await generate_for_user(user_id, last_prompt, max_tokens_for(last_type))]
+        except GigaChatError as e:
+            await bot.send_message(user_id, format_gigachat_error(e))
+            return
+        new_response, variants = responses[0], responses[1:]
+        REGENERATE_SERVED.inc(source="generated")
+
+    # Обновляем состояние с новым ответом и оставшимися вариантами; заголовок зависит от типа контента
+    text = f"{regenerate_title(last_type)}{new_response}"
+    await state.update_data(
+        last_response=new_response, last_parts=len(split_message(text)), variants=variants, variants_prompt=last_prompt
     )
 
+    # Заменяем старый ответ новым (правкой, если оба - одно сообщение)
+    await redeliver(callback_query.message, text, shown_parts(user_data), reply_markup=REGENERATE_KEYBOARD)
+
+
+# Сколько сообщений занимает показанный ответ. В состояниях, сохраненных до
+# появления last_parts, - оценка по тексту ответа без заголовка
+def shown_parts(user_data):
+    return user_data.get("last_parts") or len(split_message(user_data.get("last_response") or ""))
+
 
 # Обработчик для кнопки "Сохранить"
-@dp.callback_query(lambda c: c.data == 'save')
+@on_callback("save")
 async def process_save(callback_query: types.CallbackQuery, state: FSMContext):
     user_data = await state.get_data()
     last_response = user_data.get('last_response')
@@ -565,37 +923,24 @@ async def process_save(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer("💾 Текст сохранен!")
 
     # Отправляем пользователю копию текста с отметкой о сохранении
-    await bot.send_message(
-        callback_query.from_user.id,
-        f"💾 Сохраненная копия:\n\n{last_response}"
-    )
+    await deliver(callback_query.message, f"💾 Сохраненная копия:\n\n{last_response}")
 
 
 # Обработчик для кнопки "Главное меню"
-@dp.callback_query(lambda c: c.data == 'main_menu')
+@on_callback("main_menu")
 async def process_main_menu(callback_query: types.CallbackQuery, state: FSMContext):
     await state.clear()  # Очищаем состояние
     await callback_query.answer()
-    welcome_text = """
-🏠 Главное меню
-
-Выбери нужную опцию:
-• 📝 Отклик на вакансию
-• ✍️ Короткий текст  
-• 📄 Улучшить резюме
-• 💬 Задать вопрос
-• 📊 История запросов
-    """
     await bot.send_message(
         callback_query.from_user.id,
-        welcome_text,
-        reply_markup=get_main_keyboard()
+        MAIN_MENU_TEXT,
+        reply_markup=MAIN_KEYBOARD
     )
 
 
 # Обработчик для кнопки "Помощь"
-@dp.callback_query(lambda c: c.data == 'help')
-async def process_help(callback_query: types.CallbackQuery):
+@on_callback("help")
+async def process_help(callback_query: types.CallbackQuery, state: FSMContext):
     help_text = """
 ❓ Помощь по боту:
 
@@ -603,14 +948,17 @@ async def process_help(callback_query: types.CallbackQuery):
 • 📝 Отклик на вакансию - напишу убедительный отклик
 • ✍️ Короткий текст - помогу с любым небольшим текстом
 • 📄 Улучшить резюме - оптимизирую твое резюме
-• 💬 Задать вопрос - отвечу на любой твой вопрос
-• 📊 История запросов - покажу последние 10 запросов
+• 💬 Задать вопрос - отвечу на любой твой вопрос и помню последние сообщения диалога
+• 📊 История запросов - покажу историю, листая по 10 запросов
+• 🔎 /search <слова> - найду запросы и ответы в истории
+• 📤 /export [jsonl|csv] - пришлю всю историю файлом
 
 Просто выбери нужный пункт в меню и следуй инструкциям!
 
 🔄 Сгенерировать заново - создает новый вариант текста
 💾 Сохранить - сохраняет текущий текст
 🔄 Перефразировать - отвечает на вопрос по-другому
+🆕 Новый диалог - забывает предыдущие вопросы и ответы
 🏠 Главное меню - возвращает в главное меню
 🗑️ Очистить историю - удаляет всю историю запросов
     """
@@ -619,18 +967,212 @@ async def process_help(callback_query: types.CallbackQuery):
 
 
 # Обработчик обычных сообщений
-@dp.message()
+@router.message()
 async def echo_message(message: types.Message):
     # Если пользователь просто написал сообщение без команды и не в состоянии,
     # предлагаем использовать меню
-    await message.answer("Используй меню или кнопки ниже для начала работы!", reply_markup=get_start_keyboard())
+    await message.answer("Используй меню или кнопки ниже для начала работы!", reply_markup=START_KEYBOARD)
+
+
+# Доля общего лимита для процесса worker_index из workers: в сумме доли дают limit,
+# остаток достается первым процессам. Меньше одного процессу не дается
+def limit_share(limit, worker_index, workers):
+    return max(1, limit // workers + (1 if worker_index < limit % workers else 0))
+
+
+# Создание бота, диспетчера и всех объектов, которые нужны обработчикам
+def create_app(metrics_port_override=None, jobs_db_path=None, run_retention=True, worker_index=0, workers=1):
+    """
+    Создает бота и диспетчер и возвращает (bot, dp).
+
+    Соединения с базами, пул HTTP-соединений GigaChat и сессия Bot API
+    открываются лениво, при первом обращении. Подготовка и освобождение
+    ресурсов зарегистрированы хуками startup/shutdown диспетчера: их
+    вызывают start_polling, вебхук и dp.emit_startup()/emit_shutdown().
+    Повторный вызов возвращает уже созданные объекты. jobs_db_path
+    заменяет JOBS_DB_PATH (у каждого воркера шардинга своя очередь задач).
+    run_retention=False - не чистить историю в этом процессе: база истории
+    общая, и при шардинге очистку запускает только один воркер.
+    worker_index и workers - номер процесса и число процессов шардинга:
+    MAX_CONCURRENT_GENERATIONS и JOB_WORKERS делятся между ними.
+    """
+    global bot, dp, storage, gigachat, edit_throttle, generation_scheduler, response_cache
+    global history_store, rate_limiter, variant_budget, metrics_port, job_queue, retention_here
+    if dp is not None:
+        return bot, dp
+
+    # Проверяем, что токены загружены
+    if not all([BOT_TOKEN, GIGACHAT_CLIENT_ID, GIGACHAT_CLIENT_SECRET]):
+        exit("Ошибка: не все необходимые токены заданы в .env файле")
+    if metrics_port_override is not None:
+        metrics_port = metrics_port_override
+    retention_here = run_retention
+
+    # Инициализируем бота и диспетчер
+    if TELEGRAM_API_URL:
+        bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+    else:
+        bot = Bot(token=BOT_TOKEN)
+    if FSM_STORAGE == "memory":
+        storage = MemoryStorage()
+    else:
+        storage = SQLiteStorage(FSM_DB_PATH, ttl=FSM_TTL_HOURS * 60 * 60, cache_size=FSM_CACHE_SIZE)
+    dp = Dispatcher(storage=storage)
+    handler_metrics = HandlerMetricsMiddleware(SLOW_REQUEST_MS / 1000, SLOW_REQUEST_SAMPLE)
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
+
+    # Лимиты проверяются до фильтров и FSM: лишнее нажатие отбрасывается сразу
+    rate_limiter = TokenBucketLimiter({
+        "regenerate": parse_rate(RATE_LIMIT_REGENERATE),
+        "rephrase_question": parse_rate(RATE_LIMIT_REPHRASE),
+        "callback": parse_rate(RATE_LIMIT_CALLBACK),
+        "message": parse_rate(RATE_LIMIT_MESSAGE),
+    })
+    rate_limit = RateLimitMiddleware(rate_limiter)
+    variant_budget = TokenBucketLimiter({"variant": parse_rate(REGENERATE_VARIANT_BUDGET)})
+    dp.message.outer_middleware(rate_limit)
+    dp.callback_query.outer_middleware(rate_limit)
+
+    # Один клиент GigaChat на весь процесс: кэш токена и общий пул соединений
+    gigachat = GigaChatClient(
+        GIGACHAT_CLIENT_ID,
+        GIGACHAT_CLIENT_SECRET,
+        auth_url=GIGACHAT_AUTH_URL,
+        chat_url=GIGACHAT_CHAT_URL,
+        connect_timeout=GIGACHAT_CONNECT_TIMEOUT,
+        read_timeout=GIGACHAT_READ_TIMEOUT,
+        total_timeout=GIGACHAT_TOTAL_TIMEOUT,
+        max_retries=GIGACHAT_MAX_RETRIES,
+        breaker_threshold=GIGACHAT_BREAKER_THRESHOLD,
+        breaker_reset_timeout=GIGACHAT_BREAKER_RESET,
+        supports_n=GIGACHAT_SUPPORTS_N,
+    )
+    edit_throttle = EditThrottle(STREAM_EDIT_INTERVAL)
+    if workers > MAX_CONCURRENT_GENERATIONS and worker_index == 0:
+        logging.warning("Воркеров (%s) больше, чем MAX_CONCURRENT_GENERATIONS (%s): каждый получит 1 генерацию",
+                        workers, MAX_CONCURRENT_GENERATIONS)
+    generation_scheduler = GenerationScheduler(limit_share(MAX_CONCURRENT_GENERATIONS, worker_index, workers))
+    response_cache = ResponseCache(
+        ttl=RESPONSE_CACHE_TTL,
+        max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+        db_path=RESPONSE_CACHE_DB or None,
+    ) if RESPONSE_CACHE else None
+    if response_cache is not None:
+        REGISTRY.gauge('bot_response_cache_hit_rate', 'Доля запросов, отвеченных из кэша',
+                       lambda: response_cache.stats()['hit_rate'])
+
+    # Хранилище истории запросов: SQLite в отдельном потоке, не блокирует event loop
+    history_store = HistoryStore(
+        HISTORY_DB_PATH,
+        batch_size=HISTORY_BATCH_SIZE,
+        flush_interval=HISTORY_FLUSH_INTERVAL_MS / 1000,
+        max_rows_per_user=HISTORY_MAX_ROWS_PER_USER,
+        max_age_days=HISTORY_MAX_AGE_DAYS,
+        archive_path=HISTORY_ARCHIVE_PATH or None,
+        retention_batch=HISTORY_RETENTION_BATCH,
+    )
+
+    if BACKGROUND_FLOWS:
+        job_queue = JobQueue(run_flow_job, jobs_db_path or JOBS_DB_PATH or None, workers=limit_share(JOB_WORKERS, worker_index, workers))
+
+    if job_queue is not None:
+        # Фоновые задачи пишут результат в FSM, а хранилище Dispatcher закрывает сам при
+        # остановке, раньше наших хуков shutdown. Поэтому задач дожидается само закрытие хранилища
+        storage.close = close_after_jobs(storage.close)
+
+    dp.include_router(router)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return bot, dp
+
+
+# Периодическая очистка истории по сроку хранения
+async def run_history_retention():
+    while True:
+        try:
+            retired = await history_store.apply_retention()
+            if retired:
+                logging.info("Из истории убрано записей: %s", retired)
+        except Exception:
+            logging.exception("Ошибка очистки истории")
+        await asyncio.sleep(HISTORY_RETENTION_INTERVAL)
+
+
+# Подготовка ресурсов перед обработкой апдейтов
+async def on_startup():
+    global metrics_runner, loop_lag_task, retention_task
+    await history_store.init()
+    if job_queue is not None:
+        await job_queue.start()
+    loop_lag_task = asyncio.create_task(monitor_loop_lag())
+    if retention_here and history_store.retention_enabled:
+        retention_task = asyncio.create_task(run_history_retention())
+    if metrics_port:
+        metrics_runner = await start_metrics_server(METRICS_HOST, metrics_port)
+
+
+# Остановка фоновых задач: они еще пишут в чат, FSM и историю, поэтому
+# останавливаются до закрытия хранилищ (см. create_app)
+async def drain_background_jobs():
+    await job_queue.close(JOB_DRAIN_TIMEOUT)
+    logging.info("Фоновые задачи: %s", job_queue.stats())
+
+
+# Закрытие FSM-хранилища, которое сначала дожидается фоновых задач
+def close_after_jobs(close_storage):
+    async def close():
+        await drain_background_jobs()
+        await close_storage()
+    return close
+
+
+# Освобождение ресурсов при остановке: дописываем историю, закрываем соединения
+async def on_shutdown():
+    if loop_lag_task is not None:
+        loop_lag_task.cancel()
+    if retention_task is not None:
+        retention_task.cancel()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    await gigachat.close()
+    await storage.close()
+    if isinstance(storage, SQLiteStorage):
+        logging.info("FSM-хранилище: %s", storage.stats())
+    logging.info("Очередь генерации: %s", generation_scheduler.stats())
+    await history_store.close()
+    logging.info("История сохранена: %s", history_store.stats())
+    if response_cache is not None:
+        await response_cache.close()
+        logging.info("Кэш ответов: %s", response_cache.stats())
 
 
 # Запускаем бота
+# on_startup/on_shutdown вызывают start_polling и вебхук (через setup_application),
+# они же закрывают сессию бота
 async def main():
+    # Включаем логирование
+    logging.basicConfig(level=logging.INFO)
+    create_app()
     print("Бот запущен...")
-    await dp.start_polling(bot)
+    if BOT_MODE == "webhook":
+        # aiohttp-сервер вебхука нужен только в этом режиме
+        from webhook import run_webhook
+
+        await run_webhook(
+            dp,
+            bot,
+            host=WEBHOOK_HOST,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            base_url=WEBHOOK_BASE_URL or None,
+        )
+    else:
+        # Если раньше бот работал через вебхук, getUpdates без этого не заработает
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,235 @@
+import asyncio
+import bisect
+import json
+import logging
+import random
+import time
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+
+# Границы бакетов гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Монотонно растущий счетчик с метками
+    """
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, value=1, **labels):
+        key = tuple(map(labels.get, self.labelnames)) if labels else ()
+        self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        return self._values.get(tuple(map(labels.get, self.labelnames)) if labels else (), 0)
+
+    def render(self):
+        for key, value in list(self._values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными бакетами и метками.
+
+    observe - это поиск бакета и пара сложений, поэтому ее можно
+    вызывать на каждом запросе. Накопительные суммы считаются при выдаче.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счетчики по бакетам (+Inf последним), сумма, количество]
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(map(labels.get, self.labelnames)) if labels else ()
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, **labels):
+        series = self._series.get(tuple(map(labels.get, self.labelnames)) if labels else ())
+        return series[2] if series else 0
+
+    def render(self):
+        # Копия: наблюдения могут приходить и из потоков баз данных
+        for key, (counts, total, count) in list(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.labelnames, key)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {count}'
+
+
+class Gauge:
+    """
+    Значение, которое считывается функцией в момент запроса /metrics
+    (глубина очереди, размер кэша и т.п.)
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def render(self):
+        yield f'{self.name} {_format_value(self.func())}'
+
+
+class Registry:
+    """
+    Набор метрик, который отдается в текстовом формате Prometheus
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        # Повторная регистрация (например, при повторном импорте модуля) возвращает ту же метрику
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if isinstance(existing, Gauge):
+                existing.func = metric.func
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, func):
+        return self._register(Gauge(name, help, func))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logging.exception("Не удалось получить значение метрики %s", metric.name)
+        return '\n'.join(lines) + '\n'
+
+
+# Общий реестр процесса: модули объявляют в нем свои метрики при импорте
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    'bot_handler_seconds', 'Время работы обработчика апдейта', ('handler', 'status'),
+)
+LOOP_LAG = REGISTRY.histogram(
+    'bot_event_loop_lag_seconds', 'Насколько позже запланированного просыпается event loop',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+slow_log = logging.getLogger('slow_requests')
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Меряет время каждого обработчика сообщений и колбэков.
+
+    Запросы дольше slow_threshold секунд с вероятностью slow_sample
+    пишутся в лог slow_requests одной JSON-строкой.
+    """
+
+    def __init__(self, slow_threshold=2.0, slow_sample=1.0):
+        self.slow_threshold = slow_threshold
+        self.slow_sample = slow_sample
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        status = 'ok'
+        try:
+            return await handler(event, data)
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            # Хендлеры-маршрутизаторы передают настоящий обработчик в data['route']
+            callback = data.get('route') or getattr(data.get('handler'), 'callback', None)
+            name = getattr(callback, '__name__', 'unknown')
+            HANDLER_LATENCY.observe(elapsed, handler=name, status=status)
+
+            if elapsed >= self.slow_threshold and random.random() < self.slow_sample:
+                user = getattr(event, 'from_user', None)
+                slow_log.warning(json.dumps({
+                    'event': 'slow_request',
+                    'handler': name,
+                    'status': status,
+                    'duration_ms': round(elapsed * 1000, 1),
+                    'user_id': user.id if user else None,
+                    'update_type': type(event).__name__,
+                }, ensure_ascii=False))
+
+
+async def monitor_loop_lag(interval=0.5):
+    """
+    Фоновая задача: раз в interval секунд меряет задержку event loop
+    """
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, time.perf_counter() - started - interval))
+
+
+async def handle_metrics(request):
+    return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host='127.0.0.1', port=9100):
+    """
+    Поднимает HTTP-сервер с /metrics. Возвращает runner, который нужно
+    остановить через runner.cleanup()
+    """
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info("Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
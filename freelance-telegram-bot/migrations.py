@@ -0,0 +1,162 @@
+import logging
+
+from blobs import decode_blob, make_preview, store_texts
+from fulltext import index_rows
+
+# Сколько строк истории обрабатывать за один проход при миграциях 3 и 4
+MIGRATION_BATCH = 1000
+
+
+def _move_bodies_to_blobs(conn):
+    """
+    Переносит тексты запросов и ответов в таблицу blobs (сжатые, без дублей)
+    и оставляет в истории только ссылки на них и короткие превью
+    """
+    conn.execute('''
+        CREATE TABLE blobs (
+            hash BLOB PRIMARY KEY,
+            size INTEGER NOT NULL,
+            codec INTEGER NOT NULL,
+            data BLOB NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE history_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            request_type TEXT NOT NULL,
+            input_preview TEXT NOT NULL,
+            output_preview TEXT NOT NULL,
+            input_hash BLOB NOT NULL REFERENCES blobs (hash),
+            output_hash BLOB NOT NULL REFERENCES blobs (hash)
+        )
+    ''')
+
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, user_id, date, request_type, input_data, output_data FROM history '
+            'WHERE id > ? ORDER BY id LIMIT ?', (last_id, MIGRATION_BATCH)
+        ).fetchall()
+        if not rows:
+            break
+        hashes = store_texts(conn, [text for row in rows for text in (row[4], row[5])])
+        conn.executemany('''
+            INSERT INTO history_new (id, user_id, date, request_type, input_preview, output_preview,
+                                     input_hash, output_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (row[0], row[1], row[2], row[3], make_preview(row[4]), make_preview(row[5]),
+             hashes[2 * i], hashes[2 * i + 1])
+            for i, row in enumerate(rows)
+        ])
+        last_id = rows[-1][0]
+
+    conn.execute('DROP TABLE history')
+    conn.execute('ALTER TABLE history_new RENAME TO history')
+    conn.execute('CREATE INDEX idx_history_user_date ON history (user_id, date)')
+    # Для поиска тел, на которые больше никто не ссылается
+    conn.execute('CREATE INDEX idx_history_input_hash ON history (input_hash)')
+    conn.execute('CREATE INDEX idx_history_output_hash ON history (output_hash)')
+
+
+def _create_search_index(conn):
+    """
+    Полнотекстовый индекс по текстам истории для /search.
+
+    Индекс contentless (content=''): сами тексты уже лежат в blobs, FTS5
+    хранит только словарь и списки записей. detail=column не хранит позиции
+    слов (фразы и NEAR не нужны), индекс от этого в разы меньше и быстрее.
+    rowid записи индекса - id записи истории
+    """
+    conn.execute('''
+        CREATE VIRTUAL TABLE history_fts USING fts5 (
+            user, input, output,
+            content='',
+            detail=column,
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT h.id, h.user_id, i.codec, i.data, o.codec, o.data
+            FROM history h
+            JOIN blobs i ON i.hash = h.input_hash
+            JOIN blobs o ON o.hash = h.output_hash
+            WHERE h.id > ?
+            ORDER BY h.id
+            LIMIT ?
+        ''', (last_id, MIGRATION_BATCH)).fetchall()
+        if not rows:
+            break
+        index_rows(conn, [
+            (row[0], row[1], decode_blob(row[2], row[3]), decode_blob(row[4], row[5])) for row in rows
+        ])
+        last_id = rows[-1][0]
+
+
+# Версионированные миграции схемы базы истории.
+# Текущая версия хранится в PRAGMA user_version, каждая миграция применяется
+# ровно один раз и в своей транзакции. Миграция - это список SQL-запросов
+# или функция, принимающая соединение. Новые миграции добавляются только в конец.
+MIGRATIONS = [
+    # 1: исходная таблица истории
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            request_type TEXT NOT NULL,
+            input_data TEXT NOT NULL,
+            output_data TEXT NOT NULL
+        )
+        ''',
+    ],
+    # 2: составной индекс для выборки и удаления истории пользователя
+    [
+        'CREATE INDEX IF NOT EXISTS idx_history_user_date ON history (user_id, date)',
+    ],
+    # 3: тела текстов в сжатой таблице blobs по хэшу, в истории - ссылки и превью
+    _move_bodies_to_blobs,
+    # 4: полнотекстовый поиск по истории
+    _create_search_index,
+]
+
+
+def schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """
+    Применяет к базе все миграции, которых в ней еще нет (или до версии target)
+    """
+    target = len(MIGRATIONS) if target is None else target
+    version = schema_version(conn)
+
+    for number in range(version + 1, target + 1):
+        migration = MIGRATIONS[number - 1]
+        # IMMEDIATE сразу берет блокировку записи: при запуске нескольких
+        # воркеров миграцию применит первый, остальные увидят новую версию
+        conn.execute('BEGIN IMMEDIATE')
+        if schema_version(conn) >= number:
+            conn.rollback()
+            continue
+        try:
+            if callable(migration):
+                migration(conn)
+            else:
+                for statement in migration:
+                    conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logging.info("База истории обновлена до версии %s", number)
+
+    return max(version, target)
@@ -0,0 +1,155 @@
+import math
+import re
+import textwrap
+from string import Formatter
+
+# Оценка без токенизатора: у GigaChat на русском тексте выходит около 4 символов
+# на токен, берем 3, чтобы оценка была с запасом
+CHARS_PER_TOKEN = 3
+
+# Метка на месте вырезанной середины слишком длинного текста
+TRIM_MARKER = '\n[...]\n'
+
+SPACES = re.compile(r'[ \t\u00a0]+')
+TRAILING_SPACES = re.compile(r' +\n')
+BLANK_LINES = re.compile(r'\n{3,}')
+
+
+def estimate_tokens(text):
+    """
+    Примерное число токенов в тексте (с запасом)
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def compact_text(text):
+    """
+    Убирает лишние пробелы и пустые строки: в скопированных из PDF и
+    сайтов резюме и вакансиях их много, а токены они тратят как слова
+    """
+    text = SPACES.sub(' ', text.strip())
+    text = TRAILING_SPACES.sub('\n', text)
+    return BLANK_LINES.sub('\n\n', text)
+
+
+def trim_text(text, max_tokens):
+    """
+    Укорачивает текст до max_tokens: оставляет начало (2/3 бюджета) и конец,
+    разрезая по границам слов, а середину заменяет меткой [...]
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    max_chars = max(0, max_tokens * CHARS_PER_TOKEN - len(TRIM_MARKER))
+    head_chars = max_chars * 2 // 3
+    tail_chars = max_chars - head_chars
+
+    head = text[:head_chars]
+    if ' ' in head:
+        head = head[:head.rindex(' ')]
+    tail = text[len(text) - tail_chars:] if tail_chars else ''
+    if ' ' in tail:
+        tail = tail[tail.index(' ') + 1:]
+    return head.rstrip() + TRIM_MARKER + tail.lstrip()
+
+
+def fit_fields(values, budget):
+    """
+    Делит бюджет токенов между полями промпта. Короткие поля остаются
+    целиком, а сэкономленное ими достается длинным, которые обрезаются
+    поровну
+    """
+    sizes = {name: estimate_tokens(value) for name, value in values.items()}
+    if sum(sizes.values()) <= budget:
+        return dict(values)
+
+    fitted = {}
+    remaining = budget
+    names = sorted(values, key=sizes.get)
+    for i, name in enumerate(names):
+        share = remaining // (len(names) - i)
+        if sizes[name] <= share:
+            fitted[name] = values[name]
+            remaining -= sizes[name]
+        else:
+            fitted[name] = trim_text(values[name], share)
+            remaining -= share
+    return fitted
+
+
+class PromptTemplate:
+    """
+    Шаблон промпта с бюджетом токенов.
+
+    Статические части шаблона разбираются один раз при импорте, заодно
+    убираются отступы исходного текста (раньше они уходили в GigaChat
+    вместе с промптом). build() подставляет ввод пользователя, предварительно сжав
+    пробелы и уложив его в input_budget токенов. max_tokens - предел длины
+    ответа GigaChat для этого типа запроса.
+    """
+
+    def __init__(self, template, max_tokens, input_budget):
+        template = textwrap.dedent(template).strip()
+        self.parts = [(literal, field) for literal, field, _, _ in Formatter().parse(template)]
+        self.fields = [field for _, field in self.parts if field]
+        self.max_tokens = max_tokens
+        self.input_budget = input_budget
+
+    def build(self, budget=None, **values):
+        """
+        Собирает промпт. budget - сколько токенов отдать вводу пользователя
+        (по умолчанию input_budget шаблона)
+        """
+        budget = self.input_budget if budget is None else budget
+        fitted = fit_fields({field: compact_text(values[field]) for field in self.fields}, budget)
+        return ''.join(literal + (fitted[field] if field else '') for literal, field in self.parts)
+
+
+VACANCY_RESPONSE = PromptTemplate('''
+    Напиши профессиональный отклик на вакансию.
+
+    Описание вакансии: {vacancy}
+
+    Мои навыки и опыт: {skills}
+
+    Сделай отклик:
+    - Убедительным и профессиональным
+    - Подчеркивающим соответствие моих навыков требованиям вакансии
+    - Не слишком длинным (до 200 слов)
+    - С предложением обсудить детали
+''', max_tokens=600, input_budget=1200)
+
+SHORT_TEXT = PromptTemplate(
+    'Напиши текст по следующему запросу: {request}. Сделай его качественным и соответствующим цели.',
+    max_tokens=800, input_budget=600,
+)
+
+RESUME_IMPROVEMENT = PromptTemplate('''
+    Улучши этот текст резюме, сделай его более профессиональным и привлекательным для работодателя:
+
+    {resume}
+
+    Предложи улучшенную версию и кратко объясни, что было изменено.
+''', max_tokens=1500, input_budget=1500)
+
+FREE_QUESTION = PromptTemplate('{question}', max_tokens=1000, input_budget=1000)
+
+REPHRASE_QUESTION = PromptTemplate(
+    'Ответь на этот вопрос по-другому: {question}', max_tokens=1000, input_budget=1000,
+)
+
+# Шаблоны по типу запроса (как он записан в истории и в FSM)
+TEMPLATES = {
+    'vacancy_response': VACANCY_RESPONSE,
+    'short_text': SHORT_TEXT,
+    'resume_improvement': RESUME_IMPROVEMENT,
+    'free_question': FREE_QUESTION,
+}
+
+# Для запросов без шаблона - прежний общий предел
+DEFAULT_MAX_TOKENS = 2000
+
+
+def max_tokens_for(request_type):
+    template = TEMPLATES.get(request_type)
+    return template.max_tokens if template is not None else DEFAULT_MAX_TOKENS
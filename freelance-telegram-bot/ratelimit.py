@@ -0,0 +1,121 @@
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message
+
+from metrics import REGISTRY
+
+RATE_LIMITED = REGISTRY.counter('bot_rate_limited_total', 'Апдейты, отброшенные ограничением частоты', ('action',))
+
+
+def parse_rate(spec):
+    """
+    Разбирает лимит вида "3/30" (3 действия за 30 секунд) в (емкость, пополнение в секунду).
+    Пустая строка или "0" - без ограничения (None)
+    """
+    if not spec or spec.strip() == '0':
+        return None
+    count, _, period = spec.partition('/')
+    capacity = float(count)
+    return capacity, capacity / float(period or 1)
+
+
+class TokenBucketLimiter:
+    """
+    Token bucket на каждую пару (пользователь, действие).
+
+    limits: действие -> (емкость, токенов в секунду). Ведро хранится как
+    список [токены, время обновления, предупрежден], так что на активного
+    пользователя уходит O(1) памяти. Ведра упорядочены по последнему
+    обращению; ведро, которое простояло достаточно, чтобы наполниться
+    заново, ничем не отличается от нового и удаляется при следующих вызовах.
+    """
+
+    def __init__(self, limits, clock=time.monotonic):
+        self.limits = {action: limit for action, limit in limits.items() if limit is not None}
+        self.clock = clock
+        # (user_id, action) -> [tokens, updated_at, warned]
+        self._buckets = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _evict_idle(self, now):
+        # Смотрим только самые старые ведра, поэтому в среднем это O(1) на вызов
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            capacity, rate = self.limits[key[1]]
+            if now - bucket[1] < (capacity - bucket[0]) / rate:
+                break
+            self._buckets.popitem(last=False)
+            self.evicted += 1
+
+    def hit(self, user_id, action):
+        """
+        Пытается потратить токен. Возвращает (разрешено, нужно предупредить):
+        предупреждаем только о первом отклоненном действии подряд
+        """
+        limit = self.limits.get(action)
+        if limit is None:
+            return True, False
+        capacity, rate = limit
+        now = self.clock()
+        self._evict_idle(now)
+
+        key = (user_id, action)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [capacity, now, False]
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True, False
+
+        warn = not bucket[2]
+        bucket[2] = True
+        return False, warn
+
+
+class RateLimitMiddleware(BaseMiddleware):
+    """
+    Отбрасывает слишком частые сообщения и нажатия кнопок.
+
+    Лишние нажатия не ставятся в очередь: колбэк сразу закрывается
+    подсказкой, а обработчик (и запрос к GigaChat) не вызывается.
+    Действие колбэка - его callback_data, если для нее задан отдельный
+    лимит, иначе "callback"; для сообщений - "message".
+    """
+
+    def __init__(self, limiter, message="⏳ Слишком часто, подожди немного"):
+        self.limiter = limiter
+        self.message = message
+
+    def _action(self, event):
+        if isinstance(event, CallbackQuery):
+            return event.data if event.data in self.limiter.limits else 'callback'
+        return 'message'
+
+    async def __call__(self, handler, event, data):
+        user = getattr(event, 'from_user', None)
+        if user is None:
+            return await handler(event, data)
+
+        action = self._action(event)
+        allowed, warn = self.limiter.hit(user.id, action)
+        if allowed:
+            return await handler(event, data)
+
+        RATE_LIMITED.inc(action=action)
+        if isinstance(event, CallbackQuery):
+            # Колбэк нужно закрыть в любом случае, иначе кнопка "зависнет"
+            await event.answer(self.message)
+        elif warn and isinstance(event, Message):
+            await event.answer(self.message)
+        return None
@@ -0,0 +1,177 @@
+from blobs import decode_blob, delete_orphans
+from fulltext import unindex_rows
+
+# Имя, под которым архивная база подключается к базе истории (ATTACH)
+ARCHIVE = 'archive'
+
+# Архив - та же история без превью и поискового индекса. Тела копируются
+# из blobs как есть (уже сжатые и без дублей), распаковывать их не нужно
+ARCHIVE_SCHEMA = (
+    f'''
+    CREATE TABLE IF NOT EXISTS {ARCHIVE}.blobs (
+        hash BLOB PRIMARY KEY,
+        size INTEGER NOT NULL,
+        codec INTEGER NOT NULL,
+        data BLOB NOT NULL
+    )
+    ''',
+    f'''
+    CREATE TABLE IF NOT EXISTS {ARCHIVE}.history (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        request_type TEXT NOT NULL,
+        input_hash BLOB NOT NULL,
+        output_hash BLOB NOT NULL
+    )
+    ''',
+    f'CREATE INDEX IF NOT EXISTS {ARCHIVE}.idx_archive_user_date ON history (user_id, date)',
+    f'CREATE INDEX IF NOT EXISTS {ARCHIVE}.idx_archive_input_hash ON history (input_hash)',
+    f'CREATE INDEX IF NOT EXISTS {ARCHIVE}.idx_archive_output_hash ON history (output_hash)',
+)
+
+
+def attach_archive(conn, path):
+    """
+    Подключает архивную базу к соединению истории и создает в ней таблицы
+    """
+    conn.execute(f'ATTACH DATABASE ? AS {ARCHIVE}', (path,))
+    conn.execute(f'PRAGMA {ARCHIVE}.journal_mode=WAL')
+    with conn:
+        for statement in ARCHIVE_SCHEMA:
+            conn.execute(statement)
+
+
+def expired_ids(conn, before, limit):
+    """
+    id самых старых записей с датой раньше before (ISO), не больше limit.
+
+    Записи добавляются по времени, поэтому берем первые limit строк по id и
+    останавливаемся на первой свежей: запрос читает только то, что удалит,
+    и не сканирует таблицу, когда старых записей нет
+    """
+    ids = []
+    for record_id, date in conn.execute('SELECT id, date FROM history ORDER BY id LIMIT ?', (limit,)):
+        if date >= before:
+            break
+        ids.append(record_id)
+    return ids
+
+
+def users_page(conn, after_user, limit):
+    """
+    Следующие limit пользователей после after_user с числом их записей -
+    для обхода всей истории по частям (по индексу idx_history_user_date)
+    """
+    return conn.execute('''
+        SELECT user_id, COUNT(*) FROM history
+        WHERE user_id > ?
+        GROUP BY user_id
+        ORDER BY user_id
+        LIMIT ?
+    ''', (after_user, limit)).fetchall()
+
+
+def last_id(conn):
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM history').fetchone()[0]
+
+
+def recent_users(conn, after_id, limit):
+    """
+    Пользователи записей с id больше after_id (не больше limit записей) и
+    id последней из них (None, если новых записей нет). Видит записи всех
+    процессов, которые пишут в эту базу
+    """
+    rows = conn.execute('SELECT id, user_id FROM history WHERE id > ? ORDER BY id LIMIT ?',
+                        (after_id, limit)).fetchall()
+    return {row[1] for row in rows}, rows[-1][0] if rows else None
+
+
+def over_cap_ids(conn, user_id, max_rows, limit):
+    """
+    id самых старых записей пользователя сверх max_rows, не больше limit
+    """
+    count, = conn.execute('SELECT COUNT(*) FROM history WHERE user_id = ?', (user_id,)).fetchone()
+    if count <= max_rows:
+        return []
+    rows = conn.execute('''
+        SELECT id FROM history
+        WHERE user_id = ?
+        ORDER BY date, id
+        LIMIT ?
+    ''', (user_id, min(count - max_rows, limit))).fetchall()
+    return [row[0] for row in rows]
+
+
+def retire_rows(conn, ids, archive=False):
+    """
+    Переносит записи ids в архив (если он подключен) и удаляет их из истории
+    вместе с записями поискового индекса и телами, на которые больше никто не
+    ссылается. Одна короткая транзакция; BEGIN IMMEDIATE, чтобы два процесса
+    не удалили одну запись дважды (повторное удаление из contentless FTS5
+    портит индекс). Возвращает, сколько записей удалено
+    """
+    if not ids:
+        return 0
+    placeholders = ', '.join('?' * len(ids))
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Записи перечитываются в транзакции: другой процесс мог успеть удалить часть из них
+        rows = conn.execute(f'''
+            SELECT h.id, h.user_id, h.input_hash, h.output_hash, i.codec, i.data, o.codec, o.data
+            FROM history h
+            JOIN blobs i ON i.hash = h.input_hash
+            JOIN blobs o ON o.hash = h.output_hash
+            WHERE h.id IN ({placeholders})
+        ''', ids).fetchall()
+        if rows:
+            ids = [row[0] for row in rows]
+            placeholders = ', '.join('?' * len(ids))
+            hashes = [digest for row in rows for digest in (row[2], row[3])]
+            if archive:
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO {ARCHIVE}.blobs (hash, size, codec, data)
+                    SELECT hash, size, codec, data FROM main.blobs WHERE hash IN ({', '.join('?' * len(hashes))})
+                ''', hashes)
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO {ARCHIVE}.history (id, user_id, date, request_type, input_hash, output_hash)
+                    SELECT id, user_id, date, request_type, input_hash, output_hash
+                    FROM main.history WHERE id IN ({placeholders})
+                ''', ids)
+            unindex_rows(conn, [
+                (row[0], row[1], decode_blob(row[4], row[5]), decode_blob(row[6], row[7])) for row in rows
+            ])
+            conn.execute(f'DELETE FROM history WHERE id IN ({placeholders})', ids)
+            delete_orphans(conn, hashes)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(rows)
+
+
+def clear_archive(conn, user_id):
+    """
+    Удаляет из архива записи пользователя и тела, на которые в архиве
+    больше никто не ссылается. Выполняется внутри транзакции вызывающего
+    """
+    hashes = [digest for row in conn.execute(
+        f'SELECT input_hash, output_hash FROM {ARCHIVE}.history WHERE user_id = ?', (user_id,)
+    ) for digest in row]
+    conn.execute(f'DELETE FROM {ARCHIVE}.history WHERE user_id = ?', (user_id,))
+    conn.executemany(f'''
+        DELETE FROM {ARCHIVE}.blobs
+        WHERE hash = ?
+          AND NOT EXISTS (SELECT 1 FROM {ARCHIVE}.history WHERE input_hash = blobs.hash)
+          AND NOT EXISTS (SELECT 1 FROM {ARCHIVE}.history WHERE output_hash = blobs.hash)
+    ''', [(digest,) for digest in set(hashes)])
+
+
+def incremental_vacuum(conn, pages):
+    """
+    Возвращает ОС до pages свободных страниц файла. Работает только в
+    базе с auto_vacuum=INCREMENTAL; возвращает, сколько свободных страниц осталось
+    """
+    # execute() выполняет только первый шаг прагмы (одну страницу), executescript - до конца
+    conn.executescript(f'PRAGMA incremental_vacuum({int(pages)})')
+    return conn.execute('PRAGMA freelist_count').fetchone()[0]
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+
+class _Job:
+    __slots__ = ('user_id', 'key', 'factory', 'future', 'on_position', 'position')
+
+    def __init__(self, user_id, key, factory, future, on_position):
+        self.user_id = user_id
+        self.key = key
+        self.factory = factory
+        self.future = future
+        self.on_position = on_position
+        self.position = 0
+
+
+class GenerationScheduler:
+    """
+    Планировщик запросов к GigaChat.
+
+    Ограничивает число одновременных генераций, а ожидающие задачи раздает
+    по очереди каждому пользователю (round-robin по user_id), чтобы один
+    активный пользователь не занимал всю очередь. Одинаковые запросы одного
+    пользователя, которые уже ждут или выполняются, не дублируются: второй
+    вызов получает результат первого.
+    """
+
+    def __init__(self, max_concurrent=8):
+        self.max_concurrent = max_concurrent
+        self._running = 0
+        # user_id -> очередь задач; порядок ключей - порядок обхода round-robin
+        self._queues = OrderedDict()
+        # (user_id, key) -> future задачи, которая ждет или выполняется
+        self._jobs = {}
+        self._tasks = set()
+
+        self.completed = 0
+        self.coalesced = 0
+        self.max_queue_depth = 0
+
+    @property
+    def running(self):
+        return self._running
+
+    @property
+    def queue_depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self):
+        return {
+            'running': self._running,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'completed': self.completed,
+            'coalesced': self.coalesced,
+        }
+
+    async def run(self, user_id, key, factory, on_position=None):
+        """
+        Выполняет factory() (корутинную функцию), когда до нее дойдет очередь.
+
+        key определяет одинаковые запросы пользователя. on_position - корутинная
+        функция, которую вызываем с номером в очереди, пока задача ждет.
+        """
+        job_key = (user_id, key)
+        existing = self._jobs.get(job_key)
+        if existing is not None:
+            self.coalesced += 1
+            return await asyncio.shield(existing)
+
+        future = asyncio.get_running_loop().create_future()
+        # Результат может никому не понадобиться, если вызывающий отменен
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._jobs[job_key] = future
+        job = _Job(user_id, key, factory, future, on_position)
+
+        if self._running < self.max_concurrent and not self._queues:
+            self._start(job)
+        else:
+            self._queues.setdefault(user_id, deque()).append(job)
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            self._update_positions()
+
+        return await asyncio.shield(future)
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _start(self, job):
+        self._running += 1
+        self._spawn(self._execute(job))
+
+    async def _execute(self, job):
+        try:
+            result = await job.factory()
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            job.future.set_result(result)
+        finally:
+            self._jobs.pop((job.user_id, job.key), None)
+            self._running -= 1
+            self.completed += 1
+            self._dispatch()
+
+    def _dispatch(self):
+        started = False
+        while self._running < self.max_concurrent and self._queues:
+            user_id, queue = self._queues.popitem(last=False)
+            job = queue.popleft()
+            if queue:
+                # Пользователь уходит в конец круга
+                self._queues[user_id] = queue
+            self._start(job)
+            started = True
+
+        if started:
+            self._update_positions()
+
+    def _update_positions(self):
+        # Порядок запуска при round-robin: сначала первые задачи всех
+        # пользователей по кругу, затем вторые и так далее
+        queues = list(self._queues.values())
+        position = 0
+        depth = 0
+        while True:
+            found = False
+            for queue in queues:
+                if depth < len(queue):
+                    found = True
+                    position += 1
+                    job = queue[depth]
+                    if job.position != position:
+                        job.position = position
+                        self._notify(job)
+            if not found:
+                break
+            depth += 1
+
+    def _notify(self, job):
+        if job.on_position is None:
+            return
+        task = self._spawn(job.on_position(job.position))
+        task.add_done_callback(self._log_notify_error)
+
+    @staticmethod
+    def _log_notify_error(task):
+        if not task.cancelled() and task.exception() is not None:
+            logging.warning("Не удалось показать позицию в очереди: %s", task.exception())
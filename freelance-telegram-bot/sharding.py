@@ -0,0 +1,225 @@
+"""
+Многопроцессный режим: один процесс получает апдейты, N воркеров их обрабатывают.
+
+Фронт забирает апдейты через getUpdates и раскладывает их по воркерам по
+user_id, поэтому все апдейты одного пользователя попадают в один процесс и
+обрабатываются в порядке поступления - состояние FSM не перемешивается.
+Каждый воркер импортирует main и запускает те же обработчики, что и обычный бот.
+По умолчанию воркеры порождаются через forkserver, который один раз заранее
+импортирует main (aiogram импортируется несколько секунд), а воркеры получают
+уже загруженные модули. WORKER_START_METHOD=spawn - каждый воркер с нуля.
+
+Запуск:
+    BOT_WORKERS=4 python sharding.py
+
+При SIGINT/SIGTERM фронт перестает брать новые апдейты, подтверждает уже
+полученные и ждет, пока воркеры доделают начатое и закроют базы.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "") or "https://api.telegram.org"
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "0")) or os.cpu_count() or 1
+# Сколько апдейтов может ждать в очереди одного воркера, дальше фронт притормаживает
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+# Сколько секунд ждать воркеры при остановке, прежде чем завершить их принудительно
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "60"))
+# Как порождать воркеры: forkserver (main импортируется один раз) или spawn
+WORKER_START_METHOD = os.getenv("WORKER_START_METHOD", "forkserver")
+POLL_TIMEOUT = 30
+
+logging.basicConfig(level=logging.INFO)
+
+
+# Пользователь, к которому относится апдейт (для сообщений, колбэков и т.д.)
+def update_user_id(update):
+    for name, event in update.items():
+        if name == 'update_id' or not isinstance(event, dict):
+            continue
+        user = event.get('from') or event.get('user') or event.get('chat')
+        if isinstance(user, dict) and 'id' in user:
+            return user['id']
+    return 0
+
+
+def shard_for(update, workers):
+    return update_user_id(update) % workers
+
+
+# ---------- воркер ----------
+
+def run_worker(index, workers, updates):
+    # Останавливает воркеры фронт: сигналы от терминала или systemd приходят
+    # всей группе процессов, а воркер должен сначала доделать начатое
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    # У каждого воркера свой /metrics: METRICS_PORT + 1 + номер воркера
+    # (main мог быть импортирован заранее в forkserver, поэтому порт передается явно)
+    metrics_port = int(os.getenv("METRICS_PORT", "9100"))
+    asyncio.run(worker(index, workers, updates, metrics_port + 1 + index if metrics_port else 0))
+
+
+async def process_update(app, update, previous):
+    # Ждем предыдущий апдейт этого пользователя, чтобы сохранить порядок
+    if previous is not None:
+        await asyncio.wait([previous])
+    try:
+        await app.dp.feed_raw_update(app.bot, update)
+    except Exception:
+        logging.exception("Ошибка при обработке апдейта %s", update.get('update_id'))
+
+
+async def worker(index, workers, updates, metrics_port=0):
+    """
+    Читает апдейты из очереди и обрабатывает их обработчиками из main.
+
+    Апдейты разных пользователей обрабатываются конкурентно, одного
+    пользователя - строго по очереди. None в очереди означает остановку.
+    """
+    import main as app
+
+    # Очередь фоновых задач у каждого воркера своя, иначе после перезапуска
+    # оставшиеся задачи выполнил бы каждый воркер
+    jobs_db_path = f"{app.JOBS_DB_PATH}.{index}" if app.JOBS_DB_PATH else None
+    # База истории общая: срок хранения соблюдает только воркер 0.
+    # Лимиты одновременных генераций и фоновых задач общие и делятся между воркерами
+    app.create_app(metrics_port_override=metrics_port, jobs_db_path=jobs_db_path, run_retention=index == 0,
+                   worker_index=index, workers=workers)
+    await app.dp.emit_startup(bot=app.bot)
+    logging.info("Воркер %s запущен (pid %s)", index, os.getpid())
+
+    loop = asyncio.get_running_loop()
+    # user_id -> задача последнего апдейта пользователя
+    tails = {}
+
+    def forget(user_id, task):
+        if tails.get(user_id) is task:
+            del tails[user_id]
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='worker-queue') as reader:
+        while True:
+            update = await loop.run_in_executor(reader, updates.get)
+            if update is None:
+                break
+            user_id = update_user_id(update)
+            task = asyncio.create_task(process_update(app, update, tails.get(user_id)))
+            tails[user_id] = task
+            task.add_done_callback(lambda done, user_id=user_id: forget(user_id, done))
+
+    # Дожидаемся апдейтов, которые уже взяли в работу
+    if tails:
+        await asyncio.wait(list(tails.values()))
+    await app.dp.emit_shutdown(bot=app.bot)
+    await app.bot.session.close()
+    logging.info("Воркер %s остановлен", index)
+
+
+# ---------- фронт ----------
+
+async def call_api(session, method, **params):
+    async with session.post(f"{TELEGRAM_API_URL.rstrip('/')}/bot{BOT_TOKEN}/{method}", json=params) as response:
+        payload = await response.json()
+    if not payload.get('ok'):
+        raise RuntimeError(f"{method}: {payload.get('description')}")
+    return payload['result']
+
+
+async def dispatch(update, queues):
+    target = queues[shard_for(update, len(queues))]
+    try:
+        target.put_nowait(update)
+    except queue.Full:
+        # Воркер не успевает - ждем место в его очереди, не блокируя event loop
+        await asyncio.get_running_loop().run_in_executor(None, target.put, update)
+
+
+async def poll(queues, processes, stop):
+    offset = None
+    timeout = aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        await call_api(session, 'deleteWebhook')
+
+        while not stop.is_set():
+            dead = [index for index, process in enumerate(processes) if not process.is_alive()]
+            if dead:
+                logging.error("Воркеры %s завершились, останавливаем бота", dead)
+                break
+
+            params = {'timeout': POLL_TIMEOUT}
+            if offset is not None:
+                params['offset'] = offset
+            request = asyncio.create_task(call_api(session, 'getUpdates', **params))
+            stopping = asyncio.create_task(stop.wait())
+            await asyncio.wait({request, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            stopping.cancel()
+            if not request.done():
+                request.cancel()
+                break
+
+            try:
+                updates = request.result()
+            except Exception as e:
+                logging.warning("Не удалось получить апдейты: %s", e)
+                await asyncio.sleep(1)
+                continue
+
+            for update in updates:
+                await dispatch(update, queues)
+                offset = update['update_id'] + 1
+
+        # Подтверждаем отданные воркерам апдейты, чтобы после перезапуска
+        # Telegram не прислал их повторно
+        if offset is not None:
+            try:
+                await call_api(session, 'getUpdates', offset=offset, timeout=0, limit=1)
+            except Exception as e:
+                logging.warning("Не удалось подтвердить апдейты: %s", e)
+
+
+async def front(workers):
+    context = multiprocessing.get_context(WORKER_START_METHOD)
+    if WORKER_START_METHOD == 'forkserver':
+        context.set_forkserver_preload(['main'])
+    queues = [context.Queue(maxsize=WORKER_QUEUE_SIZE) for _ in range(workers)]
+    processes = [
+        context.Process(target=run_worker, args=(index, workers, queues[index]), name=f'bot-worker-{index}')
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logging.info("Бот запущен: %s воркеров", workers)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await poll(queues, processes, stop)
+    finally:
+        logging.info("Останавливаем воркеры...")
+        for worker_queue, process in zip(queues, processes):
+            if process.is_alive():
+                await loop.run_in_executor(None, worker_queue.put, None)
+        deadline = loop.time() + WORKER_DRAIN_TIMEOUT
+        for process in processes:
+            await loop.run_in_executor(None, process.join, max(0.0, deadline - loop.time()))
+            if process.is_alive():
+                logging.warning("Воркер %s не успел остановиться, завершаем", process.name)
+                process.kill()
+                process.join()
+
+
+if __name__ == '__main__':
+    asyncio.run(front(BOT_WORKERS))
@@ -0,0 +1,192 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+# Маркер, который показываем в конце текста, пока ответ еще генерируется
+CURSOR = " ▌"
+
+# Максимальная длина текста одного сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+# Где резать длинный текст, по убыванию предпочтения: абзацы, строки, предложения, слова
+SPLIT_LEVELS = (
+    (("\n\n", 0),),
+    (("\n", 0),),
+    ((". ", 1), ("! ", 1), ("? ", 1), ("… ", 1)),
+    ((" ", 0),),
+)
+
+
+class EditThrottle:
+    """
+    Ограничивает частоту edit_text в одном чате, чтобы не упираться
+    в лимиты Telegram на редактирование сообщений
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._last_edit = {}
+
+    def delay(self, chat_id):
+        """
+        Сколько секунд нужно подождать до следующего редактирования в чате
+        """
+        elapsed = time.monotonic() - self._last_edit.get(chat_id, 0.0)
+        return max(0.0, self.interval - elapsed)
+
+    def mark(self, chat_id):
+        self._last_edit[chat_id] = time.monotonic()
+
+    def forget(self, chat_id):
+        self._last_edit.pop(chat_id, None)
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    """
+    Делит текст на части не длиннее limit по границам абзацев, строк,
+    предложений или слов (а если их нет - просто по limit символов).
+    Части короче половины limit не получаются, если есть граница подальше
+    """
+    if len(text) <= limit:
+        return [text]
+
+    parts = []
+    start = 0
+    while len(text) - start > limit:
+        end = start + limit
+        cut = None
+        for level in SPLIT_LEVELS:
+            best = -1
+            for separator, keep in level:
+                position = text.rfind(separator, start + limit // 2, end)
+                if position != -1 and position + keep > best:
+                    best = position + keep
+                    skip = len(separator) - keep
+            if best != -1:
+                cut = best
+                break
+
+        if cut is None:
+            parts.append(text[start:end])
+            start = end
+        else:
+            parts.append(text[start:cut])
+            start = cut + skip
+    if start < len(text):
+        parts.append(text[start:])
+    return parts
+
+
+async def safe_send(message, text, reply_markup=None):
+    """
+    Отправляет сообщение в чат message, повторяя попытку после RetryAfter
+    """
+    while True:
+        try:
+            return await message.answer(text, reply_markup=reply_markup)
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+
+
+async def deliver(message, text, reply_markup=None, edit=False):
+    """
+    Выводит текст любой длины: делит его на сообщения по MESSAGE_LIMIT.
+
+    При edit=True первой частью заменяется текст message (например,
+    заглушки), остальные отправляются следом. Клавиатура прикрепляется к
+    последней части. Части отправляются по очереди, чтобы в чате они
+    шли в правильном порядке; при RetryAfter ждем и повторяем.
+    """
+    parts = split_message(text)
+    last = len(parts) - 1
+    for index, part in enumerate(parts):
+        markup = reply_markup if index == last else None
+        if index == 0 and edit:
+            await safe_edit(message, part, reply_markup=markup)
+        else:
+            await safe_send(message, part, reply_markup=markup)
+
+
+async def redeliver(message, text, old_parts, reply_markup=None):
+    """
+    Выводит новую версию ответа, последняя часть которого - message, а
+    всего в нем old_parts сообщений. Правка на месте меняет только message,
+    поэтому она возможна, лишь когда и старый, и новый ответ - одно
+    сообщение; иначе над новым текстом остались бы начальные части
+    старого, и новый ответ приходит новыми сообщениями
+    """
+    edit = old_parts == 1 and len(split_message(text)) == 1
+    await deliver(message, text, reply_markup=reply_markup, edit=edit)
+
+
+async def send_text(bot, chat_id, text, reply_markup=None):
+    """
+    Как deliver, но новым сообщением в chat_id - когда сообщения, на
+    которое можно ответить, нет (например, в фоновой задаче)
+    """
+    parts = split_message(text)
+    last = len(parts) - 1
+    for index, part in enumerate(parts):
+        while True:
+            try:
+                await bot.send_message(chat_id, part, reply_markup=reply_markup if index == last else None)
+                break
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+
+
+async def safe_edit(message, text, reply_markup=None):
+    """
+    Редактирует сообщение, повторяя попытку после RetryAfter
+    и игнорируя ошибку "message is not modified"
+    """
+    while True:
+        try:
+            await message.edit_text(text, reply_markup=reply_markup)
+            return
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return
+            raise
+
+
+async def stream_to_message(placeholder, chunks, title, throttle, reply_markup=None):
+    """
+    Постепенно дописывает текст из chunks в сообщение placeholder.
+
+    Промежуточные правки делаются не чаще, чем позволяет throttle. Пока идет
+    генерация, в сообщении видно только то, что помещается в одно сообщение
+    Telegram; в конце полный ответ выводится через deliver - при
+    необходимости несколькими сообщениями, клавиатура у последнего.
+    Возвращает полный текст ответа (пустую строку, если ничего не пришло).
+    """
+    chat_id = placeholder.chat.id
+    parts = []
+    shown = 0
+    # Сколько символов ответа помещается в промежуточную правку
+    preview_limit = MESSAGE_LIMIT - len(title) - len(CURSOR)
+
+    try:
+        async for chunk in chunks:
+            parts.append(chunk)
+            # Превью уже заполнено до лимита - до конца генерации его не трогаем
+            if shown < preview_limit and throttle.delay(chat_id) == 0:
+                throttle.mark(chat_id)
+                preview = "".join(parts)[:preview_limit]
+                shown = len(preview)
+                await safe_edit(placeholder, title + preview + CURSOR)
+
+        response = "".join(parts)
+        if not response:
+            return response
+
+        # Финальная правка тоже должна уложиться в лимит
+        await asyncio.sleep(throttle.delay(chat_id))
+        throttle.mark(chat_id)
+        await deliver(placeholder, title + response, reply_markup=reply_markup, edit=True)
+        return response
+    finally:
+        throttle.forget(chat_id)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули бота лежат в родительском каталоге и импортируются без пакета, как в bench/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import main
+from flows import FLOWS
+
+
+class FakeMessage:
+    """
+    Сообщение пользователя без бота: answer() только запоминает ответы.
+    text=None - фото, стикер или голосовое
+    """
+
+    def __init__(self, text=None):
+        self.text = text
+        self.answers = []
+
+    async def answer(self, text, reply_markup=None):
+        self.answers.append(text)
+
+
+def make_state():
+    return FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+
+
+@pytest.fixture
+def no_generation(monkeypatch):
+    async def generate_flow(*args):
+        raise AssertionError("сообщение без текста не должно доходить до генерации")
+    monkeypatch.setattr(main, "generate_flow", generate_flow)
+
+
+@pytest.mark.parametrize("flow, step", [(flow, step) for flow in FLOWS for step in range(len(flow.steps))],
+                         ids=lambda value: value.request_type if hasattr(value, "request_type") else str(value))
+def test_non_text_message_repeats_question(no_generation, flow, step):
+    async def run():
+        state = make_state()
+        await state.set_state(flow.steps[step].state)
+        earlier = {previous.field: "текст" for previous in flow.steps[:step]}
+        await state.update_data(earlier)
+
+        message = FakeMessage()
+        await main.process_flow_step(message, state, flow, step)
+
+        assert len(message.answers) == 1
+        assert flow.steps[step].question in message.answers[0]
+        # Шаг не пройден и в FSM не попало None
+        assert await state.get_state() == flow.steps[step].state.state
+        assert await state.get_data() == earlier
+
+    asyncio.run(run())
+
+
+def test_vacancy_flow_continues_after_non_text_message(monkeypatch):
+    generated = []
+
+    async def generate_flow(message, state, flow, values):
+        generated.append(values)
+    monkeypatch.setattr(main, "generate_flow", generate_flow)
+
+    flow = FLOWS[0]
+    assert flow.request_type == "vacancy_response"
+
+    async def run():
+        state = make_state()
+        await state.set_state(flow.steps[0].state)
+        for step, text in ((0, None), (0, "Ищем python"), (1, None), (1, "Умею python")):
+            await main.process_flow_step(FakeMessage(text), state, flow, step)
+
+    asyncio.run(run())
+    assert generated == [{"vacancy": "Ищем python", "skills": "Умею python"}]
@@ -0,0 +1,85 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from history import HistoryStore
+
+
+def busy_error():
+    error = sqlite3.OperationalError('database is locked')
+    error.sqlite_errorcode = sqlite3.SQLITE_BUSY
+    return error
+
+
+def test_add_rejects_bad_row_before_buffer(tmp_path):
+    async def run():
+        store = HistoryStore(str(tmp_path / 'history.db'), batch_size=2)
+        await store.init()
+        await store.add(1, 'short_text', 'запрос', 'ответ')
+        with pytest.raises(TypeError):
+            await store.add(2, 'short_text', None, 'ответ')
+        with pytest.raises(UnicodeEncodeError):
+            await store.add(3, 'short_text', 'битый \ud83d', 'ответ')
+        # Плохие строки не попали в пачку и не сорвали запись чужой строки
+        await store.add(4, 'short_text', 'запрос', 'ответ')
+        assert store.stats()['rows_flushed'] == 2
+        assert [row[1] for row in (await store.get_history_page(1))[0]] == [1]
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_batch_is_retried_after_busy_database(tmp_path):
+    async def run():
+        store = HistoryStore(str(tmp_path / 'history.db'), batch_size=3, flush_interval=0.01)
+        await store.init()
+        write_batch = store._write_batch
+        failures = [busy_error(), busy_error()]
+
+        def flaky_write_batch(rows):
+            if failures:
+                raise failures.pop()
+            return write_batch(rows)
+
+        store._write_batch = flaky_write_batch
+        for user_id in range(1, 4):
+            await store.add(user_id, 'short_text', f'запрос {user_id}', 'ответ')
+        while store.queue_depth:
+            await asyncio.sleep(0.05)
+
+        stats = store.stats()
+        assert stats['write_retries'] == 2
+        assert stats['rows_flushed'] == 3
+        assert stats['rows_dropped'] == 0
+        for user_id in range(1, 4):
+            assert len((await store.get_history_page(user_id))[0]) == 1
+        await store.close()
+
+    asyncio.run(run())
+
+
+def test_close_retries_last_batch(tmp_path):
+    path = str(tmp_path / 'history.db')
+
+    async def run():
+        store = HistoryStore(path, batch_size=50)
+        await store.init()
+        write_batch = store._write_batch
+        failures = [busy_error()]
+
+        def flaky_write_batch(rows):
+            if failures:
+                raise failures.pop()
+            return write_batch(rows)
+
+        store._write_batch = flaky_write_batch
+        await store.add(1, 'short_text', 'запрос', 'ответ')
+        await store.close()
+        return store.stats()
+
+    stats = asyncio.run(run())
+    assert stats['rows_dropped'] == 0
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT COUNT(*) FROM history').fetchone()[0] == 1
+    conn.close()
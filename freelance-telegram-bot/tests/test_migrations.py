@@ -0,0 +1,68 @@
+import sqlite3
+
+import migrations
+from blobs import decode_blob
+from migrations import migrate, schema_version
+
+# Таблица истории в том виде, в каком ее создавали до версионированных миграций
+BASELINE_SCHEMA = '''
+    CREATE TABLE history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        request_type TEXT NOT NULL,
+        input_data TEXT NOT NULL,
+        output_data TEXT NOT NULL
+    )
+'''
+
+
+def baseline_rows(count):
+    # Длинные повторяющиеся тексты сжимаются, одинаковые ответы хранятся один раз
+    return [
+        (i % 3 + 1, f'2024-01-01T00:{i // 60:02d}:{i % 60:02d}', 'short_text',
+         f'запрос метка{i} ' + 'опыт ' * (i % 50), 'общий ответ ' * 100 if i % 2 else f'ответ {i}')
+        for i in range(count)
+    ]
+
+
+def test_baseline_database_migrates_to_current_schema(tmp_path, monkeypatch):
+    # Несколько проходов по MIGRATION_BATCH строк, как на большой базе
+    monkeypatch.setattr(migrations, 'MIGRATION_BATCH', 7)
+    rows = baseline_rows(40)
+    conn = sqlite3.connect(tmp_path / 'history.db')
+    conn.execute(BASELINE_SCHEMA)
+    conn.executemany(
+        'INSERT INTO history (user_id, date, request_type, input_data, output_data) VALUES (?, ?, ?, ?, ?)', rows
+    )
+    conn.commit()
+
+    assert migrate(conn) == len(migrations.MIGRATIONS)
+    assert schema_version(conn) == len(migrations.MIGRATIONS)
+
+    migrated = conn.execute('''
+        SELECT h.user_id, h.date, h.request_type, i.codec, i.data, o.codec, o.data
+        FROM history h
+        JOIN blobs i ON i.hash = h.input_hash
+        JOIN blobs o ON o.hash = h.output_hash
+        ORDER BY h.id
+    ''').fetchall()
+    assert [
+        (row[0], row[1], row[2], decode_blob(row[3], row[4]), decode_blob(row[5], row[6])) for row in migrated
+    ] == rows
+    # Одинаковые ответы лежат в blobs один раз
+    assert conn.execute('SELECT COUNT(*) FROM blobs').fetchone()[0] == len(rows) + len(rows) // 2 + 1
+
+    conn.execute("INSERT INTO history_fts (history_fts, rank) VALUES ('integrity-check', 1)")
+    for user_id in (1, 2, 3):
+        found = conn.execute('SELECT COUNT(*) FROM history_fts WHERE history_fts MATCH ?',
+                             (f'user:u{user_id}',)).fetchone()[0]
+        assert found == sum(1 for row in rows if row[0] == user_id)
+    for i in (0, 7, 39):
+        found = conn.execute('SELECT rowid FROM history_fts WHERE history_fts MATCH ?', (f'input:метка{i}',)).fetchall()
+        assert found == [(i + 1,)]
+
+    # Повторный запуск ничего не меняет
+    assert migrate(conn) == len(migrations.MIGRATIONS)
+    assert conn.execute('SELECT COUNT(*) FROM history').fetchone()[0] == len(rows)
+    conn.close()
@@ -0,0 +1,106 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+
+from history import HistoryStore
+
+
+def check_index(conn):
+    """
+    Индекс history_fts цел и находит ровно записи, оставшиеся в истории
+    """
+    conn.execute("INSERT INTO history_fts (history_fts, rank) VALUES ('integrity-check', 1)")
+    for user_id, count in conn.execute('SELECT user_id, COUNT(*) FROM history GROUP BY user_id').fetchall():
+        found = conn.execute('SELECT COUNT(*) FROM history_fts WHERE history_fts MATCH ?',
+                             (f'user:u{user_id}',)).fetchone()[0]
+        assert found == count
+    ids = {row[0] for row in conn.execute('SELECT id FROM history')}
+    found = {row[0] for row in conn.execute("SELECT rowid FROM history_fts WHERE history_fts MATCH 'input:запрос'")}
+    assert found == ids
+
+
+def make_rows(users, per_user, first_day):
+    """
+    По per_user записей каждого пользователя, по одной в день начиная first_day
+    дней назад; тексты у всех записей разные
+    """
+    now = datetime.now()
+    return [
+        (user_id, (now - timedelta(days=first_day - day)).isoformat(), 'short_text',
+         f'запрос {user_id} {day} ' + 'опыт ' * 30, f'ответ {user_id} {day} ' + 'текст ' * 60)
+        for day in range(per_user) for user_id in users
+    ]
+
+
+def test_retention_archives_old_and_over_cap_rows(tmp_path):
+    path = str(tmp_path / 'history.db')
+    archive_path = str(tmp_path / 'archive.db')
+    # 10 записей каждого пользователя за последние 40 дней: 5 старше срока, из свежих 5 остается 3
+    rows = make_rows((1, 2, 3), 10, 40)
+
+    async def run():
+        # Маленький retention_batch: очистка идет несколькими пачками
+        store = HistoryStore(path, max_rows_per_user=3, max_age_days=35.5, archive_path=archive_path,
+                             retention_batch=4)
+        await store.init()
+        await store._db.run(store._write_batch, rows)
+        retired = await store.apply_retention()
+        again = await store.apply_retention()
+        found = (await store.search(1, 'запрос', limit=10))[0]
+        await store.close()
+        return retired, again, found
+
+    retired, again, found = asyncio.run(run())
+    assert retired == 21
+    assert again == 0
+    assert len(found) == 3
+
+    conn = sqlite3.connect(path)
+    kept = conn.execute('SELECT id, user_id, date FROM history ORDER BY id').fetchall()
+    # У каждого пользователя остались 3 самые новые записи
+    assert [row[0] for row in kept] == list(range(len(rows) - 8, len(rows) + 1))
+    check_index(conn)
+    assert conn.execute('''
+        SELECT COUNT(*) FROM blobs
+        WHERE hash NOT IN (SELECT input_hash FROM history UNION SELECT output_hash FROM history)
+    ''').fetchone()[0] == 0
+    conn.close()
+
+    archive = sqlite3.connect(archive_path)
+    archived = archive.execute('SELECT id, user_id, date FROM history ORDER BY id').fetchall()
+    assert [row[0] for row in archived] == list(range(1, len(rows) - 8))
+    # Тела архивных записей переехали вместе с ними
+    assert archive.execute('''
+        SELECT COUNT(*) FROM history
+        WHERE input_hash NOT IN (SELECT hash FROM blobs) OR output_hash NOT IN (SELECT hash FROM blobs)
+    ''').fetchone()[0] == 0
+    assert archive.execute('SELECT COUNT(*) FROM blobs').fetchone()[0] == 2 * len(archived)
+    archive.close()
+
+
+def test_clear_removes_user_from_history_and_archive(tmp_path):
+    path = str(tmp_path / 'history.db')
+    archive_path = str(tmp_path / 'archive.db')
+    rows = make_rows((1, 2), 4, 4)
+
+    async def run():
+        store = HistoryStore(path, max_rows_per_user=2, archive_path=archive_path)
+        await store.init()
+        await store._db.run(store._write_batch, rows)
+        assert await store.apply_retention() == 4
+        await store.clear(1)
+        await store.close()
+
+    asyncio.run(run())
+
+    conn = sqlite3.connect(path)
+    assert conn.execute('SELECT user_id, COUNT(*) FROM history GROUP BY user_id').fetchall() == [(2, 2)]
+    assert conn.execute('SELECT COUNT(*) FROM blobs').fetchone()[0] == 4
+    check_index(conn)
+    assert conn.execute("SELECT COUNT(*) FROM history_fts WHERE history_fts MATCH 'user:u1'").fetchone()[0] == 0
+    conn.close()
+
+    archive = sqlite3.connect(archive_path)
+    assert archive.execute('SELECT user_id, COUNT(*) FROM history GROUP BY user_id').fetchall() == [(2, 2)]
+    assert archive.execute('SELECT COUNT(*) FROM blobs').fetchone()[0] == 4
+    archive.close()
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from streaming import MESSAGE_LIMIT, redeliver
+
+
+class FakeMessage:
+    """
+    Последнее сообщение ответа: запоминает правки и новые сообщения в чате
+    """
+
+    def __init__(self):
+        self.edits = []
+        self.sent = []
+
+    async def edit_text(self, text, reply_markup=None):
+        self.edits.append(text)
+
+    async def answer(self, text, reply_markup=None):
+        self.sent.append(text)
+
+
+# Около полутора лимитов: две части
+LONG_TEXT = 'слово ' * (MESSAGE_LIMIT // 4)
+
+
+@pytest.mark.parametrize('old_parts, text, edits, sent', [
+    # Оба ответа в одном сообщении - правка на месте
+    (1, 'новый ответ', 1, 0),
+    # Старый ответ из двух частей: правка оставила бы над новым текстом его первую часть
+    (2, 'новый ответ', 0, 1),
+    # Новый ответ не помещается в одно сообщение
+    (1, LONG_TEXT, 0, 2),
+], ids=['both-single', 'old-split', 'new-split'])
+def test_redeliver_edits_only_single_message_answers(old_parts, text, edits, sent):
+    message = FakeMessage()
+    asyncio.run(redeliver(message, text, old_parts))
+    assert len(message.edits) == edits
+    assert len(message.sent) == sent
+    assert ''.join(message.edits + message.sent).replace(' ', '') == text.replace(' ', '')
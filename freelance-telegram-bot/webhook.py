@@ -0,0 +1,41 @@
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+def create_webhook_app(dp, bot, path='/webhook', secret_token=None):
+    """
+    aiohttp-приложение, которое принимает апдейты Telegram по HTTP.
+
+    Если задан secret_token, запросы без правильного заголовка
+    X-Telegram-Bot-Api-Secret-Token отклоняются с 401.
+    """
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret_token).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp, bot, host='0.0.0.0', port=8080, path='/webhook', secret_token=None, base_url=None):
+    """
+    Запускает HTTP-сервер для вебхука и работает, пока задачу не отменят.
+
+    Если задан base_url (публичный адрес бота), регистрирует вебхук в Telegram.
+    Без него считаем, что вебхук уже настроен снаружи (например, за балансировщиком).
+    """
+    app = create_webhook_app(dp, bot, path=path, secret_token=secret_token)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info("Вебхук слушает http://%s:%s%s", host, port, path)
+
+    if base_url:
+        await bot.set_webhook(f"{base_url.rstrip('/')}{path}", secret_token=secret_token)
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()